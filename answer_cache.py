@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Semantic cache of LLM answers keyed by query embedding.
+
+    A lookup hits when a stored query embedding has cosine similarity of at
+    least ``threshold`` with the new one and was answered against the same
+    index version. Entries expire after ``ttl`` seconds and the least
+    recently used entry is evicted once ``max_entries`` is reached.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._next_id = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector, index_version, scope=None):
+        query = self._unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now, index_version)
+            # Only answers drawn from the same set of documents are reusable
+            candidates = [(entry_id, entry) for entry_id, entry in self._entries.items()
+                          if entry['scope'] == scope]
+            if not candidates:
+                return None
+            matrix = np.stack([entry['vector'] for _, entry in candidates])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            entry_id, entry = candidates[best]
+            self._entries.move_to_end(entry_id)
+            logger.info(f"Answer cache hit (similarity {scores[best]:.3f})")
+            return entry
+
+    def store(self, vector, index_version, answer, sources, scope=None):
+        with self._lock:
+            self._entries[self._next_id] = {
+                'vector': self._unit(vector),
+                'index_version': index_version,
+                'scope': scope,
+                'answer': answer,
+                'sources': sources,
+                'created': time.monotonic()
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self, now, index_version):
+        # Answers from an older index version are stale as soon as it changes
+        stale = [entry_id for entry_id, entry in self._entries.items()
+                 if entry['index_version'] != index_version or now - entry['created'] > self.ttl]
+        for entry_id in stale:
+            del self._entries[entry_id]
+
+    def __len__(self):
+        return len(self._entries)
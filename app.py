@@ -1,19 +1,32 @@
-from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
+from flask import Flask, Request, request, jsonify, send_from_directory, Response, stream_with_context, g
 from flask_pymongo import PyMongo
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_uploads import UploadSet, configure_uploads, ALL
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
-import fitz  # PyMuPDF
 from datetime import timedelta, datetime
 import os
 import json
-import magic
-from model import final_result
-from datacreate import create_vector_db
-from config import init_app, Config
+import time
+import threading
+from model import open_answer, scheduler
+from scheduler import AdmissionError
+from datacreate import create_vector_db, delete_document
+from ingest import iter_pages
+from config import init_app, Config, UPLOAD_FOLDER
+from registry import registry
+from inference import InferenceClient, RemoteEmbeddings
+from jobs import IngestJobQueue, QueueFullError
+from records import BulkWriter, paginate
+from streams import ResumableStream, StreamStore, StreamGoneError
+from manifest import load_manifest, find_by_hash
+from shards import IndexMaintenance
+from storage import IncomingFile, clean_incoming, remove_stored
+from pymongo import ASCENDING, DESCENDING
+import metrics
+from metrics import Trace
 
 from dotenv import load_dotenv
 import logging
@@ -26,7 +39,20 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+class UploadRequest(Request):
+    """Streams files posted to /upload straight into the upload folder, hashing and sniffing them on the way.
+
+    Files the view does not ``store`` are deleted when the request closes.
+    Other routes keep werkzeug's temp-file spooling.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'upload_file':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return IncomingFile(UPLOAD_FOLDER)
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app = init_app(app)  # Initialize app configuration
 CORS(app, origins=["http://localhost:3000"])  # Allow requests from frontend
 
@@ -50,6 +76,63 @@ except Exception as e:
 
 jwt = JWTManager(app)
 
+# Indexes for keyset pagination (newest first, see records.paginate)
+try:
+    mongo.db.chat_history.create_index([('user', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)])
+    mongo.db.chat_history.create_index([('timestamp', DESCENDING), ('_id', DESCENDING)])
+    mongo.db.documents.create_index([('filename', ASCENDING)], unique=True)
+    mongo.db.documents.create_index([('indexed_at', DESCENDING), ('_id', DESCENDING)])
+except Exception as e:
+    logger.error(f"Error creating indexes: {str(e)}")
+
+# Query records and document listings are written in batches off the request path
+chat_writer = BulkWriter(mongo.db.chat_history, Config.RECORD_BATCH_SIZE, Config.RECORD_FLUSH_INTERVAL)
+document_writer = BulkWriter(mongo.db.documents, Config.RECORD_BATCH_SIZE, Config.RECORD_FLUSH_INTERVAL)
+
+def ingest_upload(filepath, filename, progress=None):
+    # filepath is always an upload this app stored as <sha256>.pdf (see store_upload)
+    previous = load_manifest()['documents'].get(filename)
+    success = create_vector_db(filepath, progress=progress, doc_id=filename)
+    if not success and os.path.exists(filepath):
+        os.remove(filepath)
+    if success:
+        manifest = load_manifest()
+        sha256 = os.path.splitext(os.path.basename(filepath))[0]
+        # A new version under the same name: the old bytes belong to no document now
+        if previous and find_by_hash(manifest, previous.get('sha256')) is None:
+            remove_stored(app.config['UPLOADS_DEFAULT_DEST'], previous.get('sha256'))
+        # The same bytes uploaded under another name meanwhile are indexed only
+        # once, under that name: record the document that holds them
+        entry = manifest['documents'].get(filename)
+        doc_id = filename if entry and entry.get('sha256') == sha256 else find_by_hash(manifest, sha256)
+        if doc_id is None:
+            logger.warning(f"{filename} was indexed but is no longer in the manifest")
+            return success
+        entry = manifest['documents'][doc_id]
+        # Filename -> content hash; the file itself is stored as <sha256>.pdf
+        document_writer.upsert({'filename': doc_id}, {
+            'filename': doc_id,
+            'sha256': entry.get('sha256'),
+            'chunks': entry.get('chunks'),
+            'pages': entry.get('pages'),
+            'indexed_at': datetime.utcnow()
+        })
+    return success
+
+# Compacts the global index after deletions and removes retired index files
+index_maintenance = IndexMaintenance(interval=Config.COMPACT_INTERVAL).start()
+
+# Answer streams kept for Last-Event-ID resumes
+answer_streams = StreamStore(retention=Config.STREAM_RETENTION)
+
+# Uploads are indexed by a bounded pool of background workers
+ingest_jobs = IngestJobQueue(
+    mongo.db.ingest_jobs,
+    ingest_upload,
+    workers=Config.INGEST_WORKERS,
+    max_pending=Config.INGEST_QUEUE_SIZE
+).start()
+
 # Error handlers
 @app.errorhandler(500)
 def handle_500_error(e):
@@ -62,6 +145,65 @@ def handle_404_error(e):
 # Ensure upload directory exists
 if not os.path.exists(app.config['UPLOADS_DEFAULT_DEST']):
     os.makedirs(app.config['UPLOADS_DEFAULT_DEST'])
+clean_incoming(app.config['UPLOADS_DEFAULT_DEST'])
+
+# With an inference sidecar, queries and embeddings are served by that one
+# process and this worker never loads the LLM or the embedding model
+inference_client = None
+if Config.INFERENCE_SOCKET:
+    inference_client = InferenceClient(Config.INFERENCE_SOCKET, connect_timeout=Config.INFERENCE_CONNECT_TIMEOUT)
+    registry.register('embeddings', lambda: RemoteEmbeddings(inference_client))
+    logger.info(f"Serving queries through the inference sidecar at {Config.INFERENCE_SOCKET}")
+elif Config.WARM_ON_STARTUP and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+    # Load models once per process. Skip the werkzeug reloader's parent process,
+    # which never serves requests and would otherwise hold a second copy of the LLM.
+    registry.warm_async(['embeddings', 'vectorstore', 'llm'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    # For streamed responses this is the time until the stream starts
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                             route=route, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/inference', methods=['GET'])
+def get_inference_metrics():
+    # Generation metrics of the inference sidecar, when there is one
+    if inference_client is None:
+        return jsonify(message="No inference sidecar configured"), 404
+    try:
+        text = inference_client.call({'op': 'metrics'}, timeout=Config.INFERENCE_CONNECT_TIMEOUT)['text']
+    except Exception as e:
+        logger.error(f"Error fetching inference metrics: {str(e)}")
+        return jsonify(message="Inference service unavailable"), 503
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+def health():
+    if inference_client is not None:
+        try:
+            status = inference_client.call({'op': 'status'}, timeout=Config.INFERENCE_CONNECT_TIMEOUT)
+        except Exception as e:
+            return jsonify(status="unavailable", inference=str(e)), 503
+        ready = all(status['resources'].get(name, {}).get('state') == 'ready'
+                    for name in ('embeddings', 'vectorstore', 'llm'))
+        return jsonify(status="ready" if ready else "unavailable", resources=status['resources'],
+                       scheduler=status['scheduler'], inference=Config.INFERENCE_SOCKET), 200 if ready else 503
+    resources = registry.status()
+    ready = registry.is_ready(['embeddings', 'vectorstore', 'llm'])
+    return jsonify(status="ready" if ready else "unavailable", resources=resources,
+                   scheduler=scheduler.status()), 200 if ready else 503
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -117,18 +259,58 @@ def login():
 # @jwt_required()
 def get_documents():
     try:
-        documents = list(mongo.db.documents.find({}, {'_id': False}))
-        return jsonify(documents)
+        cursor, limit = page_args()
+        documents, next_cursor = paginate(mongo.db.documents, {}, 'indexed_at', cursor, limit)
+        return page_response(documents, next_cursor)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+@app.route('/documents/<doc_id>', methods=['DELETE'])
+# @jwt_required()
+def remove_document(doc_id):
+    try:
+        entry = delete_document(doc_id)
+        if entry is None:
+            return jsonify(message="Document not found"), 404
+        # The search results stop including it at once; the index is compacted in the background
+        index_maintenance.notify()
+
+        # Only the copy this app stored; a document indexed from elsewhere keeps its file
+        if find_by_hash(load_manifest(), entry.get('sha256')) is None:
+            remove_stored(app.config['UPLOADS_DEFAULT_DEST'], entry.get('sha256'))
+        # Let a queued upsert for this document land before removing its record
+        document_writer.flush()
+        mongo.db.documents.delete_one({'filename': doc_id})
+        return jsonify(message="Document deleted", document=doc_id, chunks=entry.get('chunks')), 200
+    except Exception as e:
+        logger.error(f"Error deleting document {doc_id}: {str(e)}")
+        return jsonify(message="Error deleting document"), 500
+
+def page_args():
+    """Read ?cursor=&limit= for a paginated listing."""
+    limit = request.args.get('limit', Config.PAGE_SIZE, type=int)
+    if limit is None or limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return request.args.get('cursor') or None, min(limit, Config.MAX_PAGE_SIZE)
+
+def valid_documents(documents):
+    """Whether a request's optional ``documents`` is absent or a list of document ids."""
+    return documents is None or (isinstance(documents, list) and all(isinstance(doc_id, str) for doc_id in documents))
+
+def page_response(items, next_cursor):
+    # The body stays a plain list; the next page is advertised in headers
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?cursor={next_cursor}&limit={len(items)}>; rel="next"'
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def validate_file_type(file_stream):
-    file_head = file_stream.read(2048)
-    file_stream.seek(0)
-    mime_type = magic.from_buffer(file_head, mime=True)
+def validate_file_type(mime_type):
     logger.info(f"Detected MIME type: {mime_type}")
     # Fallback: accept application/octet-stream as a valid PDF mime type
     if mime_type == 'application/octet-stream':
@@ -151,96 +333,264 @@ def upload_file():
         if not file or not allowed_file(file.filename):
             return jsonify({"message": "Invalid file type. Only PDF files are allowed"}), 400
 
+        # Already on disk: UploadRequest hashed and sniffed it while the body was read
+        incoming = file.stream
+        if not validate_file_type(incoming.mime_type):
+            return jsonify({"message": "Invalid file type. Only PDF files are allowed"}), 400
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOADS_DEFAULT_DEST'], filename)
+        try:
+            job_id, existing = store_upload(incoming, filename)
+        except QueueFullError as e:
+            return jsonify({"message": str(e)}), 429, {"Retry-After": "30"}
 
-        # Save the file first
-        file.save(filepath)
+        if existing is not None:
+            return Response(already_indexed_events(existing, incoming.sha256), mimetype="text/event-stream")
 
-        # Reset file stream position for reading
-        file.seek(0)  # This prevents the "read of closed file" error
-        
         def generate():
-            try:
-                logger.info(f"File saved to {filepath}")
-
-                yield "data: " + json.dumps({"step": "upload", "status": "complete", "message": "PDF uploaded successfully"}) + "\n\n"
-                
-                yield "data: " + json.dumps({"step": "processing", "status": "inProgress", "message": "Processing PDF and extracting text..."}) + "\n\n"
-                
-                yield "data: " + json.dumps({"step": "embeddings", "status": "inProgress", "message": "Creating text embeddings using sentence transformers..."}) + "\n\n"
-                
-                # Create vector store
-                success = create_vector_db(filepath)
-                if not success:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    yield "data: " + json.dumps({"step": "vectordb", "status": "error", "message": "Failed to create vector database"}) + "\n\n"
-                    return
-                
-                yield "data: " + json.dumps({"step": "vectordb", "status": "complete", "message": "Vector database created successfully"}) + "\n\n"
-                
-            except Exception as e:
-                logger.error(f"Error during file processing: {str(e)}")
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                yield "data: " + json.dumps({"step": "error", "message": str(e)}) + "\n\n"
-        
+            yield "data: " + json.dumps({"step": "upload", "status": "complete", "message": "PDF uploaded successfully", "job_id": job_id}) + "\n\n"
+            yield from job_events(job_id)
+
         return Response(generate(), mimetype="text/event-stream")
 
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         return jsonify({"message": f"An error occurred: {str(e)}"}), 500
 
+def store_upload(incoming, filename):
+    """Keep an upload under its content hash and queue it for indexing.
+
+    Returns ``(job_id, existing_doc_id)``. Content that is already indexed
+    is not stored or indexed again (``job_id`` is None); content already
+    being indexed follows that job. Raises QueueFullError.
+    """
+    existing = find_by_hash(load_manifest(), incoming.sha256)
+    if existing is not None:
+        logger.info(f"{filename} is already indexed as {existing}")
+        return None, existing
+
+    filepath = str(incoming.store('.pdf'))
+    logger.info(f"File {filename} saved to {filepath}")
+    job_id = ingest_jobs.find_active(filepath)
+    if job_id is not None:
+        return job_id, None
+    try:
+        return ingest_jobs.submit(filepath, filename), None
+    except QueueFullError:
+        os.remove(filepath)
+        raise
+
+def already_indexed_events(doc_id, sha256):
+    yield "data: " + json.dumps({"step": "upload", "status": "complete", "message": "PDF uploaded successfully"}) + "\n\n"
+    yield "data: " + json.dumps({"step": "vectordb", "status": "complete", "message": "Document is already indexed",
+                                 "document": doc_id, "sha256": sha256}) + "\n\n"
+
+def job_events(job_id):
+    for event in ingest_jobs.stream(job_id):
+        yield job_frame(event)
+
+def job_frame(event):
+    if event is None:
+        return ": keepalive\n\n"
+    return "data: " + json.dumps(event, default=str) + "\n\n"
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+# @jwt_required()
+def get_job(job_id):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify(message="Job not found"), 404
+    job.pop('filepath', None)
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+# @jwt_required()
+def get_job_events(job_id):
+    if ingest_jobs.get(job_id) is None:
+        return jsonify(message="Job not found"), 404
+    return Response(job_events(job_id), mimetype="text/event-stream")
+
 @app.route('/chat-history', methods=['GET'])
 # @jwt_required()
 def get_chat_history():
     try:
+        verify_jwt_in_request(optional=True)
         claims = get_jwt()
         username = get_jwt_identity()
-        if claims.get('role') == 'admin':
-            # Admins can see all chat history
-            chat_history = list(mongo.db.chat_history.find({}, {'_id': 0}).sort('timestamp', -1))
-        else:
-            # Users can only see their own chat history
-            chat_history = list(mongo.db.chat_history.find(
-                {'user': username},
-                {'_id': 0}
-            ).sort('timestamp', -1))
-        
-        return jsonify(chat_history), 200
+        if username is None:
+            # Anonymous queries are all recorded under user None: none of them is the caller's
+            return jsonify(message="Authentication required"), 401
+        cursor, limit = page_args()
+        # Admins can see all chat history; users only their own
+        query = {} if claims.get('role') == 'admin' else {'user': username}
+        chat_history, next_cursor = paginate(mongo.db.chat_history, query, 'timestamp', cursor, limit)
+        return page_response(chat_history, next_cursor), 200
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
     except Exception as e:
         logger.error(f"Error fetching chat history: {str(e)}")
         return jsonify(message="Error fetching chat history"), 500
-        return jsonify(message="Error fetching chat history"), 500
 
 @app.route('/query', methods=['POST'])
 # @jwt_required()
 def query():
     try:
+        trace = Trace()
+        verify_jwt_in_request(optional=True)
+        username = get_jwt_identity()
         user_query = request.json.get('query')
-        
-        def generate():
-            for chunk in final_result(user_query, stream=True):
-                if chunk['type'] == 'token':
-                    yield f"data: {json.dumps({'type': 'token', 'text': chunk['token']})}\n\n"
-                
-            yield "data: {\"type\": \"done\"}\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream'
-        )
+        # Optional list of document ids to restrict retrieval to
+        documents = request.json.get('documents')
+        if not valid_documents(documents):
+            return jsonify(message="documents must be a list of document ids"), 400
+        documents = documents or None
+
+        # Cached answers skip the LLM entirely; everything else must be
+        # admitted by the scheduler (here or in the sidecar) before the stream starts
+        try:
+            stream = start_answer_stream(username, user_query, documents, trace)
+        except AdmissionError as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.status in (429, 503) else {}
+            return jsonify(message=str(e)), e.status, headers
+        return answer_response(stream)
     except Exception as e:
         logger.error(f"Query error: {str(e)}")
         return jsonify(message="Error processing query"), 500
 
+@app.route('/search', methods=['POST'])
+# @jwt_required()
+def search():
+    """Retrieval only: the top-k chunks for each of a batch of queries, without the LLM."""
+    body = request.get_json(silent=True) or {}
+    queries = body.get('queries')
+    k = body.get('k', Config.RETRIEVAL_K)
+    documents = body.get('documents')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify(message="queries must be a non-empty list of strings"), 400
+    if len(queries) > Config.SEARCH_MAX_QUERIES:
+        return jsonify(message=f"At most {Config.SEARCH_MAX_QUERIES} queries per request"), 400
+    # bool is an int subclass: k=true would otherwise pass as 1
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= Config.SEARCH_MAX_K:
+        return jsonify(message=f"k must be an integer between 1 and {Config.SEARCH_MAX_K}"), 400
+    if not valid_documents(documents):
+        return jsonify(message="documents must be a list of document ids"), 400
+    documents = documents or None
+
+    try:
+        trace = Trace()
+        # One encoder call and one FAISS search per index for the whole batch
+        with trace.span('search_embed'):
+            vectors = registry.get('embeddings').embed_documents(queries)
+        with trace.span('search_index'):
+            results = registry.get('vectorstore').search_batch(vectors, k, documents)
+    except KeyError as e:
+        return jsonify(message=str(e.args[0])), 400
+    except FileNotFoundError:
+        results = [[] for _ in queries]
+    except Exception as e:
+        logger.error(f"Search error: {str(e)}")
+        return jsonify(message="Error searching documents"), 500
+    return jsonify(results=[[search_hit(doc, distance) for doc, distance in hits] for hits in results],
+                   timings=trace.as_dict())
+
+def search_hit(doc, distance):
+    metadata = doc.metadata
+    return {
+        'text': doc.page_content,
+        # Embeddings are unit length, so squared L2 distance maps to cosine similarity
+        'score': round(1 - distance / 2, 6),
+        'document': metadata.get('doc_id') or os.path.basename(str(metadata.get('source', ''))),
+        'page': metadata.get('page'),
+        'chunk': metadata.get('chunk'),
+        'source': metadata.get('source')
+    }
+
+@app.route('/query/<stream_id>/events', methods=['GET'])
+# @jwt_required()
+def resume_query(stream_id):
+    stream = answer_streams.get(stream_id)
+    if stream is None:
+        return jsonify(message="Stream not found"), 404
+    after = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        after = int(after)
+        stream.check_resume(after)
+    except ValueError:
+        return jsonify(message="Invalid Last-Event-ID"), 400
+    except StreamGoneError as e:
+        return jsonify(message=str(e)), 410
+    return answer_response(stream, after)
+
+def start_answer_stream(username, user_query, documents, trace):
+    """Admit a query and start generating its answer; raises AdmissionError if rejected."""
+    cancel = threading.Event()
+    answer = inference_client.open_answer if inference_client is not None else open_answer
+    source, cached = answer(user_query, documents, trace, cancel)
+
+    # Generation runs in the background so that a client that drops can
+    # reconnect with Last-Event-ID and pick up where it left off
+    return answer_streams.add(ResumableStream(
+        source,
+        cancel,
+        flush_interval=Config.SSE_FLUSH_INTERVAL,
+        flush_chars=Config.SSE_FLUSH_CHARS,
+        replay_events=Config.STREAM_REPLAY_EVENTS,
+        grace=Config.STREAM_RESUME_GRACE,
+        on_finish=lambda finished: save_query_record(
+            username, user_query, ''.join(finished.answer), finished.sources, documents,
+            cached=cached, completed=finished.completed, trace=trace)
+    ).start())
+
+def answer_response(stream, after=0):
+    return Response(
+        stream_with_context(answer_events(stream, after)),
+        mimetype='text/event-stream',
+        headers={'X-Stream-Id': stream.id, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def answer_events(stream, after=0):
+    """SSE frames for an answer stream; each frame's id is a valid Last-Event-ID."""
+    if not after:
+        yield f"data: {json.dumps({'type': 'stream', 'stream_id': stream.id})}\n\n"
+    for frame in stream.frames(after):
+        text = answer_frame(frame)
+        if text:
+            yield text
+    yield "data: {\"type\": \"done\"}\n\n"
+
+def answer_frame(frame):
+    """SSE text for one ``ResumableStream`` frame (None for events clients don't see)."""
+    if frame is None:
+        return ": keepalive\n\n"
+    event_id, event = frame
+    if event['type'] == 'token':
+        payload = {'type': 'token', 'text': event['token']}
+    elif event['type'] == 'queue':
+        payload = {'type': 'queue', 'position': event['position']}
+    elif event['type'] == 'error':
+        payload = {'type': 'error', 'message': event['message']}
+    else:
+        return None
+    return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+
+def save_query_record(username, user_query, answer, sources, documents, cached, completed, trace):
+    """Queue the exchange, with its per-stage timings, for chat_history."""
+    try:
+        chat_writer.insert({
+            'user': username,
+            'query': user_query,
+            'answer': answer,
+            'sources': sources,
+            'documents': documents,
+            'cached': cached,
+            'completed': completed,
+            'timings': trace.as_dict(),
+            'timestamp': datetime.utcnow()
+        })
+    except Exception as e:
+        logger.error(f"Error saving query record: {str(e)}")
+
 def extract_text_from_pdf(filename):
-    text = ""
-    with fitz.open(filename) as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+    return "".join(text for _, text in iter_pages(filename))
 
 # def create_vector_db(filepath):
 #     try:
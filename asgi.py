@@ -0,0 +1,212 @@
+"""Asyncio serving mode: the streaming routes run on an event loop, the rest on Flask.
+
+    uvicorn asgi:application --workers 1
+
+``/query``, ``/query/<id>/events``, ``/upload`` and ``/jobs/<id>/events`` are
+served natively, so an open SSE stream costs a coroutine rather than a
+worker thread; the answer and ingest threads wake it through
+``streams.AsyncWakeups``. Every other route goes to the Flask app unchanged.
+Both share one process-wide state (streams, job queue, models), so run a
+single process per inference sidecar or per machine, as with the WSGI server.
+"""
+import asyncio
+import functools
+import json
+import logging
+import time
+
+from flask_jwt_extended import decode_token
+from pymongo import AsyncMongoClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.utils import secure_filename
+
+import app as flask_app_module
+from app import (already_indexed_events, answer_frame, allowed_file, answer_streams, ingest_jobs, job_frame,
+                 start_answer_stream, store_upload, valid_documents, validate_file_type)
+from config import Config
+from jobs import QueueFullError
+from metrics import HTTP_REQUEST_SECONDS, Trace
+from scheduler import AdmissionError
+from storage import receive
+from streams import StreamGoneError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+flask_app = flask_app_module.app
+
+# Reads made on the event loop use the async driver; writes made from
+# worker threads (BulkWriter, the ingest queue) keep the sync one
+async_db = AsyncMongoClient(Config.MONGO_URI).get_default_database()
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def identity(request):
+    """JWT identity from the Authorization header, None without one (like verify_jwt_in_request(optional=True))."""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        with flask_app.app_context():
+            return decode_token(header[len('Bearer '):])['sub']
+    except Exception as e:
+        raise InvalidToken(str(e))
+
+
+def timed(rule):
+    """Record a native route in rag_http_request_seconds, as app.py's after_request does for Flask's.
+
+    ``rule`` is the Flask form of the path, so both serving modes report
+    the same series; routes mounted from Flask are timed by Flask itself.
+    """
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(request):
+            # For streamed responses this is the time until the stream starts
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await endpoint(request)
+                status = response.status_code
+                return response
+            finally:
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                             route=rule, status=status)
+        return timed_endpoint
+    return decorate
+
+
+@timed('/query')
+async def query(request):
+    try:
+        trace = Trace()
+        username = identity(request)
+        body = await request.json()
+        user_query = body.get('query')
+        # Optional list of document ids to restrict retrieval to
+        documents = body.get('documents')
+        if not valid_documents(documents):
+            return JSONResponse({'message': "documents must be a list of document ids"}, 400)
+        documents = documents or None
+
+        # Admission may touch the cache, the retriever or the sidecar socket
+        try:
+            stream = await asyncio.to_thread(start_answer_stream, username, user_query, documents, trace)
+        except AdmissionError as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.status in (429, 503) else {}
+            return JSONResponse({'message': str(e)}, e.status, headers)
+        return answer_response(stream)
+    except InvalidToken as e:
+        return JSONResponse({'message': f"Invalid token: {e}"}, 401)
+    except Exception as e:
+        logger.error(f"Query error: {str(e)}")
+        return JSONResponse({'message': "Error processing query"}, 500)
+
+
+@timed('/query/<stream_id>/events')
+async def resume_query(request):
+    stream = answer_streams.get(request.path_params['stream_id'])
+    if stream is None:
+        return JSONResponse({'message': "Stream not found"}, 404)
+    after = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id') or 0
+    try:
+        after = int(after)
+        stream.check_resume(after)
+    except ValueError:
+        return JSONResponse({'message': "Invalid Last-Event-ID"}, 400)
+    except StreamGoneError as e:
+        return JSONResponse({'message': str(e)}, 410)
+    return answer_response(stream, after)
+
+
+def answer_response(stream, after=0):
+    return StreamingResponse(answer_events(stream, after), media_type='text/event-stream',
+                             headers=dict(SSE_HEADERS, **{'X-Stream-Id': stream.id}))
+
+
+async def answer_events(stream, after=0):
+    if not after:
+        yield f"data: {json.dumps({'type': 'stream', 'stream_id': stream.id})}\n\n"
+    async for frame in stream.aframes(after):
+        text = answer_frame(frame)
+        if text:
+            yield text
+    yield "data: {\"type\": \"done\"}\n\n"
+
+
+@timed('/upload')
+async def upload_file(request):
+    try:
+        form = await request.form(max_files=1)
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            return JSONResponse({"message": "No file part"}, 400)
+        if file.filename == '':
+            return JSONResponse({"message": "No selected file"}, 400)
+        if not allowed_file(file.filename):
+            return JSONResponse({"message": "Invalid file type. Only PDF files are allowed"}, 400)
+        if file.size is not None and file.size > Config.MAX_CONTENT_LENGTH:
+            return JSONResponse({"message": "File too large"}, 413)
+
+        # One pass over Starlette's spooled copy hashes and sniffs it into the upload folder
+        incoming = await asyncio.to_thread(receive, file.file, flask_app.config['UPLOADS_DEFAULT_DEST'])
+        try:
+            if not validate_file_type(incoming.mime_type):
+                return JSONResponse({"message": "Invalid file type. Only PDF files are allowed"}, 400)
+            filename = secure_filename(file.filename)
+            try:
+                job_id, existing = await asyncio.to_thread(store_upload, incoming, filename)
+            except QueueFullError as e:
+                return JSONResponse({"message": str(e)}, 429, {"Retry-After": "30"})
+        finally:
+            incoming.discard()
+
+        if existing is not None:
+            return StreamingResponse(already_indexed_events(existing, incoming.sha256),
+                                     media_type='text/event-stream', headers=SSE_HEADERS)
+
+        async def generate():
+            yield "data: " + json.dumps({"step": "upload", "status": "complete", "message": "PDF uploaded successfully", "job_id": job_id}) + "\n\n"
+            async for event in ingest_jobs.astream(job_id, collection=async_db.ingest_jobs):
+                yield job_frame(event)
+
+        return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    except Exception as e:
+        logger.error(f"Upload error: {str(e)}")
+        return JSONResponse({"message": f"An error occurred: {str(e)}"}, 500)
+
+
+@timed('/jobs/<job_id>/events')
+async def get_job_events(request):
+    job_id = request.path_params['job_id']
+    if await async_db.ingest_jobs.find_one({'job_id': job_id}, {'_id': True}) is None:
+        return JSONResponse({'message': "Job not found"}, 404)
+
+    async def generate():
+        async for event in ingest_jobs.astream(job_id, collection=async_db.ingest_jobs):
+            yield job_frame(event)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+application = Starlette(routes=[
+    Route('/query', query, methods=['POST']),
+    Route('/query/{stream_id}/events', resume_query, methods=['GET']),
+    Route('/upload', upload_file, methods=['POST']),
+    Route('/jobs/{job_id}/events', get_job_events, methods=['GET']),
+    Mount('/', WSGIMiddleware(flask_app))
+], middleware=[
+    # Same policy as flask_cors in app.py, applied here so it covers the native routes too
+    Middleware(CORSMiddleware, allow_origins=["http://localhost:3000"], allow_methods=["*"], allow_headers=["*"])
+])
@@ -0,0 +1,412 @@
+"""Offline benchmark for ingestion, retrieval and answer streaming.
+
+Runs the real Flask routes (/upload and /query) against a throwaway vector
+store and upload folder, with a deterministic stub LLM in place of the
+llama model and synthetic PDFs instead of user documents. Results are
+written as JSON so two runs can be compared:
+
+    python bench.py --out results.json
+    python bench.py --baseline results.json      # run, then compare
+    python bench.py --compare old.json new.json  # compare only
+
+MongoDB is served from memory by mongomock unless ``--mongo-uri`` points
+at a real server (use a separate database, e.g. ``chatbot_bench``). The
+embedding model must already be in the local Hugging Face cache unless
+``--embeddings hash`` is used.
+"""
+import argparse
+import hashlib
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Relative change that counts as a regression when comparing runs
+DEFAULT_THRESHOLD = 0.2
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def vocabulary(size=400, seed=0):
+    rng = random.Random(seed)
+    consonants, vowels = "bcdfghklmnprstvz", "aeiou"
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_pdf(pages, seed, words_per_page=350):
+    """A PDF of ``pages`` pages of deterministic pseudo-text."""
+    import fitz
+    rng = random.Random(seed)
+    words = vocabulary()
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        text = ' '.join(rng.choice(words) for _ in range(words_per_page))
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def sse_events(response):
+    """Yield (arrival time, parsed event) for each data frame of a streamed response."""
+    buffer = ''
+    for chunk in response.response:
+        buffer += chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        while '\n\n' in buffer:
+            frame, buffer = buffer.split('\n\n', 1)
+            data = [line[5:].strip() for line in frame.splitlines() if line.startswith('data:')]
+            if data:
+                yield time.perf_counter(), json.loads('\n'.join(data))
+
+
+def make_stub_llm(tokens, tokens_per_second):
+    from langchain_core.language_models.llms import LLM
+
+    class StubLLM(LLM):
+        """Emits a fixed answer at a fixed token rate through the streaming callbacks."""
+
+        n_tokens: int = 64
+        delay: float = 0.0
+
+        @property
+        def _llm_type(self):
+            return "bench-stub"
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+            words = vocabulary()
+            output = []
+            for i in range(self.n_tokens):
+                if self.delay:
+                    time.sleep(self.delay)
+                token = (' ' if i else '') + rng.choice(words)
+                if run_manager:
+                    run_manager.on_llm_new_token(token)
+                output.append(token)
+            return ''.join(output)
+
+    return StubLLM(n_tokens=tokens, delay=1.0 / tokens_per_second if tokens_per_second > 0 else 0.0)
+
+
+def make_hash_embeddings(dim=384):
+    from langchain_core.embeddings import Embeddings
+
+    class HashEmbeddings(Embeddings):
+        """Deterministic unit vectors derived from the text hash (no model needed)."""
+
+        def _vector(self, text):
+            rng = np.random.default_rng(int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:16], 16))
+            vector = rng.normal(size=dim)
+            return (vector / np.linalg.norm(vector)).tolist()
+
+        def embed_documents(self, texts):
+            return [self._vector(text) for text in texts]
+
+        def embed_query(self, text):
+            return self._vector(text)
+
+    return HashEmbeddings()
+
+
+def bench_ingest(client, args):
+    timings = []
+    total_pages = 0
+    started = time.perf_counter()
+    for i in range(args.documents):
+        pdf = synthetic_pdf(args.pages, seed=args.seed + i)
+        upload_started = time.perf_counter()
+        response = client.post('/upload', data={'file': (io.BytesIO(pdf), f"bench-{i}.pdf")},
+                               content_type='multipart/form-data', buffered=False)
+        if response.status_code != 200:
+            raise RuntimeError(f"/upload returned {response.status_code}: {response.get_data(as_text=True)}")
+        final = None
+        for _, event in sse_events(response):
+            if event.get('status') in ('complete', 'error') and event.get('step') != 'upload':
+                final = event
+                break
+        response.close()
+        if not final or final['status'] != 'complete':
+            raise RuntimeError(f"Ingestion of bench-{i}.pdf failed: {final}")
+        timings.append(time.perf_counter() - upload_started)
+        total_pages += args.pages
+    elapsed = time.perf_counter() - started
+    return {
+        'documents': args.documents,
+        'pages': total_pages,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(total_pages / elapsed, 3),
+        'document_ms_p50': percentile([t * 1000 for t in timings], 50)
+    }
+
+
+def bench_embedding(embeddings, texts, batch_size):
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    timings = []
+    for batch in batches:
+        started = time.perf_counter()
+        embeddings.embed_documents(batch)
+        timings.append(time.perf_counter() - started)
+    return {
+        'batch_size': batch_size,
+        'batches': len(batches),
+        'texts_per_sec': round(len(texts) / sum(timings), 3) if timings else None,
+        'batch_ms_p50': percentile([t * 1000 for t in timings], 50),
+        'batch_ms_p99': percentile([t * 1000 for t in timings], 99)
+    }
+
+
+def bench_retrieval(index, embeddings, queries, k):
+    from shards import ShardedRetriever
+    retriever = ShardedRetriever(index=index, k=k)
+    vectors = [embeddings.embed_query(query) for query in queries]
+
+    search, full = [], []
+    for query, vector in zip(queries, vectors):
+        started = time.perf_counter()
+        index.search(vector, k)
+        search.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        retriever.invoke(query)
+        full.append((time.perf_counter() - started) * 1000)
+
+    # The /search path: the whole batch in one call per index
+    started = time.perf_counter()
+    index.search_batch(vectors, k)
+    batch_seconds = time.perf_counter() - started
+    return {
+        'queries': len(queries),
+        'k': k,
+        'dense_search_ms_p50': percentile(search, 50),
+        'dense_search_ms_p99': percentile(search, 99),
+        'retriever_ms_p50': percentile(full, 50),
+        'retriever_ms_p99': percentile(full, 99),
+        'batch_search_queries_per_sec': round(len(vectors) / batch_seconds, 3) if batch_seconds else None
+    }
+
+
+def bench_generation(client, queries):
+    from model import final_result
+
+    def direct(query):
+        started = time.perf_counter()
+        first, tokens = None, 0
+        for chunk in final_result(query, stream=True):
+            if chunk['type'] == 'token':
+                tokens += 1
+                first = first or time.perf_counter()
+        return first - started, time.perf_counter() - started, tokens
+
+    def route(query):
+        started = time.perf_counter()
+        response = client.post('/query', json={'query': query}, buffered=False)
+        first, frames = None, 0
+        for arrived, event in sse_events(response):
+            if event.get('type') == 'token':
+                # Tokens are coalesced, so count frames rather than tokens
+                frames += 1
+                first = first or arrived
+            elif event.get('type') == 'error':
+                raise RuntimeError(f"/query failed: {event}")
+        response.close()
+        return first - started, time.perf_counter() - started, frames
+
+    results = {'direct': [], 'route': []}
+    for query in queries:
+        # Alternate so model-side warm-up and drift affect both paths alike
+        results['direct'].append(direct(query))
+        results['route'].append(route(query))
+
+    summary = {'queries': len(queries)}
+    for name, runs in results.items():
+        ttft = [run[0] * 1000 for run in runs]
+        total = [run[1] * 1000 for run in runs]
+        summary[f'{name}_ttft_ms_p50'] = percentile(ttft, 50)
+        summary[f'{name}_ttft_ms_p99'] = percentile(ttft, 99)
+        summary[f'{name}_total_ms_p50'] = percentile(total, 50)
+    direct = results['direct']
+    summary['direct_tokens_per_sec'] = round(sum(run[2] for run in direct) / sum(run[1] for run in direct), 3)
+    summary['route_frames_per_answer'] = round(sum(run[2] for run in results['route']) / len(queries), 3)
+    summary['sse_overhead_ttft_ms_p50'] = round(summary['route_ttft_ms_p50'] - summary['direct_ttft_ms_p50'], 3)
+    summary['sse_overhead_total_ms_p50'] = round(summary['route_total_ms_p50'] - summary['direct_total_ms_p50'], 3)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def use_mongomock():
+    """Serve the app's MongoDB from memory, so benchmarking needs no server."""
+    try:
+        import mongomock
+        from mongomock.collection import BulkOperationBuilder
+    except ImportError:
+        raise SystemExit("Benchmarking without MongoDB needs mongomock (pip install mongomock); "
+                         "or pass --mongo-uri")
+    import flask_pymongo
+
+    add_update = BulkOperationBuilder.add_update
+    if 'sort' not in inspect.signature(add_update).parameters:
+        # pymongo >= 4.11 passes sort= to the bulk upserts of records.BulkWriter
+        def add_update_without_sort(self, *args, sort=None, **kwargs):
+            return add_update(self, *args, **kwargs)
+        BulkOperationBuilder.add_update = add_update_without_sort
+    flask_pymongo.MongoClient = mongomock.MongoClient
+
+
+def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+    # Everything the app writes goes to the throwaway directory; must be set
+    # before config is imported
+    os.environ['VECTOR_STORE_DIR'] = str(workdir / "vectorstoredb_faiss")
+    os.environ['UPLOAD_FOLDER'] = str(workdir / "uploads")
+    os.environ['EMBEDDING_CACHE_DIR'] = str(workdir / "embedding_cache")
+    os.environ['MONGO_URI'] = args.mongo_uri or "mongodb://localhost:27017/chatbot_bench"
+    os.environ['WARM_ON_STARTUP'] = 'false'
+    # Measure the real pipeline, not the caches in front of it
+    os.environ['EMBEDDING_CACHE_SIZE'] = '0'
+    os.environ['ANSWER_CACHE_SIZE'] = '0'
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+    from config import Config
+    from registry import registry
+    if not args.mongo_uri:
+        use_mongomock()
+    try:
+        import app as server
+    except SystemExit:
+        raise SystemExit(f"MongoDB is required at {args.mongo_uri}")
+
+    if args.embeddings == 'hash':
+        registry.register('embeddings', make_hash_embeddings)
+    llm = make_stub_llm(args.tokens, args.token_rate)
+    registry.register('llm', lambda: llm)
+    for slot in range(1, Config.LLM_SLOTS):
+        registry.register(f'llm:{slot}', lambda: llm)
+
+    started = time.perf_counter()
+    registry.warm(['embeddings', 'vectorstore', 'llm'])
+    load_seconds = round(time.perf_counter() - started, 3)
+
+    client = server.app.test_client()
+    results = {'ingest': bench_ingest(client, args)}
+
+    from ingest import iter_document_batches
+    texts = [doc.page_content for path in sorted(Path(os.environ['UPLOAD_FOLDER']).glob("*.pdf"))
+             for batch in iter_document_batches(str(path)) for doc in batch]
+    embeddings = registry.get('embeddings')
+    results['embedding'] = bench_embedding(embeddings, texts, Config.EMBED_BATCH_SIZE)
+
+    rng = random.Random(args.seed)
+    words = vocabulary()
+    queries = [' '.join(rng.choice(words) for _ in range(6)) for _ in range(args.queries)]
+    results['retrieval'] = bench_retrieval(registry.get('vectorstore'), embeddings, queries, Config.RETRIEVAL_K)
+    results['generation'] = bench_generation(client, queries[:args.generations])
+
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'embeddings': Config.EMBEDDING_MODEL if args.embeddings == 'model' else 'hash',
+            'mongo': 'server' if args.mongo_uri else 'mongomock',
+            'load_seconds': load_seconds,
+            'args': {key: value for key, value in vars(args).items() if key not in ('out', 'baseline', 'compare')},
+            'config': {key: getattr(Config, key) for key in (
+                'EMBEDDING_BACKEND', 'EMBEDDING_THREADS',
+                'CHUNK_TOKENS', 'CHUNK_OVERLAP', 'EMBED_BATCH_SIZE', 'RETRIEVAL_K',
+                'HYBRID_SEARCH', 'INDEX_TYPE', 'LLM_SLOTS')}
+        },
+        **results
+    }
+
+
+def flatten(results):
+    return {f"{section}.{key}": value
+            for section, values in results.items() if section != 'meta'
+            for key, value in values.items() if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Print per-metric changes; return the metrics that regressed by more than ``threshold``."""
+    old, new = flatten(baseline), flatten(current)
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        if key.endswith('_per_sec'):
+            higher_is_better = True
+        elif '_ms' in key:
+            higher_is_better = False
+        else:
+            continue
+        before, after = old[key], new[key]
+        if not before:
+            continue
+        change = (after - before) / abs(before)
+        regressed = change < -threshold if higher_is_better else change > threshold
+        if regressed:
+            regressions.append(key)
+        print(f"{key:45} {before:>12.3f} -> {after:>12.3f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=3, help="synthetic PDFs to upload")
+    parser.add_argument('--pages', type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument('--queries', type=int, default=50, help="retrieval queries")
+    parser.add_argument('--generations', type=int, default=10, help="queries streamed through the stub LLM")
+    parser.add_argument('--tokens', type=int, default=64, help="tokens per stub answer")
+    parser.add_argument('--token-rate', type=float, default=200.0, help="stub LLM tokens/sec (0 = unthrottled)")
+    parser.add_argument('--embeddings', choices=('model', 'hash'), default='model',
+                        help="real embedding model (from the local cache) or hash-based stub")
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGO_URI'),
+                        help="benchmark against this MongoDB (default: in memory, with mongomock)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="write results JSON here (default: print)")
+    parser.add_argument('--baseline', help="compare this run against an earlier results JSON")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change treated as a regression")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="only compare two results files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            return 1 if compare(json.load(f_old), json.load(f_new), args.threshold) else 0
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            return 1 if compare(json.load(f), results, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
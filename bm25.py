@@ -0,0 +1,180 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    # Keep dotted/hyphenated identifiers ("v2.1", "E-Commerce") as one term
+    # and also index their parts, so both spellings match
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        term = match.group()
+        tokens.append(term)
+        if not term.isalnum():
+            tokens.extend(part for part in re.split(r"[.\-/]", term) if part)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class BM25Writer:
+    """Collects one shard's postings while it is written; ``save`` stores them as a BM25Index."""
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = []
+
+    def add(self, texts: Iterable[str]):
+        for text in texts:
+            row = len(self.lengths)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((row, tf))
+            self.lengths.append(sum(counts.values()))
+
+    def build(self) -> 'BM25Index':
+        return BM25Index.from_postings(self.postings, self.lengths)
+
+    def save(self, path):
+        self.build().save(path)
+
+
+class BM25Index:
+    """Inverted index for one shard in CSR form.
+
+    ``terms`` holds sorted 64-bit term hashes; the postings of ``terms[i]``
+    are ``rows[offsets[i]:offsets[i + 1]]`` with their term frequencies in
+    ``tfs``. Rows are the shard's vector rows, so lexical and dense hits
+    refer to the same chunks. Saved as ``.npy`` files that ``load``
+    memory-maps, so an index costs no Python objects per term and its
+    pages are shared by every worker. Corpus statistics are combined
+    across shards at query time (see ``search``).
+    """
+
+    FILES = ('terms', 'offsets', 'rows', 'tfs', 'lengths')
+
+    def __init__(self, terms, offsets, rows, tfs, lengths):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.lengths = lengths
+        self.total_length = int(lengths.sum())
+
+    @classmethod
+    def from_postings(cls, postings, lengths):
+        """Build from ``term -> [(row, tf), ...]`` and per-row lengths (as BM25Writer collects them)."""
+        order = sorted(postings, key=term_hash)
+        flat = [posting for term in order for posting in postings[term]]
+        return cls(np.asarray([term_hash(term) for term in order], dtype=np.uint64),
+                   np.cumsum([0] + [len(postings[term]) for term in order], dtype=np.int64),
+                   np.asarray([row for row, _ in flat], dtype=np.int32),
+                   np.asarray([tf for _, tf in flat], dtype=np.int32),
+                   np.asarray(lengths, dtype=np.int32))
+
+    @classmethod
+    def concatenate(cls, parts):
+        """One index over ``parts``, ``(index or None, rows)`` pairs laid end to end.
+
+        Rows are numbered across all parts in order, like the vectors of a
+        global ANN index; parts without an index only take up rows.
+        """
+        terms, rows, tfs, lengths = [], [], [], []
+        base = 0
+        for index, count in parts:
+            if index is None:
+                lengths.append(np.zeros(count, dtype=np.int32))
+            else:
+                terms.append(np.repeat(index.terms, np.diff(index.offsets)))
+                rows.append(np.asarray(index.rows, dtype=np.int64) + base)
+                tfs.append(index.tfs)
+                lengths.append(index.lengths)
+            base += count
+        if not terms:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(np.zeros(0, dtype=np.uint64), np.zeros(1, dtype=np.int64), empty, empty,
+                       np.concatenate(lengths) if lengths else empty)
+        terms = np.concatenate(terms)
+        # Stable: each term's postings stay in row order
+        order = np.argsort(terms, kind='stable')
+        unique, counts = np.unique(terms[order], return_counts=True)
+        return cls(unique, np.cumsum(np.concatenate([[0], counts]), dtype=np.int64),
+                   np.concatenate(rows)[order], np.concatenate(tfs)[order], np.concatenate(lengths))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def save(self, path):
+        for name in self.FILES:
+            np.save(Path(path) / f"bm25_{name}.npy", getattr(self, name))
+
+    @classmethod
+    def exists(cls, path):
+        return (Path(path) / "bm25_terms.npy").exists()
+
+    @classmethod
+    def load(cls, path):
+        return cls(*(np.load(Path(path) / f"bm25_{name}.npy", mmap_mode='r') for name in cls.FILES))
+
+    def spans(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Start and end offsets of the postings of each sorted term hash in ``keys`` (equal if absent)."""
+        if not len(self.terms):
+            empty = np.zeros(len(keys), dtype=np.int64)
+            return empty, empty
+        positions = np.minimum(np.searchsorted(self.terms, keys), len(self.terms) - 1)
+        found = self.terms[positions] == keys
+        starts = np.where(found, self.offsets[positions], 0)
+        return starts, np.where(found, self.offsets[positions + 1], 0)
+
+
+def search(indexes: Sequence[Tuple[str, BM25Index]], query: str, k: int,
+           k1=1.2, b=0.75) -> List[Tuple[str, int, float]]:
+    """Score ``query`` over several shards as if they were one corpus.
+
+    Returns up to ``k`` ``(shard, row, score)`` tuples, best first.
+    """
+    keys = np.unique(np.asarray([term_hash(term) for term in set(tokenize(query))], dtype=np.uint64))
+    if not len(keys) or not indexes:
+        return []
+
+    n_docs = sum(len(index) for _, index in indexes)
+    if not n_docs:
+        return []
+    avg_length = sum(index.total_length for _, index in indexes) / n_docs
+    spans = [(name, index, index.spans(keys)) for name, index in indexes]
+    doc_freq = sum(ends - starts for _, _, (starts, ends) in spans)
+    idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    hits = []
+    for name, index, (starts, ends) in spans:
+        present = np.flatnonzero(ends > starts)
+        if not len(present):
+            continue
+        rows = np.concatenate([index.rows[starts[i]:ends[i]] for i in present])
+        tfs = np.concatenate([index.tfs[starts[i]:ends[i]] for i in present]).astype(np.float64)
+        weights = np.repeat(idf[present], (ends - starts)[present])
+        norm = tfs + k1 * (1 - b + b * index.lengths[rows] / avg_length)
+        # A row matching several terms appears once per term; add its scores up
+        unique_rows, positions = np.unique(rows, return_inverse=True)
+        scores = np.bincount(positions, weights=weights * tfs * (k1 + 1) / norm)
+        best = np.argsort(-scores, kind='stable')[:k]
+        hits.extend((name, int(unique_rows[i]), float(scores[i])) for i in best)
+
+    return sorted(hits, key=lambda hit: hit[2], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence], k: int, rrf_k=60) -> List:
+    """Merge ranked lists of hashable keys into (key, fused score), best first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
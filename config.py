@@ -4,7 +4,7 @@ from pathlib import Path
 
 # Base Paths
 BASE_DIR = Path(__file__).parent
-UPLOAD_FOLDER = BASE_DIR / "uploads"
+UPLOAD_FOLDER = Path(os.getenv("UPLOAD_FOLDER", BASE_DIR / "uploads"))
 VECTOR_STORE = BASE_DIR / "vectorstore" / "db_faiss"
 
 # Flask Configuration
@@ -14,7 +14,105 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     UPLOADS_DEFAULT_DEST = str(UPLOAD_FOLDER)
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB
-    EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    # Embedding backend: huggingface (sentence-transformers, fp32) or onnx (an
+    # int8-quantized export of EMBEDDING_MODEL, built in EMBEDDING_ONNX_DIR on
+    # first use). EMBEDDING_THREADS=0 leaves the thread count to the runtime.
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface")
+    EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", str(BASE_DIR / "embedding_onnx"))
+    EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+    EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", "256"))
+    # Per-document shards, manifest and global ANN index
+    VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", str(BASE_DIR / "vectorstoredb_faiss"))
+    # Replaced shards and global indexes are deleted once no query in this
+    # process reads them and INDEX_GC_GRACE seconds have passed (other workers)
+    INDEX_GC_GRACE = float(os.getenv("INDEX_GC_GRACE", "300"))
+    # Deleted documents' vectors stay in the global ANN index (filtered out at
+    # query time) until they are COMPACT_TOMBSTONE_RATIO of it; a background
+    # task checks every COMPACT_INTERVAL seconds and rebuilds it from live shards
+    COMPACT_TOMBSTONE_RATIO = float(os.getenv("COMPACT_TOMBSTONE_RATIO", "0.2"))
+    COMPACT_INTERVAL = float(os.getenv("COMPACT_INTERVAL", "60"))
+    # Memory-map index files read-only, so processes share them through the page cache
+    INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"
+    # Optional inference sidecar (python inference.py): one process owns the
+    # LLM, embeddings and index, and web workers stream answers from it over
+    # this Unix socket. Empty: each worker loads its own models.
+    INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+    INFERENCE_CONNECT_TIMEOUT = float(os.getenv("INFERENCE_CONNECT_TIMEOUT", "5"))
+    # Load embeddings, vector store and LLM in the background at startup
+    WARM_ON_STARTUP = os.getenv("WARM_ON_STARTUP", "true").lower() == "true"
+    # Background ingestion: worker threads and how many uploads may wait for one
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+    # Chunking (in whitespace tokens) and embedding batch size for ingestion;
+    # chunks are also kept within EMBEDDING_MAX_LENGTH word pieces (see ingest.iter_chunks)
+    CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "180"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "30"))
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    # Retrieval: chunks per answer and threads for the per-document shard fan-out
+    RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "2"))
+    # Context packing for generation: up to RETRIEVAL_MAX_K candidates, cut at
+    # the first drop in their query distance of CONTEXT_GAP_RATIO of the
+    # spread (also for hybrid search, whose fused ranks can't), then merged,
+    # de-duplicated and trimmed to CONTEXT_TOKEN_BUDGET model tokens
+    CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+    RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "6"))
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1536"))
+    CONTEXT_GAP_RATIO = float(os.getenv("CONTEXT_GAP_RATIO", "0.4"))
+    CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+    SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", "4"))
+    # Retrieval-only /search: queries per request and chunks per query
+    SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "256"))
+    SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "50"))
+    # Hybrid retrieval: fuse dense and BM25 rankings (each HYBRID_FETCH_FACTOR * k
+    # deep) with reciprocal rank fusion
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    HYBRID_FETCH_FACTOR = int(os.getenv("HYBRID_FETCH_FACTOR", "5"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    # Corpus-wide ANN index: auto|flat|ivf|ivfpq|hnsw. With auto, exact search
+    # is used below ANN_MIN_VECTORS, HNSW below IVF_MIN_VECTORS, IVF above.
+    INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+    INDEX_PQ = os.getenv("INDEX_PQ", "false").lower() == "true"
+    ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "20000"))
+    IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "200000"))
+    # Retrain once the corpus has grown by this factor since the last build
+    ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "1.5"))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+    PQ_M = int(os.getenv("PQ_M", "48"))
+    HNSW_M = int(os.getenv("HNSW_M", "32"))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    # Persistent embedding cache; set EMBEDDING_CACHE_SIZE=0 to disable
+    EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", str(BASE_DIR / "embedding_cache"))
+    EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "200000"))
+    # Semantic answer cache in front of the LLM
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    # Inference scheduler: concurrent generations (one model copy each),
+    # queued requests allowed to wait, and how long each may wait (seconds)
+    LLM_SLOTS = int(os.getenv("LLM_SLOTS", "1"))
+    LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "8"))
+    LLM_QUEUE_TIMEOUT = int(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+    # Per-request generation budget; the answer is cut off when either is hit
+    MAX_GENERATION_TOKENS = int(os.getenv("MAX_GENERATION_TOKENS", "1024"))
+    MAX_GENERATION_SECONDS = int(os.getenv("MAX_GENERATION_SECONDS", "180"))
+    # chat_history/documents writes are buffered and sent in batches
+    RECORD_BATCH_SIZE = int(os.getenv("RECORD_BATCH_SIZE", "100"))
+    RECORD_FLUSH_INTERVAL = float(os.getenv("RECORD_FLUSH_INTERVAL", "1.0"))
+    # Default and maximum page size for /chat-history and /documents
+    PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+    MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+    # Answer streaming: tokens are coalesced into one SSE frame per
+    # SSE_FLUSH_INTERVAL seconds (or SSE_FLUSH_CHARS characters); a dropped
+    # client may resume within STREAM_RESUME_GRACE seconds before the
+    # generation is cancelled, and finished streams stay resumable for
+    # STREAM_RETENTION seconds
+    SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL", "0.05"))
+    SSE_FLUSH_CHARS = int(os.getenv("SSE_FLUSH_CHARS", "256"))
+    STREAM_REPLAY_EVENTS = int(os.getenv("STREAM_REPLAY_EVENTS", "4096"))
+    STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "10"))
+    STREAM_RETENTION = float(os.getenv("STREAM_RETENTION", "60"))
     ADMIN_KEY = os.getenv("ADMIN_KEY", "adminkey")
 
 def init_app(app):
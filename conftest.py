@@ -0,0 +1,50 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+# Tests get a throwaway vector store and upload folder, never the ones in the
+# repo (config reads these at import)
+os.environ['VECTOR_STORE_DIR'] = tempfile.mkdtemp(prefix="test-vectorstore-")
+os.environ['UPLOAD_FOLDER'] = tempfile.mkdtemp(prefix="test-uploads-")
+os.environ['EMBEDDING_CACHE_DIR'] = tempfile.mkdtemp(prefix="test-embedding-cache-")
+os.environ['WARM_ON_STARTUP'] = 'false'
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic stand-in for the embedding model: words hashed into a small unit vector."""
+
+    dim = 16
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+@pytest.fixture
+def index_store():
+    """An empty vector store; the registry serves it with HashEmbeddings."""
+    import shards  # registers 'vectorstore'
+    from registry import registry, DB_FAISS_PATH
+
+    shutil.rmtree(DB_FAISS_PATH, ignore_errors=True)
+    DB_FAISS_PATH.mkdir(parents=True)
+    registry.register('embeddings', HashEmbeddings)
+    registry.invalidate('embeddings')
+    registry.invalidate('vectorstore')
+    yield DB_FAISS_PATH
+    registry.invalidate('vectorstore')
@@ -0,0 +1,160 @@
+import logging
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def approximate_tokens(text: str) -> int:
+    # Llama-style tokenizers average roughly 4/3 tokens per English word
+    return max(1, (len(text.split()) * 4 + 2) // 3)
+
+
+def token_counter(llm) -> Callable[[str], int]:
+    """Count tokens with the LLM's own tokenizer where it exposes one."""
+    tokenize = getattr(getattr(llm, 'client', None), 'tokenize', None)
+    if tokenize is None:
+        return approximate_tokens
+
+    def count(text: str) -> int:
+        try:
+            return len(tokenize(text))
+        except Exception:
+            return approximate_tokens(text)
+    return count
+
+
+def choose_k(scores: Sequence[float], min_k: int, max_k: int, gap_ratio: float) -> int:
+    """Cut a best-first score list at the first large drop.
+
+    Keeps at least ``min_k`` and at most ``max_k`` hits; after ``min_k`` the
+    list is cut before the first drop between neighbours that is at least
+    ``gap_ratio`` of the whole spread of the candidates.
+    """
+    n = min(len(scores), max_k)
+    if n <= min_k:
+        return n
+    spread = scores[0] - scores[n - 1]
+    if spread <= 0:
+        return n
+    for i in range(min_k, n):
+        if scores[i - 1] - scores[i] >= gap_ratio * spread:
+            return i
+    return n
+
+
+def _shingles(words, size=3):
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _overlap(first: List[str], second: List[str], limit=400) -> int:
+    """Length of the longest suffix of ``first`` that is a prefix of ``second``."""
+    for m in range(min(len(first), len(second), limit), 0, -1):
+        if first[-m:] == second[:m]:
+            return m
+    return 0
+
+
+class ContextPacker:
+    """Turns ranked retrieval hits into the context for the stuff chain.
+
+    Picks k from the score gaps, merges neighbouring chunks of the same
+    document (dropping the overlap they share from chunking), drops
+    near-duplicates and fills a token budget in rank order, truncating the
+    last chunk that only partly fits.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int] = approximate_tokens, budget=1536,
+                 min_k=1, max_k=6, gap_ratio=0.4, duplicate_threshold=0.8, min_fragment_tokens=64):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.min_k = min_k
+        self.max_k = max_k
+        self.gap_ratio = gap_ratio
+        self.duplicate_threshold = duplicate_threshold
+        self.min_fragment_tokens = min_fragment_tokens
+
+    def pack(self, hits: Sequence[Tuple[Document, float]],
+             relevance: Optional[Sequence[float]] = None) -> List[Document]:
+        """``hits`` are (document, score) pairs, best first, higher score = better.
+
+        When the scores' gaps say nothing about relevance, as with
+        rank-fusion scores, pass ``relevance`` (one higher-is-better value
+        per hit, e.g. negated distances): k is chosen from its gaps instead
+        and the top k hits are kept in ranking order.
+        """
+        scores = sorted(relevance, reverse=True) if relevance is not None else [score for _, score in hits]
+        k = choose_k(scores, self.min_k, self.max_k, self.gap_ratio)
+        documents = self._merge_neighbours([doc for doc, _ in hits[:k]])
+        documents = self._drop_duplicates(documents)
+
+        packed, used = [], 0
+        for doc in documents:
+            tokens = self.count_tokens(doc.page_content)
+            if used + tokens <= self.budget:
+                packed.append(doc)
+                used += tokens
+                continue
+            remaining = self.budget - used
+            if remaining >= self.min_fragment_tokens:
+                packed.append(self._truncate(doc, remaining))
+            break
+        logger.info(f"Packed {len(packed)} of {len(hits)} retrieved chunks (k={k}) into the context")
+        return packed
+
+    @staticmethod
+    def _key(doc):
+        return doc.metadata.get('doc_id') or doc.metadata.get('source')
+
+    def _merge_neighbours(self, documents: List[Document]) -> List[Document]:
+        # Consecutive chunks of one document share CHUNK_OVERLAP tokens; join
+        # them into one passage at the position of the better-ranked chunk
+        merged = []
+        for doc in documents:
+            chunk = doc.metadata.get('chunk')
+            for i, other in enumerate(merged):
+                span = other.metadata.get('_chunks')
+                if chunk is None or span is None or self._key(other) != self._key(doc):
+                    continue
+                if chunk == span[1] + 1:
+                    first, second = other, doc
+                elif chunk == span[0] - 1:
+                    first, second = doc, other
+                else:
+                    continue
+                first_words, second_words = first.page_content.split(), second.page_content.split()
+                text = ' '.join(first_words + second_words[_overlap(first_words, second_words):])
+                merged[i] = Document(page_content=text, metadata=dict(
+                    other.metadata, _chunks=(min(span[0], chunk), max(span[1], chunk))))
+                break
+            else:
+                merged.append(Document(page_content=doc.page_content,
+                                       metadata=dict(doc.metadata, _chunks=(chunk, chunk) if chunk is not None else None)))
+        for doc in merged:
+            doc.metadata.pop('_chunks', None)
+        return merged
+
+    def _drop_duplicates(self, documents: List[Document]) -> List[Document]:
+        kept, kept_shingles = [], []
+        for doc in documents:
+            shingles = _shingles(doc.page_content.lower().split())
+            if any(len(shingles & other) / len(shingles | other) >= self.duplicate_threshold
+                   for other in kept_shingles):
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _truncate(self, doc: Document, tokens: int) -> Document:
+        words = doc.page_content.split()
+        low, high = 0, len(words)
+        # Longest word prefix that fits, by binary search over the token count
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(' '.join(words[:middle])) <= tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return Document(page_content=' '.join(words[:low]), metadata=dict(doc.metadata, truncated=True))
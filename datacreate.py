@@ -1,14 +1,24 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 import os
 import logging
 from pathlib import Path
+from registry import registry, DB_FAISS_PATH
+from ingest import iter_document_batches
+from shards import ShardWriter, shard_name, rebuild_global_index, collect_garbage, migrate_legacy_store
+from metrics import Trace, INGEST_PAGES_PER_SECOND
+from manifest import load_manifest, save_manifest, find_by_hash, file_sha256, make_entry, index_write_lock, retire
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_vector_db(filepath):
+def create_vector_db(filepath, progress=None, doc_id=None):
+    """Add a PDF to the vector store.
+
+    ``progress`` is an optional callable ``progress(step, message, **counts)``
+    used by the ingestion job queue to report real progress. ``doc_id``
+    defaults to the file name; uploads are stored under their content hash
+    and pass the name they were uploaded as.
+    """
+    report = progress or (lambda step, message, **counts: None)
     try:
         logger.info(f"Processing PDF file: {filepath}")
 
@@ -16,35 +26,124 @@ def create_vector_db(filepath):
         if not os.path.exists(filepath):
             logger.error(f"File not found: {filepath}")
             return False
-        
+
         # Create the vectorstoredb_faiss directory if it doesn't exist
-        db_path = Path("vectorstoredb_faiss")
-        db_path.mkdir(exist_ok=True)
-        
-        # Load and process the single PDF file
+        DB_FAISS_PATH.mkdir(exist_ok=True)
+
+        doc_id = doc_id or Path(filepath).name
+        sha256 = file_sha256(filepath)
+
+        # Skip files whose exact content is already in the index
+        existing_id = find_by_hash(load_manifest(), sha256)
+        if existing_id is not None:
+            logger.info(f"{doc_id} is already indexed as {existing_id}, skipping")
+            report('vectordb', 'Document is already indexed', pages_extracted=0, chunks_embedded=0, vectors_written=0)
+            return True
+
+        # Stream the PDF page by page and embed fixed-size chunk batches
+        # straight into the new shard; texts go to disk as they are written,
+        # so memory does not grow with the page count beyond the new vectors.
+        trace = Trace()
+        embeddings = registry.get('embeddings')
+        name = shard_name(sha256)
+        writer = ShardWriter(name)
+        pages_extracted = 0
         try:
-            loader = PyPDFLoader(filepath)
-            documents = loader.load()
-            logger.info(f"Number of pages loaded: {len(documents)}")
+            batches = iter_document_batches(filepath)
+            while True:
+                # Extraction and chunking happen lazily inside the iterator
+                with trace.span('ingest_extract'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                texts = [doc.page_content for doc in batch]
+                metadatas = [dict(doc.metadata, doc_id=doc_id) for doc in batch]
+                pages_extracted = batch[-1].metadata['page'] + 1
+                report('processing', 'Extracting text from PDF', pages_extracted=pages_extracted)
+
+                with trace.span('ingest_embed'):
+                    vectors = embeddings.embed_documents(texts)
+                with trace.span('ingest_write'):
+                    writer.add(texts, vectors, metadatas)
+                report('embeddings', 'Creating text embeddings', chunks_embedded=writer.count)
         except Exception as e:
             logger.error(f"Error loading document: {e}")
+            writer.abort()
             return False
-        
-        # Create embeddings
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-        
-        # Create and save vector store
-        db = FAISS.from_documents(documents, embeddings)
-        db.save_local("vectorstoredb_faiss")
-        logger.info("Vector database created successfully")
+
+        if not writer.count:
+            logger.error(f"No text could be extracted from {filepath}")
+            writer.abort()
+            return False
+        logger.info(f"Embedded {writer.count} chunks from {pages_extracted} pages")
+
+        # Each document gets its own shard; writing it never touches the others
+        with trace.span('ingest_write'):
+            writer.commit()
+        report('vectordb', 'Wrote vectors to the index', vectors_written=writer.count)
+
+        publish_document(filepath, sha256, name, writer.count, pages_extracted, doc_id=doc_id)
+
+        pages_per_second = pages_extracted / trace.elapsed()
+        INGEST_PAGES_PER_SECOND.observe(pages_per_second)
+        logger.info(f"Added {writer.count} chunks from {doc_id} to the vector database "
+                    f"({pages_per_second:.1f} pages/s, timings ms: {trace.as_dict()})")
+
+        # Retrain the corpus-wide ANN index once the corpus has grown enough
+        try:
+            rebuild_global_index(registry.get('vectorstore'))
+        except Exception as e:
+            logger.error(f"Error rebuilding global index: {e}")
         return True
-        
+
     except Exception as e:
         logger.error(f"Error creating vector database: {e}")
         return False
 
+def publish_document(filepath, sha256, name, chunks, pages, doc_id=None):
+    """Point the manifest entry for ``doc_id`` (default: the file name) at its committed shard."""
+    doc_id = doc_id or Path(filepath).name
+    migrate_legacy_store()
+    with index_write_lock:
+        manifest = load_manifest()
+        previous = manifest['documents'].get(doc_id)
+        manifest['documents'][doc_id] = make_entry(filepath, sha256, name, chunks, pages, doc_id)
+        if previous and previous.get('shard') and previous['shard'] != name:
+            # A changed file under the same name replaces its old shard, which
+            # is deleted once the queries still reading it have finished
+            retire(manifest, f"shards/{previous['shard']}")
+        save_manifest(manifest)
+
+    try:
+        collect_garbage(registry.get('vectorstore'))
+    except Exception as e:
+        logger.error(f"Error collecting retired shards: {e}")
+
+def delete_document(doc_id):
+    """Remove a document from the index; returns its manifest entry, or None if unknown.
+
+    Dropping the entry from the manifest takes the document out of every
+    query started afterwards. Its shard is retired and deleted once no
+    query reads it; its rows in the global index are skipped at query time
+    until compaction (see shards.compact_global_index) rebuilds it.
+    """
+    # Documents still in the pre-shard store get a shard of their own first
+    migrate_legacy_store()
+    with index_write_lock:
+        manifest = load_manifest()
+        entry = manifest['documents'].pop(doc_id, None)
+        if entry is None:
+            return None
+        if entry.get('shard'):
+            retire(manifest, f"shards/{entry['shard']}")
+        save_manifest(manifest)
+    logger.info(f"Deleted {doc_id} from the index")
+
+    try:
+        collect_garbage(registry.get('vectorstore'))
+    except Exception as e:
+        logger.error(f"Error collecting retired shards: {e}")
+    return entry
+
 if __name__ == "__main__":
     create_vector_db("path/to/your/pdf/file.pdf")
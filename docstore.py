@@ -0,0 +1,88 @@
+import json
+import mmap
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+
+class DocstoreWriter:
+    """Streams chunk texts and metadata into a columnar on-disk docstore.
+
+    Layout: ``texts.bin`` holds every chunk's UTF-8 text back to back,
+    ``offsets.npy`` holds n+1 int64 byte offsets into it, and ``meta.json``
+    holds metadata that is identical for every row once, plus one column
+    (an int32 ``.npy`` for integer fields, a JSON list otherwise) for each
+    field that varies.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._texts = open(self.path / TEXTS_FILE, 'wb')
+        self._offsets = [0]
+        self._columns = {}
+
+    def add(self, texts, metadatas):
+        for text, metadata in zip(texts, metadatas):
+            row = len(self._offsets) - 1
+            self._offsets.append(self._offsets[-1] + self._texts.write(text.encode('utf-8')))
+            for key in set(self._columns) | set(metadata):
+                column = self._columns.setdefault(key, [None] * row)
+                column.append(metadata.get(key))
+
+    def close(self):
+        self._texts.close()
+        np.save(self.path / OFFSETS_FILE, np.asarray(self._offsets, dtype=np.int64))
+
+        shared, columns = {}, {}
+        for key, values in self._columns.items():
+            if all(value == values[0] for value in values):
+                shared[key] = values[0]
+            elif all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+                np.save(self.path / f"meta_{key}.npy", np.asarray(values, dtype=np.int32))
+                columns[key] = 'int32'
+            else:
+                columns[key] = values
+        with open(self.path / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'shared': shared, 'columns': columns}, f)
+        return len(self._offsets) - 1
+
+
+class MmapDocstore:
+    """Read-only view of a DocstoreWriter directory.
+
+    Texts and integer columns are memory-mapped, so opening a docstore
+    costs the same regardless of corpus size and only the rows that are
+    actually returned by a search are read.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._offsets = np.load(self.path / OFFSETS_FILE, mmap_mode='r')
+        with open(self.path / TEXTS_FILE, 'rb') as f:
+            size = self._offsets[-1]
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        with open(self.path / META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self._shared = meta['shared']
+        self._columns = {
+            key: np.load(self.path / f"meta_{key}.npy", mmap_mode='r') if values == 'int32' else values
+            for key, values in meta['columns'].items()
+        }
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def document(self, row) -> Document:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        metadata = dict(self._shared)
+        for key, column in self._columns.items():
+            value = column[row]
+            if value is not None:
+                metadata[key] = int(value) if isinstance(value, np.integer) else value
+        return Document(page_content=self._texts[start:end].decode('utf-8'), metadata=metadata)
@@ -0,0 +1,179 @@
+import atexit
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """Persistent, size-bounded cache of embedding vectors, shared by every process on the host.
+
+    The whole cache is one memory-mapped file of fixed-size records (key,
+    last-use time, checksum, vector) organised as a set-associative table:
+    a key can only live in the ``WAYS`` records of the set its hash picks,
+    and a full set overwrites its least recently used record. There is no
+    separate index to keep in memory or rewrite, so web workers, the
+    inference sidecar and the bulk-ingest CLI can all use the same
+    directory. Writers take an ``flock`` on the file; readers take no lock
+    and treat a record whose checksum does not match its key and vector
+    (one being overwritten) as a miss.
+    """
+
+    WAYS = 8
+
+    def __init__(self, path, max_entries):
+        self.path = Path(path)
+        self.sets = max(1, max_entries // self.WAYS)
+        self.max_entries = self.sets * self.WAYS
+        # flock excludes other processes; threads of this one share the fd
+        self._lock = threading.Lock()
+        self._fd = None
+        self._records = None
+        self._dim = None
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _file_path(self, dim):
+        return self.path / f"vectors-{dim}x{self.max_entries}.bin"
+
+    def _open(self, dim=None):
+        """Map the cache file for ``dim`` (default: an existing file of this size), creating it if needed."""
+        if self._records is not None:
+            return True
+        if dim is None:
+            existing = sorted(self.path.glob(f"vectors-*x{self.max_entries}.bin"), key=lambda p: p.stat().st_mtime)
+            if not existing:
+                return False
+            dim = int(existing[-1].name.split('-')[1].split('x')[0])
+        self.path.mkdir(parents=True, exist_ok=True)
+        dtype = np.dtype([('key', '<u8', (2,)), ('used', '<f8'), ('check', '<u4'), ('pad', '<u4'),
+                          ('vector', '<f4', (dim,))])
+        size = dtype.itemsize * self.max_entries
+        # Never truncate: another process may already be using the file
+        fd = os.open(self._file_path(dim), os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._dim = dim
+        self._records = np.memmap(self._file_path(dim), dtype=dtype, mode="r+", shape=(self.max_entries,))
+        logger.info(f"Opened embedding cache {self._file_path(dim)} ({self.max_entries} entries)")
+        return True
+
+    def _locate(self, key):
+        digest = bytes.fromhex(key)
+        words = np.frombuffer(digest[:16], dtype='<u8')
+        # Python ints: numpy would take uint64 % int through float64 and lose the low bits
+        start = int(words[0]) % self.sets * self.WAYS
+        return words, start
+
+    @staticmethod
+    def _checksum(words, vector):
+        return zlib.crc32(vector.tobytes(), zlib.crc32(words.tobytes()))
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            if not self._open():
+                return found
+            records = self._records
+            now = time.time()
+            for key in keys:
+                words, start = self._locate(key)
+                ways = records[start:start + self.WAYS]
+                for way in np.flatnonzero((ways['key'] == words).all(axis=1)):
+                    vector = np.array(ways['vector'][way])
+                    if ways['used'][way] and ways['check'][way] == self._checksum(words, vector):
+                        # Racy with other readers, but it only affects which record is evicted next
+                        ways['used'][way] = now
+                        found[key] = vector
+                        break
+        return found
+
+    def put_many(self, items):
+        items = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in items]
+        if not items:
+            return
+        with self._lock:
+            self._open(items[0][1].shape[0])
+            records = self._records
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                for key, vector in items:
+                    words, start = self._locate(key)
+                    ways = records[start:start + self.WAYS]
+                    matches = np.flatnonzero((ways['key'] == words).all(axis=1))
+                    # The key's own record, else an empty one, else the least recently used
+                    way = int(matches[0]) if len(matches) else int(np.argmin(ways['used']))
+                    ways['used'][way] = 0
+                    ways['key'][way] = words
+                    ways['vector'][way] = vector
+                    ways['check'][way] = self._checksum(words, vector)
+                    ways['used'][way] = now
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def flush(self):
+        with self._lock:
+            if self._records is not None:
+                self._records.flush()
+
+    def __len__(self):
+        with self._lock:
+            if not self._open():
+                return 0
+            return int(np.count_nonzero(self._records['used']))
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the encoder on cache misses."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in computed)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.cache.key(self.model_name, text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key].tolist()
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many([(key, vector)])
+        return list(vector)
@@ -0,0 +1,212 @@
+import argparse
+import inspect
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+from config import Config, UPLOAD_FOLDER
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('huggingface', 'onnx')
+QUANTIZED_FILE = "model_int8.onnx"
+
+
+def export_onnx(model_name, model_dir):
+    """Export a sentence-transformers model to ONNX with int8 (dynamically quantized) weights.
+
+    The export is built in a temp directory and renamed into place, so
+    workers starting together never load a half-written model.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    model_dir = Path(model_dir)
+    tmp_dir = model_dir.parent / f".{model_dir.name}.tmp-{os.getpid()}"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Exporting {model_name} to int8 ONNX in {model_dir}...")
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(["an example sentence"], return_tensors='pt')
+        # Traced inputs follow forward()'s order, not the tokenizer's: name them in that order,
+        # or attention_mask and token_type_ids trade places in the exported graph
+        names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+        axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+        axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        # torch >= 2.9 defaults to the dynamo exporter, which needs onnxscript and ignores dynamic_axes
+        exporter = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(sample[name] for name in names), str(tmp_dir / "model.onnx"),
+                              input_names=names, output_names=['last_hidden_state'],
+                              dynamic_axes=axes, opset_version=14, **exporter)
+        quantize_dynamic(str(tmp_dir / "model.onnx"), str(tmp_dir / QUANTIZED_FILE), weight_type=QuantType.QInt8)
+        os.remove(tmp_dir / "model.onnx")
+        tokenizer.save_pretrained(str(tmp_dir))
+        if model_dir.exists():
+            shutil.rmtree(tmp_dir)
+        else:
+            os.replace(tmp_dir, model_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+class OnnxEmbeddings(Embeddings):
+    """all-MiniLM-style sentence embeddings from an int8 ONNX export, on onnxruntime.
+
+    Mean-pools the last hidden state over the attention mask and
+    L2-normalises, like the sentence-transformers pipeline. Texts are
+    sorted by length before batching, so each batch is only padded to its
+    own longest text.
+    """
+
+    def __init__(self, model_dir, batch_size=64, threads=0, max_length=256):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(Path(model_dir) / QUANTIZED_FILE), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.batch_size = batch_size
+        self.max_length = max_length
+        # Fast tokenizers are not safe to call from several threads at once
+        self._tokenizer_lock = threading.Lock()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(texts, padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors='np')
+        hidden = self.session.run(None, {name: encoded[name].astype(np.int64) for name in self.input_names})[0]
+        mask = encoded['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def create_embeddings(backend=None) -> Embeddings:
+    """Build the embedding backend selected by EMBEDDING_BACKEND."""
+    backend = backend or Config.EMBEDDING_BACKEND
+    if backend == 'huggingface':
+        if Config.EMBEDDING_THREADS > 0:
+            import torch
+            torch.set_num_threads(Config.EMBEDDING_THREADS)
+        return HuggingFaceEmbeddings(
+            model_name=Config.EMBEDDING_MODEL,
+            model_kwargs={'device': 'cpu'}
+        )
+    if backend == 'onnx':
+        model_dir = Path(Config.EMBEDDING_ONNX_DIR)
+        if not (model_dir / QUANTIZED_FILE).exists():
+            export_onnx(Config.EMBEDDING_MODEL, model_dir)
+        return OnnxEmbeddings(model_dir, batch_size=Config.EMBED_BATCH_SIZE,
+                              threads=Config.EMBEDDING_THREADS, max_length=Config.EMBEDDING_MAX_LENGTH)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+def cache_name(backend=None):
+    """Embedding-cache namespace: vectors from different backends must not mix."""
+    backend = backend or Config.EMBEDDING_BACKEND
+    return Config.EMBEDDING_MODEL if backend == 'huggingface' else f"{Config.EMBEDDING_MODEL}@{backend}"
+
+
+def check_parity(reference: Embeddings, candidate: Embeddings, texts: List[str], k=5, queries=100):
+    """Compare two backends on the same chunks.
+
+    Reports the cosine similarity of their vectors for each chunk, the
+    overlap of their top-``k`` chunks for ``queries`` short queries (the
+    opening words of sampled chunks) and the throughput of each.
+    """
+    timings = {}
+    vectors = {}
+    for label, embeddings in (('reference', reference), ('candidate', candidate)):
+        started = time.perf_counter()
+        vectors[label] = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        timings[label] = time.perf_counter() - started
+
+    ref, cand = vectors['reference'], vectors['candidate']
+    cosine = (ref * cand).sum(axis=1) / np.clip(np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1), 1e-12, None)
+
+    sample = [' '.join(text.split()[:12]) for text in texts[::max(1, len(texts) // queries)]][:queries]
+    k = min(k, len(texts))
+    overlaps = []
+    for query in sample:
+        tops = []
+        for label, embeddings in (('reference', reference), ('candidate', candidate)):
+            scores = vectors[label] @ np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            tops.append(set(np.argsort(-scores)[:k].tolist()))
+        overlaps.append(len(tops[0] & tops[1]) / k)
+
+    return {
+        'texts': len(texts),
+        'queries': len(sample),
+        'k': k,
+        'min_cosine': round(float(cosine.min()), 4),
+        'mean_cosine': round(float(cosine.mean()), 4),
+        'recall_at_k': round(float(np.mean(overlaps)), 4),
+        'reference_per_sec': round(len(texts) / timings['reference'], 1),
+        'candidate_per_sec': round(len(texts) / timings['candidate'], 1),
+        'speedup': round(timings['reference'] / timings['candidate'], 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check an embedding backend against the reference backend.")
+    parser.add_argument('paths', nargs='*', help="PDF files or directories to take chunks from (default: the upload folder)")
+    parser.add_argument('--backend', default='onnx', choices=BACKENDS)
+    parser.add_argument('--reference', default='huggingface', choices=BACKENDS)
+    parser.add_argument('--limit', type=int, default=2000, help="maximum number of chunks")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--min-recall', type=float, default=0.95, help="fail below this top-k overlap")
+    args = parser.parse_args(argv)
+
+    from ingest import iter_document_batches
+
+    texts = []
+    for path in map(Path, args.paths or [UPLOAD_FOLDER]):
+        for pdf in (sorted(path.glob("**/*.pdf")) if path.is_dir() else [path]):
+            texts.extend(doc.page_content for batch in iter_document_batches(str(pdf)) for doc in batch)
+            if len(texts) >= args.limit:
+                break
+        if len(texts) >= args.limit:
+            break
+    texts = texts[:args.limit]
+    if not texts:
+        logger.warning("No documents found to compare on")
+        return 1
+
+    report = check_parity(create_embeddings(args.reference), create_embeddings(args.backend), texts, k=args.k)
+    print(json.dumps(dict(report, reference=args.reference, backend=args.backend,
+                          threads=Config.EMBEDDING_THREADS or os.cpu_count()), indent=2))
+    return 0 if report['recall_at_k'] >= args.min_recall else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+import logging
+import math
+import time
+
+import faiss
+import numpy as np
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw')
+
+
+def choose_index_type(n_vectors, configured=None):
+    """Pick an index type for ``n_vectors`` unless one is configured."""
+    configured = configured or Config.INDEX_TYPE
+    if configured != 'auto':
+        if configured not in INDEX_TYPES:
+            raise ValueError(f"Unknown INDEX_TYPE '{configured}', expected auto or one of {INDEX_TYPES}")
+        return configured
+    if n_vectors < Config.ANN_MIN_VECTORS:
+        return 'flat'
+    if n_vectors < Config.IVF_MIN_VECTORS:
+        return 'hnsw'
+    return 'ivfpq' if Config.INDEX_PQ else 'ivf'
+
+
+def ivf_lists(n_vectors):
+    # ~4*sqrt(n) lists, with at least 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def build_index(vectors: np.ndarray, index_type):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, Config.HNSW_M)
+        index.hnsw.efConstruction = Config.HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = Config.HNSW_EF_SEARCH
+    elif index_type in ('ivf', 'ivfpq'):
+        nlist = ivf_lists(n)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % Config.PQ_M:
+                raise ValueError(f"PQ_M={Config.PQ_M} must divide the embedding size {dim}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, Config.PQ_M, 8)
+        # Train on a bounded sample; more points than this add little to k-means
+        sample_size = min(n, nlist * 256)
+        sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+        index.train(sample)
+        index.nprobe = min(Config.IVF_NPROBE, nlist)
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'")
+
+    index.add(vectors)
+    return index
+
+
+def evaluate_index(index, vectors: np.ndarray, k=10, n_queries=200):
+    """Measure recall@k against exact search and per-query latency."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n = vectors.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(n, min(n_queries, n), replace=False)]
+    queries = queries + rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    latencies = []
+    found = np.empty_like(truth)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        found[i] = ids[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    recall = np.mean([len(set(truth[i]) & set(found[i])) / k for i in range(len(queries))])
+    return {
+        'vectors': int(n),
+        'queries': int(len(queries)),
+        'k': int(k),
+        'recall_at_k': round(float(recall), 4),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3)
+    }
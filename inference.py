@@ -0,0 +1,229 @@
+import inspect
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from config import Config
+from registry import registry
+from model import open_answer, scheduler
+from scheduler import AdmissionError
+import metrics
+from metrics import Trace
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+class _LineReader:
+    """Newline-delimited JSON messages from a socket that may have a timeout set."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b''
+
+    def read(self):
+        """Next message, None at end of stream; socket.timeout propagates."""
+        while b'\n' not in self._buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    """One request per connection: a JSON line in, one or more JSON lines out."""
+
+    def handle(self):
+        request = _LineReader(self.request).read()
+        if request is None:
+            return
+        op = request.get('op')
+        try:
+            if op == 'query':
+                self.query(request)
+            elif op == 'embed':
+                _send(self.request, {'vectors': registry.get('embeddings').embed_documents(request['texts'])})
+            elif op == 'embed_query':
+                _send(self.request, {'vector': registry.get('embeddings').embed_query(request['text'])})
+            elif op == 'status':
+                _send(self.request, {'resources': registry.status(), 'scheduler': scheduler.status()})
+            elif op == 'metrics':
+                _send(self.request, {'text': metrics.render()})
+            else:
+                _send(self.request, {'type': 'error', 'message': f"Unknown operation '{op}'"})
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Inference client went away during '{op}'")
+        except Exception as e:
+            logger.error(f"Error handling inference request '{op}': {str(e)}")
+            try:
+                _send(self.request, {'type': 'error', 'message': str(e)})
+            except OSError:
+                pass
+
+    def query(self, request):
+        trace = Trace()
+        cancel = threading.Event()
+        try:
+            source, cached = open_answer(request['query'], request.get('documents') or None, trace, cancel)
+        except AdmissionError as e:
+            _send(self.request, {'type': 'rejected', 'message': str(e), 'status': e.status,
+                                 'retry_after': e.retry_after})
+            return
+
+        # The client hangs up to cancel (or because its own client left)
+        threading.Thread(target=self._watch_hangup, args=(cancel,), daemon=True).start()
+        try:
+            _send(self.request, {'type': 'accepted', 'cached': cached})
+            for event in source:
+                _send(self.request, event)
+            _send(self.request, {'type': 'end', 'stages': trace.stages})
+        except OSError:
+            cancel.set()
+            if inspect.getgeneratorstate(source) == inspect.GEN_CREATED:
+                # Closing an unstarted stream would leak its scheduler ticket;
+                # with cancel set it hands the ticket back and ends
+                for _ in source:
+                    pass
+        finally:
+            source.close()
+
+    def _watch_hangup(self, cancel):
+        try:
+            while self.request.recv(1024):
+                pass
+        except OSError:
+            pass
+        cancel.set()
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """The inference sidecar: owns the LLM, embeddings and index for all web workers."""
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, InferenceHandler)
+        os.chmod(path, 0o660)
+
+
+class InferenceClient:
+    """Talks to the inference sidecar on ``path``; one connection per request."""
+
+    def __init__(self, path, connect_timeout=5.0, poll=0.5):
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.poll = poll
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def call(self, request, timeout=None):
+        """Send one request and return its single reply."""
+        with self._connect() as sock:
+            sock.settimeout(timeout)
+            _send(sock, request)
+            reply = _LineReader(sock).read()
+        if reply is None:
+            raise ConnectionError("Inference sidecar closed the connection")
+        if reply.get('type') == 'error':
+            raise RuntimeError(reply['message'])
+        return reply
+
+    def open_answer(self, query, documents=None, trace=None, cancel=None):
+        """Same contract as model.open_answer, served by the sidecar.
+
+        Returns ``(events, cached)``; raises AdmissionError if the sidecar
+        rejects the query (or cannot be reached). Setting ``cancel`` or
+        closing ``events`` hangs up, which stops the generation.
+        """
+        cancel = cancel or threading.Event()
+        trace = trace or Trace()
+        try:
+            sock = self._connect()
+        except OSError as e:
+            logger.error(f"Inference sidecar unavailable at {self.path}: {str(e)}")
+            raise AdmissionError("Inference service unavailable, try again later", status=503)
+        try:
+            sock.settimeout(None)
+            _send(sock, {'op': 'query', 'query': query, 'documents': documents})
+            reader = _LineReader(sock)
+            reply = reader.read()
+        except Exception:
+            sock.close()
+            raise
+        if reply is None or reply['type'] != 'accepted':
+            sock.close()
+            if reply is None:
+                raise AdmissionError("Inference service unavailable, try again later", status=503)
+            if reply['type'] == 'error':
+                raise RuntimeError(reply['message'])
+            raise AdmissionError(reply['message'], status=reply['status'], retry_after=reply['retry_after'])
+        return self._events(sock, reader, trace, cancel), reply['cached']
+
+    def _events(self, sock, reader, trace, cancel):
+        sock.settimeout(self.poll)
+        try:
+            while not cancel.is_set():
+                try:
+                    event = reader.read()
+                except socket.timeout:
+                    continue
+                if event is None:
+                    yield {'type': 'error', 'message': "Inference service closed the connection"}
+                    return
+                if event['type'] == 'end':
+                    trace.merge(event['stages'])
+                    return
+                yield event
+        finally:
+            sock.close()
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings computed by the sidecar's model (and its embedding cache)."""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.call({'op': 'embed', 'texts': texts})['vectors']
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.call({'op': 'embed_query', 'text': text})['vector']
+
+
+def main():
+    if not Config.INFERENCE_SOCKET:
+        raise SystemExit("Set INFERENCE_SOCKET to the Unix socket path to listen on")
+    registry.warm(['embeddings', 'vectorstore', 'llm'] + [f'llm:{slot}' for slot in range(1, Config.LLM_SLOTS)])
+    server = InferenceServer(Config.INFERENCE_SOCKET)
+    logger.info(f"Inference sidecar listening on {Config.INFERENCE_SOCKET}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(Config.INFERENCE_SOCKET)
+
+
+if __name__ == "__main__":
+    main()
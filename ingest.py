@@ -0,0 +1,120 @@
+import logging
+import re
+import time
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+from langchain_core.documents import Document
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\S+")
+
+
+def iter_pages(filepath) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) one page at a time."""
+    with fitz.open(filepath) as doc:
+        for page in doc:
+            yield page.number, page.get_text()
+
+
+@lru_cache(maxsize=None)
+def embedding_tokenizer():
+    """The embedding model's tokenizer, or None if it can't be loaded here."""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(Config.EMBEDDING_MODEL)
+    except Exception as e:
+        logger.warning(f"Could not load the {Config.EMBEDDING_MODEL} tokenizer, chunks are bounded by "
+                       f"CHUNK_TOKENS words only and may be truncated by the embedder: {e}")
+        return None
+
+
+def piece_counts(tokenizer, text, spans) -> np.ndarray:
+    """Number of the tokenizer's word pieces in each whitespace word ``spans`` of ``text``."""
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)['offset_mapping']
+    starts = np.asarray([start for start, _ in offsets], dtype=np.int64)
+    # A piece belongs to the last word that starts at or before it
+    owners = np.searchsorted(np.asarray([start for start, _ in spans]), starts, side='right') - 1
+    return np.bincount(owners[owners >= 0], minlength=len(spans))
+
+
+def iter_chunks(pages: Iterable[Tuple[int, str]], source, chunk_tokens=None, overlap=None,
+                tokenizer=None, max_pieces=None) -> Iterator[Document]:
+    """Split pages into overlapping chunks of at most ``chunk_tokens`` tokens.
+
+    Tokens are whitespace-separated words. A chunk also stops before it
+    exceeds ``max_pieces`` word pieces of the embedding model's
+    ``tokenizer`` (default: EMBEDDING_MAX_LENGTH less the special tokens),
+    since the embedder would silently drop the rest: identifiers, numbers
+    and non-English text take several pieces per word.
+    """
+    chunk_tokens = chunk_tokens or Config.CHUNK_TOKENS
+    overlap = Config.CHUNK_OVERLAP if overlap is None else overlap
+    tokenizer = tokenizer or embedding_tokenizer()
+    if tokenizer is not None and max_pieces is None:
+        max_pieces = Config.EMBEDDING_MAX_LENGTH - tokenizer.num_special_tokens_to_add()
+    chunk_index = 0
+
+    for page_number, text in pages:
+        spans = [m.span() for m in TOKEN_PATTERN.finditer(text)]
+        if not spans:
+            continue
+        cumulative = None
+        if tokenizer is not None:
+            cumulative = np.concatenate([[0], np.cumsum(piece_counts(tokenizer, text, spans))])
+        start = 0
+        while True:
+            end = min(start + chunk_tokens, len(spans))
+            if cumulative is not None:
+                # Most words whose pieces fit, but at least one
+                fits = int(np.searchsorted(cumulative, cumulative[start] + max_pieces, side='right')) - 1
+                end = max(start + 1, min(end, fits))
+            window = spans[start:end]
+            yield Document(
+                page_content=text[window[0][0]:window[-1][1]],
+                metadata={'source': str(source), 'page': page_number, 'chunk': chunk_index}
+            )
+            chunk_index += 1
+            if end >= len(spans):
+                break
+            start = max(end - overlap, start + 1)
+
+
+def iter_batches(items: Iterable, batch_size) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_document_batches(filepath, batch_size=None) -> Iterator[List[Document]]:
+    """Stream a PDF as fixed-size batches of chunk Documents."""
+    pages = iter_pages(filepath)
+    chunks = iter_chunks(pages, filepath)
+    yield from iter_batches(chunks, batch_size or Config.EMBED_BATCH_SIZE)
+
+
+def extract_document(filepath, chunks, batch_size=None):
+    """Extract and chunk a PDF in the bulk-ingest process pool, streaming it to the parent.
+
+    Puts ``('batch', filepath, texts, metadatas)`` on the ``chunks`` queue
+    for each batch, then ``('done', filepath, pages, seconds)``; the worker
+    never holds more than one batch.
+    """
+    started = time.perf_counter()
+    doc_id = Path(filepath).name
+    pages = 0
+    for batch in iter_document_batches(filepath, batch_size):
+        chunks.put(('batch', filepath, [doc.page_content for doc in batch],
+                    [dict(doc.metadata, doc_id=doc_id) for doc in batch]))
+        pages = batch[-1].metadata['page'] + 1
+    chunks.put(('done', filepath, pages, time.perf_counter() - started))
@@ -1,45 +1,334 @@
+import argparse
+import json
+import multiprocessing
 import os
-from pathlib import Path
 import logging
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from datacreate import publish_document
+from ingest import extract_document
+from manifest import (load_manifest, save_manifest, find_by_hash, file_sha256, live_paths, retire, make_entry,
+                      index_write_lock)
+from shards import ShardWriter, shard_name, shard_path, rebuild_global_index, migrate_legacy_store
+from registry import registry, DB_FAISS_PATH
+from config import UPLOAD_FOLDER, Config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Progress of the current bulk run; present only while a run is unfinished
+CHECKPOINT_PATH = DB_FAISS_PATH / "bulk_ingest.json"
+
+
+def load_checkpoint():
+    if not CHECKPOINT_PATH.exists():
+        return None
+    with open(CHECKPOINT_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint):
+    tmp_path = CHECKPOINT_PATH.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def publish_rebuild(documents):
+    """Replace every document in the manifest with a rebuild's ``documents``, in one save.
+
+    Until then queries are served by the previous version, complete; after
+    it, by the new one. Shards only the previous version used are retired
+    and deleted once the queries still reading them have finished. Entries
+    whose shard was collected while the rebuild ran (e.g. a document
+    deleted meanwhile) are left out.
+    """
+    with index_write_lock:
+        manifest = load_manifest()
+        previous = live_paths(manifest)
+        documents = dict(documents)
+        for doc_id, entry in list(documents.items()):
+            if not shard_path(entry['shard']).exists():
+                logger.error(f"Shard {entry['shard']} of {doc_id} was removed during the rebuild, leaving it out")
+                del documents[doc_id]
+        manifest['documents'] = documents
+        current = live_paths(manifest)
+        # Shards reused from the previous version may have been retired since
+        manifest['retired'] = [item for item in manifest.get('retired', []) if item['path'] not in current]
+        for path in sorted(previous - current):
+            retire(manifest, path)
+        save_manifest(manifest)
+    logger.info(f"Published rebuilt index with {len(documents)} documents")
+
+
+class PendingDocument:
+    """A document being extracted by a worker, whose chunks are embedded into its shard as they arrive.
+
+    Only chunks not yet embedded are held; ``extracted`` is set once the
+    worker has sent the last of them.
+    """
+
+    def __init__(self, filepath, sha256, doc_id=None):
+        self.filepath = filepath
+        self.sha256 = sha256
+        self.doc_id = doc_id
+        self.pages = 0
+        self.extracted = False
+        self.texts = []
+        self.metadatas = []
+        self.writer = ShardWriter(shard_name(sha256))
+
+    def receive(self, texts, metadatas):
+        if self.doc_id:
+            metadatas = [dict(metadata, doc_id=self.doc_id) for metadata in metadatas]
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+
+    def take(self, count):
+        texts, metadatas = self.texts[:count], self.metadatas[:count]
+        del self.texts[:count], self.metadatas[:count]
+        return texts, metadatas
+
+    @property
+    def remaining(self):
+        return len(self.texts)
+
+
+def bulk_ingest(pdf_files, workers=None, batch_size=None, rebuild=False, restart=False, names=None):
+    """Index many PDFs: extract in a process pool, embed in batches, checkpoint per document.
+
+    Every finished document is published to the manifest straight away, so
+    an interrupted run loses at most the documents in flight, and running
+    it again skips everything already indexed. ``restart`` discards an
+    unfinished run's checkpoint. ``names`` maps content hashes to the
+    document ids to index them under (default: the file name).
+
+    ``rebuild`` replaces the whole index with ``pdf_files`` blue/green:
+    documents are staged in the checkpoint instead of published, shards
+    whose content is already indexed are reused as they are, and the new
+    set is swapped in at the end (``publish_rebuild``). Queries see the old
+    index, complete, until then. A document that fails keeps its previous
+    version, if it had one.
+    """
+    workers = workers or os.cpu_count() or 1
+    batch_size = batch_size or Config.EMBED_BATCH_SIZE
+    DB_FAISS_PATH.mkdir(parents=True, exist_ok=True)
+
+    checkpoint = None if restart else load_checkpoint()
+    if checkpoint:
+        logger.info(f"Resuming bulk ingest started at {checkpoint['started_at']} "
+                    f"({len(checkpoint['done'])} documents already done)")
+        rebuild = checkpoint.get('rebuild', False)
+    else:
+        checkpoint = {'started_at': datetime.utcnow().isoformat(), 'done': [], 'failed': [],
+                      'rebuild': rebuild, 'documents': {}}
+        save_checkpoint(checkpoint)
+    names = names or {}
+    migrate_legacy_store()
+    # Documents of a rebuild, published all at once when it ends
+    staged = checkpoint.setdefault('documents', {})
+
+    manifest = load_manifest()
+    done = set(checkpoint['done'])
+    todo, hashes, path_hashes = [], set(), {}
+    staged_hashes = {entry.get('sha256') for entry in staged.values()}
+    for path in map(str, pdf_files):
+        if path in done:
+            continue
+        sha256 = path_hashes[path] = file_sha256(path)
+        # Identical files would share (and race on) one content-addressed shard
+        if sha256 in hashes:
+            continue
+        if not rebuild:
+            if find_by_hash(manifest, sha256) is None:
+                hashes.add(sha256)
+                todo.append(path)
+            continue
+        if sha256 in staged_hashes:
+            continue
+        hashes.add(sha256)
+        existing = manifest['documents'].get(find_by_hash(manifest, sha256))
+        if existing and existing.get('shard') == shard_name(sha256) and shard_path(existing['shard']).exists():
+            # Content-addressed: re-embedding it would produce the shard that is already there
+            doc_id = names.get(sha256) or Path(path).name
+            staged[doc_id] = dict(existing, filename=doc_id)
+            checkpoint['done'].append(path)
+        else:
+            todo.append(path)
+    if rebuild:
+        save_checkpoint(checkpoint)
+    logger.info(f"Bulk ingest: {len(todo)} of {len(pdf_files)} documents to index, {workers} extract workers")
+
+    embeddings = registry.get('embeddings')
+    stats = {'documents': 0, 'pages': 0, 'chunks': 0,
+             'extract_seconds': 0.0, 'embed_seconds': 0.0, 'write_seconds': 0.0}
+    failed = []
+    # filepath -> PendingDocument, for documents submitted to the pool
+    pending = {}
+    started = time.perf_counter()
+
+    def fail(filepath, reason):
+        logger.error(f"Failed to index {filepath}: {reason}")
+        failed.append(filepath)
+        checkpoint['failed'].append(filepath)
+        save_checkpoint(checkpoint)
+
+    def finish(doc: PendingDocument):
+        write_started = time.perf_counter()
+        doc.writer.commit()
+        if rebuild:
+            doc_id = doc.doc_id or Path(doc.filepath).name
+            staged[doc_id] = make_entry(doc.filepath, doc.sha256, doc.writer.name, doc.writer.count, doc.pages, doc_id)
+        else:
+            publish_document(doc.filepath, doc.sha256, doc.writer.name, doc.writer.count, doc.pages, doc_id=doc.doc_id)
+        stats['write_seconds'] += time.perf_counter() - write_started
+        stats['documents'] += 1
+        stats['pages'] += doc.pages
+        stats['chunks'] += doc.writer.count
+        checkpoint['done'].append(doc.filepath)
+        save_checkpoint(checkpoint)
+        logger.info(f"[{stats['documents']}/{len(todo)}] {doc.filepath}: {doc.pages} pages, {doc.writer.count} chunks "
+                    f"({stats['pages'] / (time.perf_counter() - started):.1f} pages/s so far)")
+
+    def drop(filepath, reason):
+        doc = pending.pop(filepath, None)
+        if doc is not None:
+            doc.writer.abort()
+        fail(filepath, reason)
+
+    def embed_ready(flush=False):
+        # Batches span documents so that small files still fill the embedder;
+        # each document's slice of the vectors goes to its own shard
+        while True:
+            available = sum(doc.remaining for doc in pending.values())
+            if not available or (available < batch_size and not flush):
+                break
+            parts = []
+            size = 0
+            for doc in pending.values():
+                take = min(doc.remaining, batch_size - size)
+                if take:
+                    parts.append((doc,) + doc.take(take))
+                    size += take
+                if size == batch_size:
+                    break
+            embed_started = time.perf_counter()
+            vectors = embeddings.embed_documents([text for _, texts, _ in parts for text in texts])
+            stats['embed_seconds'] += time.perf_counter() - embed_started
+            offset = 0
+            for doc, texts, metadatas in parts:
+                doc.writer.add(texts, vectors[offset:offset + len(texts)], metadatas)
+                offset += len(texts)
+        for doc in [doc for doc in pending.values() if doc.extracted and not doc.remaining]:
+            del pending[doc.filepath]
+            finish(doc)
+
+    def handle(message):
+        kind, filepath = message[:2]
+        doc = pending.get(filepath)
+        if doc is None:
+            # Chunks of a document that already failed
+            return
+        if kind == 'batch':
+            doc.receive(*message[2:])
+            return
+        doc.pages, seconds = message[2:]
+        doc.extracted = True
+        stats['extract_seconds'] += seconds
+        if not doc.writer.count and not doc.remaining:
+            drop(filepath, "no text could be extracted")
+
+    # spawn rather than fork: the parent holds the embedding model and its threads
+    context = multiprocessing.get_context('spawn')
+    # The manager shuts down first: if embedding fails, workers blocked on a
+    # full queue then fail too instead of keeping the pool from exiting
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool, context.Manager() as manager:
+        # Workers stream chunk batches through a bounded queue, so neither
+        # they nor the parent ever hold a whole document's chunks
+        chunks = manager.Queue(maxsize=workers * 4)
+        queued = iter(todo)
+        in_flight = {}
+        while True:
+            while len(in_flight) < workers:
+                path = next(queued, None)
+                if path is None:
+                    break
+                sha256 = path_hashes[path]
+                pending[path] = PendingDocument(path, sha256, doc_id=names.get(sha256))
+                in_flight[pool.submit(extract_document, path, chunks, batch_size)] = path
+            if not in_flight:
+                break
+            try:
+                handle(chunks.get(timeout=0.1))
+                while True:
+                    handle(chunks.get_nowait())
+            except queue.Empty:
+                pass
+            for future in [future for future in in_flight if future.done()]:
+                path = in_flight.pop(future)
+                if future.exception() is not None:
+                    drop(path, future.exception())
+            embed_ready()
+        # Every worker has finished: what is left in the queue is all there is
+        while not chunks.empty():
+            handle(chunks.get())
+        embed_ready(flush=True)
+
+    elapsed = time.perf_counter() - started
+    report = dict(
+        {key: round(value, 3) for key, value in stats.items()},
+        failed=failed,
+        seconds=round(elapsed, 3),
+        pages_per_sec=round(stats['pages'] / elapsed, 3),
+        chunks_per_sec=round(stats['chunks'] / elapsed, 3)
+    )
+    logger.info(f"Bulk ingest report: {json.dumps(report)}")
+
+    if rebuild:
+        for path in failed:
+            doc_id = names.get(path_hashes.get(path)) or Path(path).name
+            if doc_id not in staged and doc_id in manifest['documents']:
+                logger.warning(f"Keeping the previous version of {doc_id}")
+                staged[doc_id] = manifest['documents'][doc_id]
+        publish_rebuild(staged)
+
+    try:
+        rebuild_global_index(registry.get('vectorstore'))
+    except Exception as e:
+        logger.error(f"Error rebuilding global index: {e}")
+
+    if not failed:
+        CHECKPOINT_PATH.unlink(missing_ok=True)
+    return report
+
+
+def indexed_names():
+    """Content hash -> document id of the current index.
+
+    Uploads are stored under their content hash; a rebuild keeps the names
+    they were uploaded as.
+    """
+    return {entry['sha256']: doc_id for doc_id, entry in load_manifest()['documents'].items() if entry.get('sha256')}
+
+
 def create_vector_store():
+    """Rebuild the whole vector store from the PDFs in the upload folder."""
     try:
-        # Setup paths
-        base_dir = Path(__file__).parent
-        data_dir = base_dir / "uploads"
-        db_faiss_path = base_dir / "vectorstoredb_faiss"
-
-        # Create directories if they don't exist
-        data_dir.mkdir(exist_ok=True)
-        db_faiss_path.parent.mkdir(exist_ok=True)
-
-        logger.info(f"Loading documents from {data_dir}")
-        loader = DirectoryLoader(str(data_dir), glob="**/*.pdf", loader_cls=PyPDFLoader)
-        documents = loader.load()
-        
-        if not documents:
+        UPLOAD_FOLDER.mkdir(exist_ok=True)
+        pdf_files = sorted(UPLOAD_FOLDER.glob("**/*.pdf"))
+        if not pdf_files:
             logger.warning("No documents found to process")
             return False
 
-        logger.info(f"Loaded {len(documents)} documents")
-
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",  # Add the model name
-            model_kwargs={'device': 'cpu'}
-        )
+        logger.info(f"Rebuilding vector store from {len(pdf_files)} documents in {UPLOAD_FOLDER}")
+        report = bulk_ingest(pdf_files, rebuild=True, names=indexed_names())
+        if report['failed']:
+            logger.error(f"Failed to index: {', '.join(report['failed'])}")
+            return False
 
-        logger.info("Creating vector store...")
-        db = FAISS.from_documents(documents, embeddings)
-        
-        logger.info(f"Saving vector store to {db_faiss_path}")
-        db.save_local(str(db_faiss_path))
-        
         logger.info("Vector store created successfully")
         return True
 
@@ -47,5 +336,29 @@ def create_vector_store():
         logger.error(f"Error creating vector store: {str(e)}")
         raise
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-index PDFs into the vector store.")
+    parser.add_argument('paths', nargs='*', help="PDF files or directories (default: the upload folder)")
+    parser.add_argument('--workers', type=int, help="extraction processes (default: one per core)")
+    parser.add_argument('--batch-size', type=int, help="chunks per embedding call (default: EMBED_BATCH_SIZE)")
+    parser.add_argument('--rebuild', action='store_true', help="replace the index with these documents once they are all indexed")
+    parser.add_argument('--restart', action='store_true', help="ignore an unfinished run's checkpoint")
+    args = parser.parse_args(argv)
+
+    pdf_files = []
+    for path in map(Path, args.paths or [UPLOAD_FOLDER]):
+        pdf_files.extend(sorted(path.glob("**/*.pdf")) if path.is_dir() else [path])
+    if not pdf_files:
+        logger.warning("No documents found to process")
+        return 1
+
+    report = bulk_ingest([path.resolve() for path in pdf_files], workers=args.workers,
+                         batch_size=args.batch_size, rebuild=args.rebuild, restart=args.restart,
+                         names=indexed_names() if args.rebuild else None)
+    print(json.dumps(report, indent=2))
+    return 1 if report['failed'] else 0
+
+
 if __name__ == "__main__":
-    create_vector_store()
+    raise SystemExit(main())
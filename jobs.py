@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from streams import AsyncWakeups
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    pass
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class IngestJobQueue:
+    """Bounded background worker pool for document ingestion.
+
+    Job records are persisted in a MongoDB collection; progress events are
+    also kept in memory so that SSE clients can follow a running job.
+    """
+
+    def __init__(self, collection, handler, workers=1, max_pending=4, keep_events=100):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._events = OrderedDict()
+        self._finished = set()
+        self._keep_events = keep_events
+        self._cond = threading.Condition()
+        self._wakeups = AsyncWakeups()
+        self._threads = []
+
+    def start(self):
+        # Jobs left queued or running by a process that has since died cannot be resumed
+        for job in self.collection.find({'status': {'$in': ['queued', 'running']}}, {'job_id': True, 'owner_pid': True}):
+            if not _pid_alive(job.get('owner_pid')):
+                self._update(job['job_id'], {'status': 'error', 'error': 'Interrupted by server restart'})
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, filepath, filename):
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        record = {
+            'job_id': job_id,
+            'filename': filename,
+            'filepath': filepath,
+            'status': 'queued',
+            'owner_pid': os.getpid(),
+            'progress': {},
+            'created_at': now,
+            'updated_at': now
+        }
+        self.collection.insert_one(record)
+        with self._cond:
+            self._events[job_id] = []
+            while len(self._events) > self._keep_events:
+                old_id, _ = self._events.popitem(last=False)
+                self._finished.discard(old_id)
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._cond:
+                self._events.pop(job_id, None)
+            self.collection.delete_one({'job_id': job_id})
+            raise QueueFullError("Ingestion queue is full, try again later")
+
+        self._publish(job_id, {'step': 'queued', 'status': 'inProgress', 'message': 'Waiting for an ingestion worker',
+                               'position': self._queue.qsize()})
+        return job_id
+
+    def get(self, job_id):
+        return self.collection.find_one({'job_id': job_id}, {'_id': False})
+
+    def find_active(self, filepath):
+        """Id of a queued or running job for ``filepath``, if any."""
+        record = self.collection.find_one({'filepath': filepath, 'status': {'$in': ['queued', 'running']}},
+                                          {'job_id': True})
+        return record['job_id'] if record else None
+
+    def stream(self, job_id, keepalive=15):
+        """Yield progress events for a job until it finishes.
+
+        Yields None when no event arrived within ``keepalive`` seconds so the
+        caller can send an SSE comment and notice disconnected clients.
+        """
+        index = 0
+        while True:
+            with self._cond:
+                events = self._events.get(job_id)
+                if events is None:
+                    break
+                if index >= len(events) and job_id not in self._finished:
+                    self._cond.wait(keepalive)
+                pending = events[index:]
+                index += len(pending)
+                finished = job_id in self._finished and index >= len(events)
+            if not pending and not finished:
+                yield None
+            for event in pending:
+                yield event
+            if finished:
+                return
+
+        # Not tracked in memory (e.g. another process handled it): report the stored state
+        record = self.get(job_id)
+        if record is not None:
+            yield {'step': record['status'], 'status': record['status'], 'job_id': job_id,
+                   'progress': record.get('progress', {}), 'error': record.get('error')}
+
+    async def astream(self, job_id, keepalive=15, collection=None):
+        """Async form of ``stream``; ``collection`` is an async driver handle for the job records."""
+        index = 0
+        with self._wakeups.waiter() as wakeup:
+            while True:
+                wakeup.clear()
+                with self._cond:
+                    events = self._events.get(job_id)
+                    if events is None:
+                        break
+                    pending = events[index:]
+                    index += len(pending)
+                    finished = job_id in self._finished and index >= len(events)
+                for event in pending:
+                    yield event
+                if finished:
+                    return
+                if not pending:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), keepalive)
+                    except asyncio.TimeoutError:
+                        yield None
+
+        if collection is not None:
+            record = await collection.find_one({'job_id': job_id}, {'_id': False})
+        else:
+            record = self.get(job_id)
+        if record is not None:
+            yield {'step': record['status'], 'status': record['status'], 'job_id': job_id,
+                   'progress': record.get('progress', {}), 'error': record.get('error')}
+
+    def _publish(self, job_id, event, final=False):
+        event = dict(event, job_id=job_id)
+        with self._cond:
+            if job_id in self._events:
+                self._events[job_id].append(event)
+            if final:
+                self._finished.add(job_id)
+            self._cond.notify_all()
+        self._wakeups.notify()
+
+    def _update(self, job_id, fields):
+        fields['updated_at'] = datetime.utcnow()
+        self.collection.update_one({'job_id': job_id}, {'$set': fields})
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                logger.error(f"Ingest job {job_id} crashed: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        record = self.get(job_id)
+        self._update(job_id, {'status': 'running', 'started_at': datetime.utcnow()})
+        progress = {}
+
+        def report(step, message, **counts):
+            progress.update(counts)
+            self._update(job_id, {'progress': dict(progress), 'step': step})
+            self._publish(job_id, dict({'step': step, 'status': 'inProgress', 'message': message}, **counts))
+
+        try:
+            success = self.handler(record['filepath'], record['filename'], progress=report)
+        except Exception as e:
+            logger.error(f"Ingest job {job_id} failed: {str(e)}")
+            success, error = False, str(e)
+        else:
+            error = None if success else "Failed to create vector database"
+
+        if success:
+            self._update(job_id, {'status': 'complete', 'finished_at': datetime.utcnow()})
+            self._publish(job_id, {'step': 'vectordb', 'status': 'complete',
+                                   'message': 'Vector database created successfully'}, final=True)
+        else:
+            self._update(job_id, {'status': 'error', 'error': error, 'finished_at': datetime.utcnow()})
+            self._publish(job_id, {'step': 'vectordb', 'status': 'error', 'message': error}, final=True)
@@ -0,0 +1,131 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from registry import DB_FAISS_PATH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = DB_FAISS_PATH / "manifest.json"
+
+
+class ManifestLock:
+    """Serialises manifest writers: threads through a lock, processes through ``flock``.
+
+    Every load -> modify -> save of the manifest happens under it, so web
+    workers, their maintenance threads and the bulk-ingest CLI never save
+    over each other's changes. Reentrant within a thread. The lock file is
+    opened on each acquisition, so a forked worker never shares its
+    parent's lock.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if not self._depth:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if not self._depth:
+            # Closing the file releases the flock
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+index_write_lock = ManifestLock(DB_FAISS_PATH / "manifest.lock")
+
+
+def file_sha256(filepath, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Return the index manifest: {'documents': {doc_id: entry}}."""
+    path = Path(path)
+    if not path.exists():
+        return {'documents': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    # Write to a temp file and rename so readers never see a half-written manifest
+    path = Path(path)
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    # The mtime is the version readers compare (index_version); file times
+    # are only as fine as the kernel tick, so make sure two saves differ
+    mtime = max(time.time_ns(), index_version(path) + 1)
+    os.utime(tmp_path, ns=(mtime, mtime))
+    os.replace(tmp_path, path)
+
+
+def index_version(path=MANIFEST_PATH):
+    """Cheap token that changes whenever a writer saves the manifest."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def find_by_hash(manifest, sha256):
+    for doc_id, entry in manifest['documents'].items():
+        if entry.get('sha256') == sha256:
+            return doc_id
+    return None
+
+
+def live_paths(manifest):
+    """Shard and global index directories (relative to DB_FAISS_PATH) the manifest points at."""
+    paths = {f"shards/{entry['shard']}" for entry in manifest['documents'].values() if entry.get('shard')}
+    if manifest.get('global'):
+        paths.add(f"global/{manifest['global']['name']}")
+    return paths
+
+
+def retire(manifest, path):
+    """Queue a directory no longer referenced by ``manifest`` for garbage collection."""
+    manifest.setdefault('retired', []).append({'path': path, 'retired_at': time.time()})
+
+
+def make_entry(filepath, sha256, shard, chunks, pages, doc_id=None):
+    return {
+        'filename': doc_id or Path(filepath).name,
+        'sha256': sha256,
+        'shard': shard,
+        'chunks': chunks,
+        'pages': pages,
+        'indexed_at': datetime.utcnow().isoformat()
+    }
@@ -0,0 +1,138 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_metrics = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, optionally labelled."""
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                series['buckets'][position] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, series['buckets']):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, [('le', f"{bound:g}")])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return '\n'.join(lines)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return '\n'.join(lines)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in _metrics) + '\n'
+
+
+STAGE_SECONDS = Histogram('rag_stage_seconds', 'Duration of each timed query and ingestion stage',
+                          labelnames=('stage',))
+TIME_TO_FIRST_TOKEN = Histogram('rag_time_to_first_token_seconds',
+                                'Time from receiving a query to its first generated token')
+TOKENS_PER_SECOND = Histogram('rag_generation_tokens_per_second', 'Decode speed of each generation',
+                              buckets=RATE_BUCKETS)
+QUEUE_WAIT = Histogram('rag_queue_wait_seconds', 'Time queries waited for an inference slot')
+INGEST_PAGES_PER_SECOND = Histogram('rag_ingest_pages_per_second', 'Ingestion throughput per document',
+                                    buckets=RATE_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram('rag_http_request_seconds', 'Time until the response (or stream) starts',
+                                 labelnames=('method', 'route', 'status'))
+QUERIES = Counter('rag_queries_total', 'Answered queries by outcome', labelnames=('outcome',))
+
+
+class Trace:
+    """Per-request stage timings.
+
+    Each stage is also observed in ``rag_stage_seconds``; ``as_dict`` gives
+    the breakdown (in milliseconds) that is stored with the request record.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def merge(self, stages):
+        """Add stage timings (in seconds) measured and observed in another process."""
+        with self._lock:
+            for stage, seconds in stages.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        with self._lock:
+            timings = {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+        timings['total'] = round(self.elapsed() * 1000, 3)
+        return timings
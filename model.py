@@ -1,17 +1,24 @@
 import os
+import re
 import logging
 from pathlib import Path
 from typing import Iterator
 import threading
+import time
 from queue import Queue
 
 from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
 from langchain.prompts import PromptTemplate
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_community.llms import CTransformers
 from langchain.chains import RetrievalQA
-from config import DATA_DIR
+from config import DATA_DIR, Config
+from registry import registry
+from shards import ShardedRetriever
+from context import ContextPacker, token_counter
+from manifest import index_version
+from answer_cache import AnswerCache
+from scheduler import InferenceScheduler, AdmissionError, DeadlineExceededError
+from metrics import Trace, QUERIES, QUEUE_WAIT, TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -20,7 +27,6 @@ logger = logging.getLogger(__name__)
 # Update paths
 BASE_DIR = Path(__file__).parent.parent
 MODEL_PATH = BASE_DIR / "backend" /"ai-model"/ "llama-2-7b-chat.ggmlv3.q8_0.bin"
-DB_FAISS_PATH = Path(__file__).parent / "vectorstoredb_faiss"
 
 custom_prompt_template = """Use the following pieces of information to answer the user's question.
 If you don't know the answer, just say that you don't know, don't try to make up an answer.
@@ -46,7 +52,8 @@ def load_llm():
         llm = CTransformers(
             model=str(MODEL_PATH),
             model_type="llama",
-            max_new_tokens=2048,
+            # The same limit as the per-request token budget (see QueueCallback)
+            max_new_tokens=Config.MAX_GENERATION_TOKENS,
             temperature=0.3,
             context_length=4096,
             n_ctx=4096, # Explicitly set n_ctx
@@ -58,90 +65,292 @@ def load_llm():
         logger.error(f"Error loading model: {str(e)}")
         raise
 
-from langchain_core.callbacks import BaseCallbackHandler, CallbackManager
+# One model instance per generation slot; slot 0 is the registry's 'llm'
+registry.register('llm', load_llm)
+for _slot in range(1, Config.LLM_SLOTS):
+    registry.register(f'llm:{_slot}', load_llm)
+
+def llm_for_slot(slot: int = 0):
+    return registry.get('llm' if not slot else f'llm:{slot}')
+
+scheduler = InferenceScheduler(
+    slots=Config.LLM_SLOTS,
+    max_queue=Config.LLM_MAX_QUEUE,
+    timeout=Config.LLM_QUEUE_TIMEOUT
+)
+
+answer_cache = AnswerCache(
+    max_entries=Config.ANSWER_CACHE_SIZE,
+    ttl=Config.ANSWER_CACHE_TTL,
+    threshold=Config.ANSWER_CACHE_THRESHOLD
+)
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
 
 class QueueCallback(BaseCallbackHandler):
-    def __init__(self, queue: Queue):
+    # Let GenerationCancelled escape the callback manager and stop the
+    # token loop inside the LLM instead of being logged and swallowed
+    raise_error = True
+
+    def __init__(self, queue: Queue, cancel_event: threading.Event = None,
+                 max_tokens: int = None, max_seconds: float = None):
         super().__init__()
         self.queue = queue
+        self.cancel_event = cancel_event or threading.Event()
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.tokens = 0
 
     def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self.cancel_event.is_set():
+            raise GenerationCancelled("client disconnected")
         self.queue.put({'type': 'token', 'token': token})
+        self.tokens += 1
+        if self.max_tokens and self.tokens >= self.max_tokens:
+            raise GenerationCancelled(f"token budget of {self.max_tokens} reached")
+        if self.deadline and time.monotonic() > self.deadline:
+            raise GenerationCancelled("time budget exceeded")
+
+class TimingCallback(BaseCallbackHandler):
+    """Records prompt evaluation and decode spans of one LLM run into a Trace."""
+
+    def __init__(self, trace: Trace):
+        super().__init__()
+        self.trace = trace
+        self.llm_started = None
+        self.first_token = None
+        self.tokens = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.llm_started = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        now = time.perf_counter()
+        self.tokens += 1
+        if self.first_token is None:
+            self.first_token = now
+            self.trace.record('prompt_eval', now - self.llm_started)
+            TIME_TO_FIRST_TOKEN.observe(self.trace.elapsed())
 
     def on_llm_end(self, response, **kwargs) -> None:
-        self.queue.put(None)
+        self._finish()
+
+    def on_llm_error(self, error, **kwargs) -> None:
+        self._finish()
 
-def qa_bot(streaming=False, queue=None):
+    def _finish(self):
+        if self.llm_started is None:
+            return
+        if self.first_token is None:
+            # Nothing was streamed, so prompt evaluation and decoding can't be told apart
+            self.trace.record('generate', time.perf_counter() - self.llm_started)
+            return
+        decode = time.perf_counter() - self.first_token
+        self.trace.record('decode', decode)
+        if self.tokens > 1 and decode > 0:
+            TOKENS_PER_SECOND.observe((self.tokens - 1) / decode)
+
+def qa_bot(slot=0, documents=None, trace=None):
+    # Embeddings, index and LLM come from the process-wide registry, so only
+    # the (cheap) chain object is built per query.
     try:
-        logger.info("Initializing embeddings...")
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-        
-        if not DB_FAISS_PATH.exists():
-            raise FileNotFoundError(f"Vector store not found at {DB_FAISS_PATH}")
-        
-        logger.info(f"Loading vector store from {DB_FAISS_PATH}")
-        # db = FAISS.load_local(str(DB_FAISS_PATH), embeddings)
-        db = FAISS.load_local(str(DB_FAISS_PATH), embeddings, allow_dangerous_deserialization=True)
-
-
-        logger.info("Vector store loaded successfully")
-        
-        callbacks = []
-        if streaming and queue:
-            callbacks.append(QueueCallback(queue))
-        
-        llm = load_llm()
+        index = registry.get('vectorstore')
+        llm = llm_for_slot(slot)
+
+        packer = None
+        if Config.CONTEXT_PACKING:
+            packer = ContextPacker(
+                count_tokens=token_counter(llm),
+                budget=Config.CONTEXT_TOKEN_BUDGET,
+                min_k=Config.RETRIEVAL_K,
+                max_k=Config.RETRIEVAL_MAX_K,
+                gap_ratio=Config.CONTEXT_GAP_RATIO,
+                duplicate_threshold=Config.CONTEXT_DUPLICATE_THRESHOLD
+            )
+
         qa_prompt = set_custom_prompt()
         qa = RetrievalQA.from_chain_type(
             llm=llm,
             chain_type='stuff',
-            retriever=db.as_retriever(search_kwargs={'k': 2}),
+            retriever=ShardedRetriever(index=index, k=Config.RETRIEVAL_K, documents=documents, trace=trace,
+                                       packer=packer),
             return_source_documents=True,
-            chain_type_kwargs={'prompt': qa_prompt},
-            callback_manager=CallbackManager(callbacks)
+            chain_type_kwargs={'prompt': qa_prompt}
         )
         return qa
     except Exception as e:
         logger.error(f"Error in qa_bot: {str(e)}")
         raise
 
-def stream_response(query: str) -> Iterator[dict]:
-    queue = Queue()
-    qa = qa_bot(streaming=True, queue=queue)
-    
-    def process_query():
-        response = qa({'query': query})
-        queue.put({'type': 'sources', 'data': response.get('source_documents', [])})
-    
-    thread = threading.Thread(target=process_query)
-    thread.start()
+def run_qa(qa, query: str, callbacks=None) -> dict:
+    # Run-time callbacks are inherited by the nested LLM run, unlike the
+    # chain's own callback_manager, so token streaming reaches the queue
+    return qa({'query': query}, callbacks=callbacks)
+
+def answer_scope(documents=None):
+    return tuple(sorted(documents)) if documents else None
+
+def lookup_cached_answer(query: str, documents=None, trace=None):
+    """Return (query_vector, index_version, cached_entry_or_None)."""
+    with (trace or Trace()).span('embed_query'):
+        vector = registry.get('embeddings').embed_query(query)
+    version = index_version()
+    return vector, version, answer_cache.lookup(vector, version, answer_scope(documents))
+
+def replay_cached_answer(entry) -> Iterator[dict]:
+    # Replay in word-sized tokens so clients see the same stream format
+    for token in re.findall(r"\s*\S+\s*", entry['answer']):
+        yield {'type': 'token', 'token': token}
+    yield {'type': 'sources', 'sources': [str(doc) for doc in entry['sources']]}
+
+def stream_response(query: str, ticket=None, lookup=None, documents=None, trace=None,
+                    cancel: threading.Event = None) -> Iterator[dict]:
+    """Stream an answer as token/sources/queue/error dicts.
+
+    ``ticket`` is a scheduler ticket admitted by the caller (so that it can
+    reject with 429/503 before streaming starts); ``lookup`` is the result of
+    ``lookup_cached_answer`` if the caller already ran it. ``documents``
+    limits retrieval to those document ids. Stage timings are recorded in
+    ``trace`` (see metrics.Trace). Setting ``cancel`` stops the generation at
+    its next token, as does closing the stream.
+    """
+    cancel = cancel or threading.Event()
+    trace = trace or Trace()
+    vector, version, cached = lookup or lookup_cached_answer(query, documents, trace)
+    if cached is not None:
+        if ticket is not None:
+            scheduler.cancel(ticket)
+        QUERIES.inc(outcome='cache_hit')
+        yield from replay_cached_answer(cached)
+        return
+
+    if ticket is None:
+        ticket = scheduler.submit()
+    started = False
+    try:
+        # Tell the client where it is in line while it waits for a slot
+        try:
+            for position in scheduler.wait(ticket):
+                if cancel.is_set():
+                    return
+                yield {'type': 'queue', 'position': position}
+        except DeadlineExceededError as e:
+            QUERIES.inc(outcome='queue_timeout')
+            yield {'type': 'error', 'message': str(e)}
+            return
+        if cancel.is_set():
+            # Abandoned while queued: give the slot back without generating
+            QUERIES.inc(outcome='cancelled')
+            return
+        trace.record('queue_wait', ticket.queue_wait or 0.0)
+        QUEUE_WAIT.observe(ticket.queue_wait or 0.0)
+
+        queue = Queue()
+        callback = QueueCallback(queue, cancel, max_tokens=Config.MAX_GENERATION_TOKENS,
+                                 max_seconds=Config.MAX_GENERATION_SECONDS)
+        with trace.span('setup'):
+            qa = qa_bot(slot=ticket.slot, documents=documents, trace=trace)
+
+        def process_query():
+            try:
+                # The timing callback goes first so it still sees the token
+                # on which QueueCallback stops the generation
+                response = run_qa(qa, query, callbacks=[TimingCallback(trace), callback])
+                queue.put({'type': 'sources', 'data': response.get('source_documents', [])})
+                QUERIES.inc(outcome='generated')
+            except GenerationCancelled as e:
+                logger.info(f"Generation stopped after {callback.tokens} tokens: {e.reason}")
+                QUERIES.inc(outcome='cancelled' if cancel.is_set() else 'truncated')
+                if not cancel.is_set():
+                    queue.put({'type': 'error', 'message': f"Answer truncated: {e.reason}"})
+            except Exception as e:
+                logger.error(f"Error generating answer: {str(e)}")
+                QUERIES.inc(outcome='error')
+                queue.put({'type': 'error', 'message': str(e)})
+            finally:
+                scheduler.release(ticket)
+                queue.put(None)
+
+        thread = threading.Thread(target=process_query)
+        thread.start()
+        started = True
+    finally:
+        if not started:
+            scheduler.cancel(ticket)
     
     current_text = []
-    while True:
-        token = queue.get()
-        if token is None:
-            break
-        elif isinstance(token, dict) and token.get('type') == 'sources':
-            yield {
-                'type': 'sources',
-                'sources': [str(doc) for doc in token['data']]
-            }
-            # Removed 'break' to allow finishing streaming tokens
-        else:
-            current_text.append(token)
-            yield {
-                'type': 'token',
-                'text': ''.join(current_text),
-                'token': token
-            }
-
-def final_result(query: str, stream: bool = False):
+    sources = None
+    finished = False
+    try:
+        while True:
+            token = queue.get()
+            if token is None:
+                finished = True
+                break
+            elif isinstance(token, dict) and token.get('type') == 'sources':
+                sources = token['data']
+                yield {
+                    'type': 'sources',
+                    'sources': [str(doc) for doc in sources]
+                }
+            elif isinstance(token, dict) and token.get('type') == 'error':
+                yield token
+            else:
+                current_text.append(token['token'])
+                yield {'type': 'token', 'token': token['token']}
+    finally:
+        # Runs when the consumer closes the stream early (client disconnect);
+        # the worker stops at its next token and frees the slot
+        if not finished:
+            cancel.set()
+
+    if sources is not None:
+        answer_cache.store(vector, version, ''.join(current_text), sources, answer_scope(documents))
+
+def final_result(query: str, stream: bool = False, ticket=None, lookup=None, documents=None, trace=None,
+                 cancel=None):
     if stream:
-        return stream_response(query)
+        return stream_response(query, ticket=ticket, lookup=lookup, documents=documents, trace=trace,
+                               cancel=cancel)
     else:
-        qa = qa_bot()
-        response = qa({'query': query})
+        trace = trace or Trace()
+        vector, version, cached = lookup_cached_answer(query, documents, trace)
+        if cached is not None:
+            QUERIES.inc(outcome='cache_hit')
+            return {'query': query, 'result': cached['answer'], 'source_documents': cached['sources']}
+        ticket = scheduler.submit()
+        try:
+            slot = scheduler.acquire(ticket)
+            trace.record('queue_wait', ticket.queue_wait or 0.0)
+            QUEUE_WAIT.observe(ticket.queue_wait or 0.0)
+            with trace.span('setup'):
+                qa = qa_bot(slot=slot, documents=documents, trace=trace)
+            response = run_qa(qa, query, callbacks=[TimingCallback(trace)])
+            QUERIES.inc(outcome='generated')
+        finally:
+            scheduler.cancel(ticket)
+        answer_cache.store(vector, version, response['result'], response.get('source_documents', []),
+                           answer_scope(documents))
         return response
+
+def open_answer(query: str, documents=None, trace=None, cancel=None):
+    """Admit a query for streaming; returns ``(events, answered_from_cache)``.
+
+    Raises AdmissionError before anything is streamed if the query can't
+    be served: unknown documents (400) or a full scheduler (429/503).
+    """
+    if documents:
+        try:
+            registry.get('vectorstore').select(documents)
+        except KeyError as e:
+            raise AdmissionError(str(e.args[0]), status=400)
+    lookup = lookup_cached_answer(query, documents, trace)
+    ticket = scheduler.submit() if lookup[2] is None else None
+    events = final_result(query, stream=True, ticket=ticket, lookup=lookup, documents=documents, trace=trace,
+                          cancel=cancel)
+    return events, lookup[2] is not None
@@ -0,0 +1,108 @@
+import atexit
+import base64
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, DESCENDING
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BulkWriter:
+    """Buffers MongoDB writes and applies them in batches from a background thread.
+
+    ``insert`` and ``upsert`` never block the caller: operations wait in a
+    bounded queue and are sent with one unordered ``bulk_write`` per batch,
+    either when ``batch_size`` operations are pending or every
+    ``flush_interval`` seconds. If the queue is full the write is dropped and
+    logged rather than stalling a request.
+    """
+
+    def __init__(self, collection, batch_size=100, flush_interval=1.0, max_pending=10000):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name=f"bulk-writer-{collection.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def insert(self, document):
+        self._submit(InsertOne(document))
+
+    def upsert(self, filter, fields):
+        self._submit(UpdateOne(filter, {'$set': fields}, upsert=True))
+
+    def flush(self):
+        """Block until every operation submitted so far has been written."""
+        self._queue.join()
+
+    def _submit(self, operation):
+        try:
+            self._queue.put_nowait(operation)
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Write buffer for {self.collection.name} is full, dropping a write ({self.dropped} dropped)")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                self.collection.bulk_write(batch, ordered=False)
+            except Exception as e:
+                logger.error(f"Error writing {len(batch)} records to {self.collection.name}: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+def encode_cursor(document, sort_field):
+    value = document.get(sort_field)
+    if isinstance(value, datetime):
+        value = {'$date': value.isoformat()}
+    payload = json.dumps({'v': value, 'id': str(document['_id'])}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (sort value, ObjectId); raises ValueError for a malformed cursor."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value = payload['v']
+        if isinstance(value, dict) and '$date' in value:
+            value = datetime.fromisoformat(value['$date'])
+        return value, ObjectId(payload['id'])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def paginate(collection, filter, sort_field, cursor=None, limit=50, projection=None):
+    """Keyset pagination, newest first: ``(page, next_cursor)``.
+
+    Pages are ordered by ``(sort_field, _id)`` descending, so a compound
+    index ending in those fields serves every page without skipping or
+    sorting in memory. ``next_cursor`` is None on the last page.
+    """
+    query = dict(filter)
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        query['$or'] = [{sort_field: {'$lt': value}}, {sort_field: value, '_id': {'$lt': last_id}}]
+    results = list(collection.find(query, projection)
+                   .sort([(sort_field, DESCENDING), ('_id', DESCENDING)])
+                   .limit(limit + 1))
+    page = results[:limit]
+    next_cursor = encode_cursor(page[-1], sort_field) if len(results) > limit else None
+    for document in page:
+        document.pop('_id', None)
+    return page, next_cursor
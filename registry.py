@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+from config import Config
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embeddings import create_embeddings, cache_name
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DB_FAISS_PATH = Path(Config.VECTOR_STORE_DIR)
+
+
+class ResourceRegistry:
+    """Process-wide cache of heavyweight resources (models, indexes).
+
+    Each resource is registered with a zero-argument loader and is loaded at
+    most once per process. Loading is guarded by a per-resource lock so that a
+    slow LLM load never blocks requests that only need the embeddings.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._locks = {}
+        self._resources = {}
+        self._status = {}
+        self._guard = threading.Lock()
+
+    def register(self, name, loader):
+        with self._guard:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._status.setdefault(name, {'state': 'unloaded'})
+
+    def get(self, name):
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+
+        if name not in self._loaders:
+            raise KeyError(f"No loader registered for resource '{name}'")
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            resource = self._resources.get(name)
+            if resource is not None:
+                return resource
+
+            self._status[name] = {'state': 'loading'}
+            started = time.perf_counter()
+            try:
+                resource = self._loaders[name]()
+            except Exception as e:
+                self._status[name] = {'state': 'error', 'error': str(e)}
+                raise
+            self._resources[name] = resource
+            self._status[name] = {
+                'state': 'ready',
+                'load_seconds': round(time.perf_counter() - started, 3)
+            }
+            logger.info(f"Resource '{name}' loaded in {self._status[name]['load_seconds']}s")
+            return resource
+
+    def invalidate(self, name):
+        """Drop a cached resource so the next get() reloads it."""
+        with self._locks[name]:
+            self._resources.pop(name, None)
+            self._status[name] = {'state': 'unloaded'}
+
+    def warm(self, names=None):
+        for name in names or list(self._loaders):
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Failed to warm resource '{name}': {str(e)}")
+
+    def warm_async(self, names=None):
+        thread = threading.Thread(target=self.warm, args=(names,), name="registry-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {name: dict(state) for name, state in self._status.items()}
+
+    def is_ready(self, names=None):
+        status = self.status()
+        return all(status.get(name, {}).get('state') == 'ready' for name in names or status)
+
+
+registry = ResourceRegistry()
+
+
+def load_embeddings():
+    logger.info(f"Initializing embeddings ({Config.EMBEDDING_MODEL}, {Config.EMBEDDING_BACKEND} backend)...")
+    embeddings = create_embeddings()
+    if Config.EMBEDDING_CACHE_SIZE <= 0:
+        return embeddings
+    cache = EmbeddingCache(Config.EMBEDDING_CACHE_DIR, Config.EMBEDDING_CACHE_SIZE)
+    return CachedEmbeddings(embeddings, cache, cache_name())
+
+
+registry.register('embeddings', load_embeddings)
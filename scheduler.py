@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class AdmissionError(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status."""
+
+    def __init__(self, message, status=429, retry_after=5):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.slot = None
+        self.granted = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.queue_wait = None
+
+
+class InferenceScheduler:
+    """Admission control and FIFO queueing for a fixed number of LLM slots.
+
+    ``submit`` admits a request or fails fast (429 when the wait queue is
+    full, 503 when the expected wait already exceeds the request deadline).
+    ``wait`` yields the ticket's queue position until a slot is granted.
+    Each slot maps to one loaded model instance and runs one generation.
+    """
+
+    def __init__(self, slots=1, max_queue=8, timeout=120):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._free = list(range(slots - 1, -1, -1))
+        self._waiting = deque()
+        # Moving average of how long a generation holds its slot
+        self._avg_service = None
+
+    def submit(self, timeout=None):
+        timeout = timeout or self.timeout
+        with self._lock:
+            if len(self._waiting) >= self.max_queue:
+                raise AdmissionError("Too many queued requests, try again later", status=429)
+            expected = self._expected_wait_locked(len(self._waiting))
+            if expected is not None and expected > timeout:
+                raise AdmissionError("Server is overloaded, try again later", status=503,
+                                     retry_after=int(expected - timeout) + 1)
+            ticket = Ticket(time.monotonic() + timeout)
+            self._waiting.append(ticket)
+            self._dispatch_locked()
+        return ticket
+
+    def wait(self, ticket, poll=1.0):
+        """Yield the 1-based queue position until ``ticket`` holds a slot."""
+        while not ticket.granted.is_set():
+            remaining = ticket.deadline - time.monotonic()
+            if remaining <= 0:
+                if self._withdraw(ticket):
+                    raise DeadlineExceededError("Timed out waiting for a generation slot")
+                break
+            if ticket.granted.wait(min(poll, remaining)):
+                break
+            position = self.position(ticket)
+            if position:
+                yield position
+
+    def acquire(self, ticket):
+        """Blocking form of ``wait`` for callers that do not stream."""
+        for _ in self.wait(ticket):
+            pass
+        return ticket.slot
+
+    def position(self, ticket):
+        with self._lock:
+            try:
+                return self._waiting.index(ticket) + 1
+            except ValueError:
+                return 0
+
+    def release(self, ticket):
+        with self._lock:
+            if ticket.slot is None:
+                return
+            held = time.monotonic() - ticket.enqueued_at - (ticket.queue_wait or 0)
+            self._avg_service = held if self._avg_service is None else 0.8 * self._avg_service + 0.2 * held
+            self._free.append(ticket.slot)
+            ticket.slot = None
+            self._dispatch_locked()
+
+    def cancel(self, ticket):
+        """Withdraw a ticket whether it is still queued or already holds a slot."""
+        if not self._withdraw(ticket):
+            self.release(ticket)
+
+    def status(self):
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'busy': self.slots - len(self._free),
+                'waiting': len(self._waiting),
+                'avg_generation_seconds': round(self._avg_service, 3) if self._avg_service else None
+            }
+
+    def _withdraw(self, ticket):
+        with self._lock:
+            try:
+                self._waiting.remove(ticket)
+                return True
+            except ValueError:
+                return False
+
+    def _expected_wait_locked(self, ahead):
+        if self._avg_service is None or self._free:
+            return None
+        return (ahead // self.slots + 1) * self._avg_service
+
+    def _dispatch_locked(self):
+        while self._free and self._waiting:
+            ticket = self._waiting.popleft()
+            ticket.slot = self._free.pop()
+            ticket.queue_wait = time.monotonic() - ticket.enqueued_at
+            ticket.granted.set()
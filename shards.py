@@ -0,0 +1,749 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PureWindowsPath
+from typing import List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from config import Config, UPLOAD_FOLDER
+from registry import registry, DB_FAISS_PATH
+from manifest import (load_manifest, save_manifest, index_version, index_write_lock, live_paths, retire, make_entry,
+                      file_sha256)
+from index_builder import choose_index_type, build_index, evaluate_index
+from docstore import DocstoreWriter, MmapDocstore
+from metrics import Trace
+from context import ContextPacker
+import bm25
+from bm25 import BM25Index, BM25Writer, reciprocal_rank_fusion
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARDS_PATH = DB_FAISS_PATH / "shards"
+INDEX_FILE = "index.faiss"
+# Corpus-wide ANN index over all shards, used for unscoped queries
+GLOBAL_PATH = DB_FAISS_PATH / "global"
+# Member name of the pre-shard root store in global indexes built before it was migrated
+LEGACY_SHARD = "_legacy"
+
+# Index files are never modified in place, so they can be mapped read-only
+# and shared between processes (zero-copy for flat codes needs faiss >= 1.10)
+READ_FLAGS = (getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+              if Config.INDEX_MMAP else 0)
+
+_search_pool = ThreadPoolExecutor(max_workers=Config.SEARCH_THREADS, thread_name_prefix="shard-search")
+_global_build_lock = threading.Lock()
+
+
+def shard_path(name):
+    return SHARDS_PATH / name
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process
+        return True
+    return True
+
+
+def sweep_temp_shards():
+    """Delete ShardWriter temp directories whose process died before committing or aborting."""
+    removed = []
+    for path in SHARDS_PATH.glob(".*.tmp-*"):
+        try:
+            pid = int(path.name.rsplit(".tmp-", 1)[1].split("-")[0])
+        except ValueError:
+            continue
+        if not _process_exists(pid):
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+    if removed:
+        logger.info(f"Removed {len(removed)} unfinished shard directories: {', '.join(removed)}")
+    return removed
+
+
+def shard_name(sha256):
+    # Shards are content-addressed, so a shard directory never changes once written
+    return sha256[:16]
+
+
+class Shard:
+    """A loaded shard: its FAISS index plus the docstore that maps a row to a Document."""
+
+    def __init__(self, index, docstore):
+        self.index = index
+        self.docstore = docstore
+
+    def document(self, row) -> Document:
+        return self.docstore.document(row)
+
+
+class ShardWriter:
+    """Streams one document's vectors, texts and BM25 postings into a new shard.
+
+    Everything is written to a temp directory and renamed into place by
+    ``commit``, so readers never see a partial shard. Nothing is pickled:
+    the shard is ``index.faiss`` plus a columnar docstore (see docstore.py).
+    """
+
+    def __init__(self, name):
+        SHARDS_PATH.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.count = 0
+        self._tmp_path = SHARDS_PATH / f".{name}.tmp-{os.getpid()}-{threading.get_ident()}"
+        self._index = None
+        self._docstore = DocstoreWriter(self._tmp_path)
+        self._lexical = BM25Writer()
+
+    def add(self, texts, vectors, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._index is None:
+            self._index = faiss.IndexFlatL2(vectors.shape[1])
+        self._index.add(vectors)
+        self._docstore.add(texts, metadatas)
+        self._lexical.add(texts)
+        self.count += len(texts)
+
+    def commit(self):
+        self._docstore.close()
+        faiss.write_index(self._index, str(self._tmp_path / INDEX_FILE))
+        self._lexical.save(self._tmp_path)
+        final_path = shard_path(self.name)
+        with index_write_lock:
+            # Same content as a retired shard: take it back before the collector deletes it
+            manifest = load_manifest()
+            retired = manifest.get('retired', [])
+            manifest['retired'] = [item for item in retired if item['path'] != f"shards/{self.name}"]
+            if len(manifest['retired']) != len(retired):
+                save_manifest(manifest)
+            if final_path.exists():
+                shutil.rmtree(self._tmp_path)
+                return final_path
+            os.replace(self._tmp_path, final_path)
+        return final_path
+
+    def abort(self):
+        self._docstore.close()
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+def load_shard(name) -> Shard:
+    path = shard_path(name)
+    return Shard(faiss.read_index(str(path / INDEX_FILE), READ_FLAGS), MmapDocstore(path))
+
+
+class IndexSnapshot:
+    """One published version of the index: which shard serves each document, and the global index.
+
+    Queries pin the snapshot they start on, so a version that has been
+    replaced stays readable (and its files stay on disk) until they finish.
+    """
+
+    def __init__(self, version, documents, global_index=None):
+        self.version = version
+        self.documents = documents
+        self.global_index = global_index
+        self.readers = 0
+
+    def shard_names(self):
+        names = set(self.documents.values())
+        if self.global_index is not None:
+            names |= self.global_index.members
+        return names
+
+    def paths(self):
+        paths = {f"shards/{name}" for name in self.shard_names()}
+        if self.global_index is not None:
+            paths.add(f"global/{self.global_index.name}")
+        return paths
+
+
+class ShardIndex:
+    """All per-document shards named by the current manifest.
+
+    The manifest is re-read whenever a writer (in any process) has saved a
+    new one, and becomes a new IndexSnapshot; queries pin the snapshot that
+    was current when they started (``snapshot()``), so publishing never
+    blocks or changes a query in flight. Shards are loaded lazily and kept
+    for as long as the current or a pinned snapshot references them.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        # Guards the current snapshot, reader counts and the shard caches
+        self._lock = threading.Lock()
+        # One manifest reload at a time; readers keep using the current snapshot meanwhile
+        self._refresh_lock = threading.Lock()
+        self._shards = {}
+        self._shard_locks = {}
+        self._lexical = {}
+        self._current = IndexSnapshot(None, {})
+        self._pinned = set()
+        self.refresh()
+
+    def refresh(self):
+        version = index_version()
+        if version == self._current.version:
+            return
+        with self._refresh_lock:
+            if version == self._current.version:
+                return
+            manifest = load_manifest()
+            documents = {doc_id: entry['shard'] for doc_id, entry in manifest['documents'].items() if entry.get('shard')}
+            snapshot = IndexSnapshot(version, documents, self._load_global(manifest.get('global')))
+            with self._lock:
+                self._current = snapshot
+                self._prune_locked()
+
+    def _load_global(self, info):
+        if not info:
+            return None
+        current = self._current.global_index
+        if current is not None and current.name == info['name']:
+            return current
+        try:
+            return GlobalIndex(info)
+        except Exception as e:
+            logger.error(f"Could not load global index {info['name']}, falling back to shard search: {str(e)}")
+            return None
+
+    @contextmanager
+    def snapshot(self):
+        """Pin the current version of the index for the duration of a query."""
+        self.refresh()
+        with self._lock:
+            snapshot = self._current
+            snapshot.readers += 1
+            self._pinned.add(snapshot)
+        try:
+            yield snapshot
+        finally:
+            with self._lock:
+                snapshot.readers -= 1
+                if not snapshot.readers:
+                    self._pinned.discard(snapshot)
+                    if snapshot is not self._current:
+                        self._prune_locked()
+
+    def _prune_locked(self):
+        live = self._current.shard_names()
+        for snapshot in self._pinned:
+            live |= snapshot.shard_names()
+        self._shards = {name: shard for name, shard in self._shards.items() if name in live}
+        self._shard_locks = {name: lock for name, lock in self._shard_locks.items() if name in live}
+        self._lexical = {name: bm for name, bm in self._lexical.items() if name in live}
+
+    def pinned_paths(self):
+        """Directories that this process may still read: the current and all pinned versions."""
+        with self._lock:
+            paths = self._current.paths()
+            for snapshot in self._pinned:
+                paths |= snapshot.paths()
+        return paths
+
+    @property
+    def version(self):
+        return self._current.version
+
+    def document_ids(self):
+        return list(self._current.documents)
+
+    def _shard(self, name) -> Shard:
+        shard = self._shards.get(name)
+        if shard is None:
+            # Per-shard lock: loading one shard doesn't hold up queries on the others
+            with self._lock:
+                lock = self._shard_locks.setdefault(name, threading.Lock())
+            with lock:
+                shard = self._shards.get(name)
+                if shard is None:
+                    shard = load_shard(name)
+                    with self._lock:
+                        self._shards[name] = shard
+        return shard
+
+    def select(self, documents: Optional[Sequence[str]] = None, snapshot: IndexSnapshot = None) -> List[str]:
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._current
+        if not documents:
+            return sorted(set(snapshot.documents.values()))
+        missing = [doc_id for doc_id in documents if doc_id not in snapshot.documents]
+        if missing:
+            raise KeyError(f"Unknown documents: {', '.join(missing)}")
+        return sorted({snapshot.documents[doc_id] for doc_id in documents})
+
+    def shard_sizes(self, snapshot: IndexSnapshot = None):
+        return {name: self._shard(name).index.ntotal for name in self.select(snapshot=snapshot)}
+
+    def search(self, vector, k, documents=None) -> List[Tuple[Document, float]]:
+        """Dense search: (document, L2 distance) pairs, nearest first."""
+        return self.search_batch([vector], k, documents)[0]
+
+    def search_batch(self, vectors, k, documents=None) -> List[List[Tuple[Document, float]]]:
+        """Dense search for many query vectors with one FAISS call per index."""
+        with self.snapshot() as snapshot:
+            return [[(self._document(name, row), distance) for name, row, distance in hits]
+                    for hits in self._dense_hits(snapshot, vectors, k, documents)]
+
+    def hybrid_search(self, query, vector, k, documents=None, fetch_k=None) -> List[Tuple[Document, float, float]]:
+        """Fuse dense and BM25 rankings with reciprocal rank fusion.
+
+        Each ranking contributes its top ``fetch_k`` hits; returns the fused
+        top ``k`` as (document, fused score, L2 distance) triples, best first.
+        The distance is exact for every hit, including those only BM25 found.
+        """
+        fetch_k = fetch_k or k * Config.HYBRID_FETCH_FACTOR
+        query_vector = np.asarray(vector, dtype=np.float32)
+        with self.snapshot() as snapshot:
+            dense = [(name, row) for name, row, _ in self._dense_hits(snapshot, [vector], fetch_k, documents)[0]]
+            lexical = self._lexical_hits(snapshot, query, fetch_k, documents)
+            fused = reciprocal_rank_fusion([dense, lexical], k, Config.RRF_K)
+            # Shard indexes are flat, so each hit's vector can be read back
+            return [(self._document(name, row), score,
+                     float(np.sum((self._shard(name).index.reconstruct(int(row)) - query_vector) ** 2)))
+                    for (name, row), score in fused]
+
+    def _lexical_hits(self, snapshot: IndexSnapshot, query, k, documents=None) -> List[Tuple[str, int]]:
+        """BM25 (shard, row) hits, best first.
+
+        Like dense search, unscoped queries use the global index's postings
+        for every shard it covers and only score newer shards separately.
+        Rows of shards deleted since it was built still count towards the
+        corpus statistics until compaction rebuilds it.
+        """
+        names = self.select(documents, snapshot)
+        global_index = snapshot.global_index if not documents else None
+        if global_index is None or global_index.lexical is None:
+            indexes = [(name, self._bm25(name)) for name in names]
+            return [(name, row) for name, row, _ in
+                    bm25.search([(name, index) for name, index in indexes if index is not None], query, k)]
+
+        live = set(names)
+        indexes = [(None, global_index.lexical)]
+        indexes += [(name, self._bm25(name)) for name in names if name not in global_index.members]
+        hits = []
+        for name, row, _ in bm25.search([(name, index) for name, index in indexes if index is not None],
+                                        query, global_index.fetch_k(k, live)):
+            if name is None:
+                name, row = global_index.locate(row)
+                if name not in live:
+                    continue
+            hits.append((name, row))
+        return hits[:k]
+
+    def _dense_hits(self, snapshot: IndexSnapshot, vectors, k, documents=None) -> List[List[Tuple[str, int, float]]]:
+        """Fan out to the selected shards and merge each query's top-k by distance.
+
+        All query vectors go to each index in one search call. Unscoped
+        queries use the global ANN index for every shard it covers and only
+        search newer shards directly.
+        """
+        names = self.select(documents, snapshot)
+        if not names:
+            raise FileNotFoundError(f"Vector store at {DB_FAISS_PATH} has no documents")
+
+        queries = np.asarray(vectors, dtype=np.float32)
+        hits = [[] for _ in range(len(queries))]
+        global_index = snapshot.global_index if not documents else None
+        if global_index is not None:
+            live = set(names)
+            # Skip rows from shards deleted or replaced since the global index was built
+            for query_hits, global_hits in zip(hits, global_index.search(queries, global_index.fetch_k(k, live))):
+                query_hits.extend(hit for hit in global_hits if hit[0] in live)
+            names = [name for name in names if name not in global_index.members]
+
+        def search_shard(name):
+            distances, rows = self._shard(name).index.search(queries, k)
+            return [[(name, int(row), float(distance)) for distance, row in zip(query_distances, query_rows) if row >= 0]
+                    for query_distances, query_rows in zip(distances, rows)]
+
+        if len(names) == 1:
+            shard_results = [search_shard(names[0])]
+        else:
+            shard_results = list(_search_pool.map(search_shard, names)) if names else []
+        for shard_hits in shard_results:
+            for query_hits, hits_for_shard in zip(hits, shard_hits):
+                query_hits.extend(hits_for_shard)
+        return [heapq.nsmallest(k, query_hits, key=lambda hit: hit[2]) for query_hits in hits]
+
+    def _document(self, name, row) -> Document:
+        return self._shard(name).document(row)
+
+    def _bm25(self, name) -> Optional[BM25Index]:
+        if name not in self._lexical:
+            path = shard_path(name)
+            # A shard without postings is searched dense-only
+            self._lexical[name] = BM25Index.load(path) if BM25Index.exists(path) else None
+        return self._lexical[name]
+
+
+class GlobalIndex:
+    """ANN index over the concatenated vectors of several shards, and their BM25 postings.
+
+    ``members`` lists ``[shard, count]`` in the order the shards' vectors
+    were added, so a global row id maps back to a shard and a row in it.
+    The lexical index uses the same row ids.
+    """
+
+    def __init__(self, info):
+        self.name = info['name']
+        self.members = {shard for shard, _ in info['members']}
+        self._shards = [shard for shard, _ in info['members']]
+        self._counts = dict(info['members'])
+        self._offsets = np.cumsum([0] + [count for _, count in info['members']])
+        path = GLOBAL_PATH / self.name
+        self.index = faiss.read_index(str(path / "index.faiss"), READ_FLAGS)
+        # Global indexes built before the lexical one was added have none
+        self.lexical = BM25Index.load(path) if BM25Index.exists(path) else None
+
+    def dead_vectors(self, live):
+        """Vectors of shards no longer in ``live`` (deleted or replaced documents)."""
+        return sum(count for shard, count in self._counts.items() if shard not in live)
+
+    def fetch_k(self, k, live):
+        # Dead rows are dropped after the search, so fetch enough to still leave k live ones
+        total = int(self._offsets[-1])
+        alive = max(total - self.dead_vectors(live), 1)
+        return min(total, int(np.ceil(k * 2 * total / alive)))
+
+    def search(self, vectors, k):
+        """(shard, row, distance) hits for each query vector, ``k`` per query (including dead ones)."""
+        distances, ids = self.index.search(np.asarray(vectors, dtype=np.float32), k)
+        results = []
+        for query_distances, query_ids in zip(distances, ids):
+            hits = []
+            for distance, global_id in zip(query_distances, query_ids):
+                if global_id < 0:
+                    continue
+                hits.append(self.locate(global_id) + (float(distance),))
+            results.append(hits)
+        return results
+
+    def locate(self, global_id):
+        """(shard, row) of a global row id."""
+        position = int(np.searchsorted(self._offsets, global_id, side='right')) - 1
+        return self._shards[position], int(global_id - self._offsets[position])
+
+
+def rebuild_global_index(index: ShardIndex, force=False):
+    """Build a new global ANN index if the corpus has outgrown the current one.
+
+    Returns the build report, or None if no rebuild was needed. Only one
+    build runs at a time; concurrent callers return immediately.
+    """
+    if not _global_build_lock.acquire(blocking=False):
+        return None
+    try:
+        with index.snapshot() as snapshot:
+            sizes = index.shard_sizes(snapshot)
+            total = sum(sizes.values())
+            current = load_manifest().get('global')
+            if not force:
+                if total < Config.ANN_MIN_VECTORS:
+                    return None
+                if current and total < current['vectors'] * Config.ANN_RETRAIN_GROWTH:
+                    return None
+
+            index_type = choose_index_type(total)
+            logger.info(f"Building {index_type} global index over {total} vectors in {len(sizes)} shards")
+            members = [[name, count] for name, count in sizes.items() if count]
+            vectors = np.vstack([index._shard(name).index.reconstruct_n(0, count) for name, count in members])
+            lexical = BM25Index.concatenate([(index._bm25(name), count) for name, count in members])
+
+        started = time.perf_counter()
+        ann = build_index(vectors, index_type)
+        report = dict(evaluate_index(ann, vectors), type=index_type,
+                      build_seconds=round(time.perf_counter() - started, 3))
+
+        name = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        path = GLOBAL_PATH / name
+        path.mkdir(parents=True)
+        faiss.write_index(ann, str(path / "index.faiss"))
+        lexical.save(path)
+        with open(path / "report.json", 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Global index report: {report}")
+
+        with index_write_lock:
+            manifest = load_manifest()
+            previous = manifest.get('global')
+            manifest['global'] = {'name': name, 'type': index_type, 'vectors': total, 'members': members}
+            if previous:
+                retire(manifest, f"global/{previous['name']}")
+            save_manifest(manifest)
+        collect_garbage(index)
+        return report
+    finally:
+        _global_build_lock.release()
+
+
+def compact_global_index(index: ShardIndex, threshold=None):
+    """Rebuild the global index from the live shards once deleted vectors make up ``threshold`` of it.
+
+    Until then, rows of deleted documents stay in the index and are
+    filtered out at query time. If the live corpus has become too small
+    for an ANN index, the global index is dropped and shards are searched
+    directly. Returns a report, or None if nothing was done.
+    """
+    threshold = Config.COMPACT_TOMBSTONE_RATIO if threshold is None else threshold
+    with index.snapshot() as snapshot:
+        global_index = snapshot.global_index
+        if global_index is None:
+            return None
+        total = global_index.index.ntotal
+        dead = global_index.dead_vectors(set(snapshot.documents.values()))
+    if not total or dead < threshold * total:
+        return None
+
+    logger.info(f"Compacting global index {global_index.name}: {dead} of {total} vectors are deleted")
+    if total - dead >= Config.ANN_MIN_VECTORS:
+        return rebuild_global_index(index, force=True)
+    if not _global_build_lock.acquire(blocking=False):
+        return None
+    try:
+        with index_write_lock:
+            manifest = load_manifest()
+            current = manifest.pop('global', None)
+            if current is None or current['name'] != global_index.name:
+                # Rebuilt by someone else in the meantime
+                return None
+            retire(manifest, f"global/{current['name']}")
+            save_manifest(manifest)
+        return {'dropped': current['name'], 'dead_vectors': dead}
+    finally:
+        _global_build_lock.release()
+
+
+class IndexMaintenance:
+    """Background thread that compacts the global index and deletes retired index files.
+
+    Runs every ``interval`` seconds, and straight away after ``notify``.
+    """
+
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self._wake = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="index-maintenance", daemon=True).start()
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                index = registry.get('vectorstore')
+                compact_global_index(index)
+                collect_garbage(index)
+            except Exception as e:
+                logger.error(f"Error in index maintenance: {str(e)}")
+
+
+def collect_garbage(index: ShardIndex = None, grace=None):
+    """Delete retired shard and global index directories that nothing can still be reading.
+
+    A directory goes once no query in this process has a snapshot that uses
+    it and ``grace`` seconds (INDEX_GC_GRACE) have passed since it was
+    retired, which covers queries in other worker processes. Returns the
+    removed paths. Temp directories of shard writers that died are swept
+    as well (``sweep_temp_shards``).
+    """
+    grace = Config.INDEX_GC_GRACE if grace is None else grace
+    sweep_temp_shards()
+    pinned = set()
+    if index is not None:
+        # Let go of this process's snapshot of versions that have been replaced
+        index.refresh()
+        pinned = index.pinned_paths()
+    now = time.time()
+    removed = []
+    with index_write_lock:
+        manifest = load_manifest()
+        retired = manifest.get('retired', [])
+        if not retired:
+            return removed
+        live = live_paths(manifest)
+        kept = []
+        for item in retired:
+            if item['path'] in live:
+                # Published again since it was retired
+                continue
+            if item['path'] in pinned or now - item['retired_at'] < grace:
+                kept.append(item)
+                continue
+            shutil.rmtree(DB_FAISS_PATH / item['path'], ignore_errors=True)
+            removed.append(item['path'])
+        if len(kept) != len(retired):
+            manifest['retired'] = kept
+            save_manifest(manifest)
+    if removed:
+        logger.info(f"Removed {len(removed)} retired index directories: {', '.join(removed)}")
+    return removed
+
+
+class _PickledObject:
+    """Stand-in for the classes in a legacy docstore pickle; keeps their fields as a dict."""
+
+    def __setstate__(self, state):
+        # pydantic v1 and v2 models both pickle their fields under __dict__
+        self.fields = state.get('__dict__', state)
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Reads a LangChain FAISS docstore pickle without LangChain's classes.
+
+    The pickled Documents only load with the LangChain/pydantic versions
+    that wrote them, and nothing but the docstore and its Documents may be
+    instantiated from the file.
+    """
+
+    def find_class(self, module, name):
+        if module.startswith('langchain') and name in ('InMemoryDocstore', 'Document'):
+            return _PickledObject
+        raise pickle.UnpicklingError(f"Unexpected {module}.{name} in the legacy docstore")
+
+
+def read_legacy_store(path=DB_FAISS_PATH):
+    """The pre-shard store at ``path``: ``(vectors, [(chunk_id, text, metadata), ...])`` in row order."""
+    index = faiss.read_index(str(path / INDEX_FILE))
+    with open(path / "index.pkl", 'rb') as f:
+        docstore, row_ids = _LegacyUnpickler(f).load()
+    documents = docstore.fields['_dict']
+    rows = []
+    for row in range(index.ntotal):
+        fields = documents[row_ids[row]].fields
+        rows.append((row_ids[row], fields.get('page_content', ''), dict(fields.get('metadata') or {})))
+    return index.reconstruct_n(0, index.ntotal), rows
+
+
+def migrate_legacy_store():
+    """Move the pre-shard store at the root of the vector store into one shard per document.
+
+    Rows are grouped by the manifest's chunk ids, else by the file name in
+    their ``source``, and each group is published like any other document,
+    so legacy documents can be replaced, deleted and compacted. Groups of
+    documents re-indexed since are dropped. The root files are moved aside
+    and retired. Returns the migrated document ids.
+    """
+    if not (DB_FAISS_PATH / INDEX_FILE).exists():
+        return []
+    with index_write_lock:
+        if not (DB_FAISS_PATH / INDEX_FILE).exists():
+            # Migrated by another process meanwhile
+            return []
+        vectors, rows = read_legacy_store()
+        manifest = load_manifest()
+        owners = {chunk_id: doc_id for doc_id, entry in manifest['documents'].items()
+                  for chunk_id in entry.get('chunk_ids', [])}
+        groups = {}
+        for row, (chunk_id, text, metadata) in enumerate(rows):
+            # Sources are whatever path the file had when it was indexed, Windows ones included
+            doc_id = owners.get(chunk_id) or PureWindowsPath(metadata.get('source', '')).name or "legacy"
+            groups.setdefault(doc_id, []).append(row)
+
+        entries = {}
+        for doc_id, group in groups.items():
+            entry = manifest['documents'].get(doc_id, {})
+            if entry.get('shard'):
+                # Re-indexed since sharding; these rows are its old version
+                continue
+            texts = [rows[row][1] for row in group]
+            metadatas = [dict(rows[row][2], doc_id=doc_id, chunk=i) for i, row in enumerate(group)]
+            # Named after the rows, not the file: re-ingesting the file should chunk it afresh
+            writer = ShardWriter(shard_name(hashlib.sha256("\0".join(texts).encode('utf-8')).hexdigest()))
+            writer.add(texts, vectors[group], metadatas)
+            writer.commit()
+            upload = UPLOAD_FOLDER / doc_id
+            sha256 = entry.get('sha256') or (file_sha256(upload) if upload.is_file() else None)
+            pages = max((metadata.get('page', 0) for metadata in metadatas), default=0) + 1
+            source = rows[group[0]][2].get('source') or doc_id
+            entries[doc_id] = make_entry(source, sha256, writer.name, writer.count, pages, doc_id)
+
+        # Reloaded: committing the shards may have changed it
+        manifest = load_manifest()
+        manifest['documents'].update(entries)
+        for doc_id, entry in list(manifest['documents'].items()):
+            if not entry.get('shard'):
+                logger.warning(f"{doc_id} has no rows in the legacy store, dropping it from the manifest")
+                del manifest['documents'][doc_id]
+        current = manifest.get('global')
+        if current and LEGACY_SHARD in {shard for shard, _ in current['members']}:
+            # Its row ids point into the legacy store; shards are searched directly until the next build
+            manifest.pop('global')
+            retire(manifest, f"global/{current['name']}")
+        moved = f"legacy-{int(time.time())}"
+        retire(manifest, moved)
+        save_manifest(manifest)
+        (DB_FAISS_PATH / moved).mkdir()
+        for legacy_file in (INDEX_FILE, "index.pkl"):
+            os.replace(DB_FAISS_PATH / legacy_file, DB_FAISS_PATH / moved / legacy_file)
+    logger.info(f"Migrated {len(entries)} documents from the legacy store into shards: {', '.join(entries)}")
+    return list(entries)
+
+
+class ShardedRetriever(BaseRetriever):
+    """Retriever over a ShardIndex, optionally scoped to some documents."""
+
+    index: ShardIndex
+    k: int = 2
+    documents: Optional[List[str]] = None
+    # Optional per-request timings (metrics.Trace)
+    trace: Optional[Trace] = None
+    # When set, fetch up to packer.max_k hits and let it choose and trim them
+    packer: Optional[ContextPacker] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        trace = self.trace or Trace()
+        with trace.span('retrieve_embed'):
+            vector = self.index.embeddings.embed_query(query)
+        k = max(self.k, self.packer.max_k) if self.packer else self.k
+        with trace.span('retrieve_search'):
+            if Config.HYBRID_SEARCH:
+                results = self.index.hybrid_search(query, vector, k, self.documents)
+                hits = [(doc, score) for doc, score, _ in results]
+                # RRF scores depend only on ranks, so k is chosen from how near the fused hits are
+                relevance = [-distance for _, _, distance in results]
+            else:
+                # Distances: smaller is better
+                hits = [(doc, -distance) for doc, distance in self.index.search(vector, k, self.documents)]
+                relevance = None
+        if self.packer is None:
+            return [doc for doc, _ in hits]
+        with trace.span('pack_context'):
+            return self.packer.pack(hits, relevance)
+
+
+def load_vectorstore():
+    migrate_legacy_store()
+    return ShardIndex(registry.get('embeddings'))
+
+
+registry.register('vectorstore', load_vectorstore)
+
+
+if __name__ == "__main__":
+    # Force a rebuild of the global index and print its recall/latency report
+    print(json.dumps(rebuild_global_index(registry.get('vectorstore'), force=True), indent=2))
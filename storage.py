@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import magic
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bytes kept from the start of an upload for MIME sniffing
+SNIFF_BYTES = 2048
+INCOMING_PREFIX = ".incoming-"
+
+
+class IncomingFile:
+    """An upload streaming into the upload folder, hashed and MIME-sniffed as it is written.
+
+    It lands under a temp name; ``store`` renames it to its content hash,
+    so the same bytes are only ever kept once and a new upload never
+    overwrites another document's file.
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        fd, path = tempfile.mkstemp(dir=self.folder, prefix=INCOMING_PREFIX)
+        self.path = Path(path)
+        self.stored = False
+        self.size = 0
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._head = b''
+
+    def write(self, data):
+        self._digest.update(data)
+        if len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush, as werkzeug's FileStorage expects of its stream
+        return getattr(self._file, name)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    @property
+    def mime_type(self):
+        return magic.from_buffer(self._head, mime=True)
+
+    def store(self, suffix=''):
+        """Move the file to ``<sha256><suffix>`` in the folder and return that path."""
+        path = self.folder / f"{self.sha256}{suffix}"
+        self._file.close()
+        if path.exists():
+            # Same bytes already stored (e.g. an earlier upload still being indexed)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, path)
+        self.path = path
+        self.stored = True
+        return path
+
+    def discard(self):
+        """Delete the temp file unless it was stored."""
+        if self.stored:
+            return
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    # Werkzeug closes a request's files at teardown: anything not stored by then is dropped
+    close = discard
+
+
+def receive(source, folder, chunk_size=1024 * 1024):
+    """Copy a file object into an IncomingFile in ``chunk_size`` blocks."""
+    incoming = IncomingFile(folder)
+    try:
+        for block in iter(lambda: source.read(chunk_size), b''):
+            incoming.write(block)
+    except Exception:
+        incoming.discard()
+        raise
+    return incoming
+
+
+def remove_stored(folder, sha256, suffix='.pdf'):
+    """Delete the upload stored as ``<sha256><suffix>`` in ``folder``; returns whether there was one.
+
+    Files are found by content hash, never by a path recorded elsewhere, so
+    documents indexed from outside the folder (e.g. by the bulk-ingest CLI)
+    keep their files.
+    """
+    if not sha256:
+        return False
+    try:
+        (Path(folder) / f"{sha256}{suffix}").unlink()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def clean_incoming(folder, max_age=3600):
+    """Remove temp files left by uploads that never finished (e.g. a crashed worker)."""
+    now = time.time()
+    for path in Path(folder).glob(f"{INCOMING_PREFIX}*"):
+        try:
+            if now - path.stat().st_mtime > max_age:
+                path.unlink()
+                logger.info(f"Removed abandoned upload {path.name}")
+        except OSError:
+            pass
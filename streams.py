@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StreamGoneError(Exception):
+    pass
+
+
+class AsyncWakeups:
+    """Wakes asyncio readers from producer threads.
+
+    Each waiting coroutine registers an asyncio.Event; ``notify`` sets them
+    all through their own loop's ``call_soon_threadsafe``, so producers never
+    touch an event loop directly and readers hold no thread while waiting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The reader's loop has been closed
+                pass
+
+    @contextmanager
+    def waiter(self):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+class ResumableStream:
+    """Runs an answer stream in the background and lets clients (re)attach to it.
+
+    A pump thread drains ``source`` (the dicts from model.stream_response)
+    into a replay buffer, numbering every event. Readers get coalesced
+    frames: consecutive tokens are sent as one frame at most every
+    ``flush_interval`` seconds (sooner once ``flush_chars`` characters are
+    pending), tagged with the sequence number of the last event they carry,
+    so a client reconnecting with that id resumes exactly after it.
+
+    When the last reader detaches before the answer is finished, the
+    generation is cancelled after ``grace`` seconds unless a client
+    reattaches in the meantime.
+    """
+
+    def __init__(self, source, cancel: threading.Event, flush_interval=0.05, flush_chars=256,
+                 replay_events=4096, grace=10.0, on_finish=None):
+        self.id = uuid.uuid4().hex
+        self.answer = []
+        self.sources = []
+        self.completed = False
+        self.finished_at = None
+        self._source = source
+        self._cancel = cancel
+        self._flush_interval = flush_interval
+        self._flush_chars = flush_chars
+        self._grace = grace
+        self._on_finish = on_finish
+        self._events = deque(maxlen=replay_events)
+        self._last_seq = 0
+        self._finished = False
+        self._readers = 0
+        self._cancel_timer = None
+        self._cond = threading.Condition()
+        self._wakeups = AsyncWakeups()
+
+    def start(self):
+        threading.Thread(target=self._pump, name=f"stream-{self.id[:8]}", daemon=True).start()
+        return self
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def _pump(self):
+        try:
+            for event in self._source:
+                if event['type'] == 'token':
+                    self.answer.append(event['token'])
+                elif event['type'] == 'sources':
+                    self.sources = event['sources']
+                with self._cond:
+                    self._last_seq += 1
+                    self._events.append((self._last_seq, event))
+                    self._cond.notify_all()
+                self._wakeups.notify()
+                if self._cancel.is_set():
+                    break
+            else:
+                self.completed = not self._cancel.is_set()
+        except Exception as e:
+            logger.error(f"Error in answer stream {self.id}: {str(e)}")
+            with self._cond:
+                self._last_seq += 1
+                self._events.append((self._last_seq, {'type': 'error', 'message': str(e)}))
+        finally:
+            # Closing here (on the pump thread) also withdraws a queued ticket
+            self._source.close()
+            with self._cond:
+                self._finished = True
+                self.finished_at = time.monotonic()
+                self._cond.notify_all()
+            self._wakeups.notify()
+            if self._on_finish:
+                try:
+                    self._on_finish(self)
+                except Exception as e:
+                    logger.error(f"Error finishing answer stream {self.id}: {str(e)}")
+
+    def check_resume(self, after):
+        """Raise StreamGoneError if events after ``after`` have left the replay buffer."""
+        with self._cond:
+            if self._events and after < self._events[0][0] - 1:
+                raise StreamGoneError("Stream position is no longer available")
+
+    def frames(self, after=0, keepalive=15):
+        """Yield ``(event_id, event)`` frames after ``after``, or None as a keepalive."""
+        self._attach()
+        try:
+            last_sent = 0.0
+            while True:
+                with self._cond:
+                    if not self._pending(after) and not self._finished:
+                        self._cond.wait(keepalive)
+                    pending, finished, delay, ready = self._poll_locked(after, last_sent)
+                if not pending:
+                    if finished:
+                        return
+                    yield None
+                    continue
+                if not ready:
+                    # Let a few more tokens accumulate into this frame
+                    time.sleep(delay)
+                with self._cond:
+                    frames = self._collect(after)
+                for event_id, event in frames:
+                    yield event_id, event
+                    after = event_id
+                last_sent = time.monotonic()
+        finally:
+            self._detach()
+
+    async def aframes(self, after=0, keepalive=15):
+        """Async form of ``frames`` for asyncio servers: waits on the event loop, not a thread."""
+        self._attach()
+        try:
+            with self._wakeups.waiter() as wakeup:
+                last_sent = 0.0
+                while True:
+                    # Clear before looking, so a notify that races the check is not lost
+                    wakeup.clear()
+                    with self._cond:
+                        pending, finished, delay, ready = self._poll_locked(after, last_sent)
+                    if not pending:
+                        if finished:
+                            return
+                        try:
+                            await asyncio.wait_for(wakeup.wait(), keepalive)
+                        except asyncio.TimeoutError:
+                            yield None
+                        continue
+                    if not ready:
+                        await asyncio.sleep(delay)
+                    with self._cond:
+                        frames = self._collect(after)
+                    for event_id, event in frames:
+                        yield event_id, event
+                        after = event_id
+                    last_sent = time.monotonic()
+        finally:
+            self._detach()
+
+    def _poll_locked(self, after, last_sent):
+        pending, finished = self._pending(after), self._finished
+        delay = last_sent + self._flush_interval - time.monotonic()
+        ready = finished or delay <= 0 or self._pending_chars(after) >= self._flush_chars
+        return pending, finished, delay, ready
+
+    def _pending(self, after):
+        return self._last_seq > after
+
+    def _pending_chars(self, after):
+        chars = 0
+        for seq, event in reversed(self._events):
+            if seq <= after:
+                break
+            chars += len(event.get('token', ''))
+        return chars
+
+    def _collect(self, after):
+        frames, tokens, last_token_seq = [], [], None
+        for seq, event in self._events:
+            if seq <= after:
+                continue
+            if event['type'] == 'token':
+                tokens.append(event['token'])
+                last_token_seq = seq
+                continue
+            if tokens:
+                frames.append((last_token_seq, {'type': 'token', 'token': ''.join(tokens)}))
+                tokens = []
+            frames.append((seq, event))
+        if tokens:
+            frames.append((last_token_seq, {'type': 'token', 'token': ''.join(tokens)}))
+        return frames
+
+    def _attach(self):
+        with self._cond:
+            self._readers += 1
+            if self._cancel_timer is not None:
+                self._cancel_timer.cancel()
+                self._cancel_timer = None
+
+    def _detach(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers or self._finished:
+                return
+            if self._grace <= 0:
+                self._cancel.set()
+                return
+            self._cancel_timer = threading.Timer(self._grace, self._abandon)
+            self._cancel_timer.daemon = True
+            self._cancel_timer.start()
+
+    def _abandon(self):
+        with self._cond:
+            if self._readers:
+                return
+        logger.info(f"No client reattached to stream {self.id}, cancelling generation")
+        self._cancel.set()
+
+
+class StreamStore:
+    """Live and recently finished streams, by id, for Last-Event-ID resumes."""
+
+    def __init__(self, retention=60.0, max_streams=256):
+        self.retention = retention
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stream: ResumableStream):
+        with self._lock:
+            self._evict_locked()
+            self._streams[stream.id] = stream
+        return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            self._evict_locked()
+            return self._streams.get(stream_id)
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            expired = stream.finished and now - stream.finished_at > self.retention
+            if expired or (len(self._streams) >= self.max_streams and stream.finished):
+                del self._streams[stream_id]
@@ -0,0 +1,65 @@
+import numpy as np
+
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def rotated(angle):
+    """A unit vector ``angle`` radians from (1, 0), i.e. cosine similarity cos(angle) to it."""
+    return [np.cos(angle), np.sin(angle)]
+
+
+def test_hits_only_at_or_above_the_threshold():
+    cache = AnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], 1, "cached", [])
+    assert cache.lookup(rotated(0.30), 1)['answer'] == "cached"   # cos 0.955
+    assert cache.lookup(rotated(0.33), 1) is None                 # cos 0.946
+    # Similarity is cosine, not a raw dot product
+    assert cache.lookup([10.0, 0.5], 1)['answer'] == "cached"
+
+
+def test_returns_the_most_similar_entry():
+    cache = AnswerCache(threshold=0.9)
+    cache.store(rotated(0.0), 1, "far", [])
+    cache.store(rotated(0.4), 1, "near", [])
+    assert cache.lookup(rotated(0.35), 1)['answer'] == "near"
+
+
+def test_answers_are_only_reused_for_the_same_documents():
+    cache = AnswerCache()
+    cache.store([1.0, 0.0], 1, "all documents", [])
+    cache.store([1.0, 0.0], 1, "a and b", [], scope=("a.pdf", "b.pdf"))
+    assert cache.lookup([1.0, 0.0], 1)['answer'] == "all documents"
+    assert cache.lookup([1.0, 0.0], 1, scope=("a.pdf", "b.pdf"))['answer'] == "a and b"
+    assert cache.lookup([1.0, 0.0], 1, scope=("a.pdf",)) is None
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, 'monotonic', lambda: now[0])
+    cache = AnswerCache(ttl=60)
+    cache.store([1.0, 0.0], 1, "cached", [])
+    now[0] += 60
+    assert cache.lookup([1.0, 0.0], 1) is not None
+    now[0] += 1
+    assert cache.lookup([1.0, 0.0], 1) is None
+    assert len(cache) == 0
+
+
+def test_a_new_index_version_invalidates_older_answers():
+    cache = AnswerCache()
+    cache.store([1.0, 0.0], 1, "old", [])
+    assert cache.lookup([1.0, 0.0], 2) is None
+    assert len(cache) == 0
+    # Dropped, not hidden: going back to the old version finds nothing
+    assert cache.lookup([1.0, 0.0], 1) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.store([1.0, 0.0], 1, "x", [])
+    cache.store([0.0, 1.0], 1, "y", [])
+    cache.lookup([1.0, 0.0], 1)
+    cache.store([-1.0, 0.0], 1, "z", [])
+    assert cache.lookup([1.0, 0.0], 1)['answer'] == "x"
+    assert cache.lookup([0.0, 1.0], 1) is None
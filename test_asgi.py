@@ -0,0 +1,185 @@
+import hashlib
+import io
+import json
+
+import fitz
+import pytest
+
+pytest.importorskip('mongomock')
+pytest.importorskip('httpx')
+
+from bench import make_stub_llm, use_mongomock  # noqa: E402
+
+use_mongomock()
+
+import asgi  # noqa: E402
+import metrics  # noqa: E402
+from config import Config, UPLOAD_FOLDER  # noqa: E402
+from registry import registry  # noqa: E402
+from storage import IncomingFile  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+
+class AsyncCollection:
+    """The async driver calls asgi makes, served from the app's (mongomock) collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+
+class AsyncDatabase:
+    def __init__(self, db):
+        self.ingest_jobs = AsyncCollection(db.ingest_jobs)
+
+
+@pytest.fixture
+def client(index_store, monkeypatch):
+    llm = make_stub_llm(tokens=8, tokens_per_second=0)
+    registry.register('llm', lambda: llm)
+    for slot in range(1, Config.LLM_SLOTS):
+        registry.register(f'llm:{slot}', lambda: llm)
+    registry.invalidate('llm')
+    monkeypatch.setattr(asgi, 'async_db', AsyncDatabase(asgi.flask_app_module.mongo.db))
+    with TestClient(asgi.application) as client:
+        yield client
+
+
+def frames(response):
+    """(id, data) for each SSE frame with data."""
+    result = []
+    for frame in response.text.split('\n\n'):
+        lines = frame.splitlines()
+        data = [line[len('data: '):] for line in lines if line.startswith('data: ')]
+        if data:
+            ids = [line[len('id: '):] for line in lines if line.startswith('id: ')]
+            result.append((ids[0] if ids else None, json.loads('\n'.join(data))))
+    return result
+
+
+def requests_seen(method, route, status):
+    series = metrics.HTTP_REQUEST_SECONDS._series.get((method, route, str(status)))
+    return series['count'] if series else 0
+
+
+def pdf_bytes(text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+def upload(client, content, filename="notes.pdf"):
+    if isinstance(content, str):
+        content = pdf_bytes(content)
+    return client.post('/upload', files={'file': (filename, content, "application/pdf")})
+
+
+def test_query_streams_an_answer_that_can_be_resumed(client):
+    upload(client, "apple pie recipe")
+    before = requests_seen('POST', '/query', 200)
+    response = client.post('/query', json={'query': "what is in the documents?"})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = frames(response)
+    assert events[0][1] == {'type': 'stream', 'stream_id': response.headers['X-Stream-Id']}
+    tokens = [(event_id, event['text']) for event_id, event in events if event['type'] == 'token']
+    assert tokens and events[-1][1] == {'type': 'done'}
+    assert requests_seen('POST', '/query', 200) == before + 1
+
+    # Reconnect after the first token: the rest are replayed, without the stream frame
+    stream_id = response.headers['X-Stream-Id']
+    resumed = client.get(f'/query/{stream_id}/events', headers={'Last-Event-ID': tokens[0][0]})
+    assert resumed.status_code == 200
+    replayed = [event['text'] for _, event in frames(resumed) if event['type'] == 'token']
+    assert ''.join(replayed) == ''.join(text for _, text in tokens[1:])
+    assert requests_seen('GET', '/query/<stream_id>/events', 200) >= 1
+
+
+def test_resume_rejects_unknown_streams_and_bad_event_ids(client):
+    assert client.get('/query/nope/events').status_code == 404
+    upload(client, "apple pie recipe")
+    stream_id = client.post('/query', json={'query': "anything"}).headers['X-Stream-Id']
+    response = client.get(f'/query/{stream_id}/events', headers={'Last-Event-ID': "x"})
+    assert response.status_code == 400
+    assert requests_seen('GET', '/query/<stream_id>/events', 404) >= 1
+
+
+def test_upload_streams_the_ingest_job_and_its_events_can_be_replayed(client):
+    content = pdf_bytes("apple pie recipe")
+    response = upload(client, content)
+    assert response.status_code == 200
+    events = [event for _, event in frames(response)]
+    assert events[0]['step'] == "upload" and events[0]['status'] == "complete"
+    assert events[-1]['status'] == "complete"
+    assert requests_seen('POST', '/upload', 200) >= 1
+
+    job_id = events[0]['job_id']
+    replay = client.get(f'/jobs/{job_id}/events')
+    assert replay.status_code == 200
+    assert frames(replay)[-1][1]['status'] == "complete"
+    assert client.get('/jobs/nope/events').status_code == 404
+
+    # The same bytes again are recognised without a second job
+    again = upload(client, content, "copy.pdf")
+    assert [event['status'] for _, event in frames(again)] == ["complete", "complete"]
+
+
+def test_upload_rejects_files_that_are_not_pdfs(client):
+    response = client.post('/upload', files={'file': ("notes.txt", b"plain text", "text/plain")})
+    assert response.status_code == 400
+    assert requests_seen('POST', '/upload', 400) >= 1
+
+
+def test_search_rejects_malformed_documents_and_k(client):
+    upload(client, "apple pie recipe")
+    for body in ({'queries': ["pie"], 'documents': "notes.pdf"},
+                 {'queries': ["pie"], 'documents': [1, 2]},
+                 {'queries': ["pie"], 'k': True}):
+        assert client.post('/search', json=body).status_code == 400
+    response = client.post('/search', json={'queries': ["pie"], 'k': 1, 'documents': []})
+    assert response.status_code == 200
+    assert len(response.json()['results'][0]) == 1
+
+
+def test_query_documents_must_be_a_list_of_ids(client):
+    flask_client = asgi.flask_app.test_client()
+    for documents in ("notes.pdf", {'id': "notes.pdf"}, ["notes.pdf", 3]):
+        response = client.post('/query', json={'query': "pie", 'documents': documents})
+        assert response.status_code == 400
+        assert response.json()['message'] == "documents must be a list of document ids"
+        # The WSGI-only deployment's route
+        assert flask_client.post('/query', json={'query': "pie", 'documents': documents}).status_code == 400
+
+
+def test_duplicate_indexed_meanwhile_records_the_document_holding_it(client):
+    server = asgi.flask_app_module
+    content = pdf_bytes("apple pie recipe")
+    upload(client, content)
+    sha256 = hashlib.sha256(content).hexdigest()
+    # A second job for the same bytes under another name, queued before the first finished
+    assert server.ingest_upload(str(UPLOAD_FOLDER / f"{sha256}.pdf"), "copy.pdf")
+    server.document_writer.flush()
+    assert server.mongo.db.documents.find_one({'filename': "copy.pdf"}) is None
+    assert server.mongo.db.documents.find_one({'sha256': None}) is None
+    assert server.mongo.db.documents.find_one({'filename': "notes.pdf"})['sha256'] == sha256
+
+
+def test_only_uploads_stream_into_the_upload_folder():
+    app = asgi.flask_app
+    for path, streamed in (('/upload', True), ('/login', False)):
+        with app.test_request_context(path, method='POST', data={'file': (io.BytesIO(b"%PDF-1.4"), "a.pdf")}):
+            assert isinstance(asgi.flask_app_module.request.files['file'].stream, IncomingFile) == streamed
+
+
+def test_chat_history_needs_an_identity(client):
+    server = asgi.flask_app_module
+    server.mongo.db.chat_history.insert_many([{'user': None, 'query': "anonymous", 'timestamp': 1},
+                                              {'user': "alice", 'query': "mine", 'timestamp': 2}])
+    assert client.get('/chat-history').status_code == 401
+    with asgi.flask_app.app_context():
+        token = server.create_access_token(identity="alice", additional_claims={'role': "user"})
+    response = client.get('/chat-history', headers={'Authorization': f"Bearer {token}"})
+    assert response.status_code == 200
+    assert [item['query'] for item in response.json()] == ["mine"]
@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+import pytest
+
+import bm25
+from bm25 import BM25Index, BM25Writer, tokenize, reciprocal_rank_fusion
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("ShopNest E-Commerce v2.1") == ['shopnest', 'e-commerce', 'e', 'commerce', 'v2.1', 'v2', '1']
+
+
+def test_search_ranks_exact_identifier_first_across_shards():
+    first, second = BM25Writer(), BM25Writer()
+    first.add(["an online store for groceries", "ShopNest project report"])
+    second.add(["a report on path planning", "unrelated text"])
+    hits = bm25.search([("a", first.build()), ("b", second.build())], "ShopNest report", k=3)
+    assert hits[0][:2] == ("a", 1)
+    assert {(name, row) for name, row, _ in hits} == {("a", 1), ("b", 0)}
+
+
+def test_saved_index_is_memory_mapped(tmp_path):
+    writer = BM25Writer()
+    writer.add(["alpha beta", "beta gamma"])
+    writer.save(tmp_path)
+    loaded = BM25Index.load(tmp_path)
+    assert isinstance(loaded.rows, np.memmap)
+    assert bm25.search([("s", loaded)], "gamma", k=1)[0][:2] == ("s", 1)
+
+
+def test_scores_match_the_bm25_formula():
+    texts = ["alpha beta beta", "beta gamma", "gamma gamma delta alpha", "", "epsilon"]
+    writer = BM25Writer()
+    writer.add(texts)
+    assert bm25.search([("s", writer.build())], "missing", k=5) == []
+
+    # Scored by hand: the same term frequency wins in the shorter chunk
+    hits = bm25.search([("s", writer.build())], "gamma", k=5)
+    assert [row for _, row, _ in hits] == [2, 1]
+    n, df, avg = 5, 2, 10 / 5
+    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+    assert hits[1][2] == pytest.approx(idf * 1 * 2.2 / (1 + 1.2 * (0.25 + 0.75 * 2 / avg)))
+
+
+def test_empty_shard_index(tmp_path):
+    writer = BM25Writer()
+    writer.add([""])
+    writer.save(tmp_path)
+    assert bm25.search([("s", BM25Index.load(tmp_path))], "anything", k=3) == []
+
+
+def test_rrf_prefers_keys_ranked_by_both_lists():
+    fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "w"]], k=2)
+    assert [key for key, _ in fused] == ["y", "x"]
+
+
+def test_concatenated_index_scores_like_its_parts():
+    first, second = BM25Writer(), BM25Writer()
+    first.add(["alpha beta", "beta gamma gamma"])
+    second.add(["gamma delta", "alpha alpha", "epsilon"])
+    parts = [first.build(), second.build()]
+    merged = BM25Index.concatenate([(parts[0], 2), (parts[1], 3)])
+    separate = bm25.search([("a", parts[0]), ("b", parts[1])], "alpha gamma", k=5)
+    together = bm25.search([("g", merged)], "alpha gamma", k=5)
+    offsets = {"a": 0, "b": 2}
+    assert sorted((offsets[name] + row, round(score, 9)) for name, row, score in separate) == \
+        sorted((row, round(score, 9)) for _, row, score in together)
@@ -0,0 +1,53 @@
+from langchain_core.documents import Document
+
+from context import ContextPacker, choose_k
+
+
+def words(start, end):
+    return ' '.join(f"w{i}" for i in range(start, end))
+
+
+def test_choose_k_cuts_at_the_first_large_gap():
+    assert choose_k([0.9, 0.88, 0.87, 0.4, 0.38], min_k=1, max_k=5, gap_ratio=0.4) == 3
+    assert choose_k([0.9, 0.3, 0.29], min_k=2, max_k=5, gap_ratio=0.4) == 3
+    assert choose_k([0.5, 0.5, 0.5], min_k=1, max_k=2, gap_ratio=0.4) == 2
+
+
+def test_neighbouring_chunks_are_merged_without_their_overlap():
+    hits = [
+        (Document(page_content=words(30, 60), metadata={'doc_id': 'a', 'chunk': 1}), 3.0),
+        (Document(page_content=words(0, 40), metadata={'doc_id': 'a', 'chunk': 0}), 2.9),
+        (Document(page_content=words(0, 40), metadata={'doc_id': 'b', 'chunk': 0}), 2.8),
+    ]
+    packed = ContextPacker(max_k=3, gap_ratio=1.0).pack(hits)
+    assert packed[0].page_content == words(0, 60)
+    # b's chunk only covers part of the merged passage, so it is not a near-duplicate
+    assert len(packed) == 2
+
+
+def test_near_duplicates_are_dropped_and_budget_truncates():
+    hits = [
+        (Document(page_content=words(0, 60), metadata={'doc_id': 'a', 'chunk': 0}), 3.0),
+        (Document(page_content=words(0, 60), metadata={'doc_id': 'b', 'chunk': 5}), 2.9),
+        (Document(page_content=words(100, 200), metadata={'doc_id': 'c', 'chunk': 0}), 2.8),
+    ]
+    packer = ContextPacker(count_tokens=lambda text: len(text.split()), budget=100, max_k=3,
+                           gap_ratio=1.0, min_fragment_tokens=10)
+    packed = packer.pack(hits)
+    assert [doc.metadata['doc_id'] for doc in packed] == ['a', 'c']
+    assert packed[1].page_content == words(100, 140)
+    assert packed[1].metadata['truncated']
+
+
+def test_rank_fusion_hits_are_cut_at_gaps_in_their_relevance():
+    # RRF scores for ranks 1, 2, 3 and a hit only one of two rankings found
+    scores = [2 / 61, 2 / 62, 2 / 63, 1 / 61]
+    hits = [(Document(page_content=words(i * 100, i * 100 + 10), metadata={'doc_id': str(i), 'chunk': 0}), score)
+            for i, score in enumerate(scores)]
+    packer = ContextPacker(max_k=4, gap_ratio=0.4)
+    # Their own gaps cut at the rank structure, not at relevance
+    assert len(packer.pack(hits)) == 3
+    # Negated distances: only the first two hits are near the query
+    packed = packer.pack(hits, relevance=[-0.25, -0.30, -1.20, -1.25])
+    assert [doc.metadata['doc_id'] for doc in packed] == ['0', '1']
+    assert len(packer.pack(hits, relevance=[-0.30, -0.31, -0.32, -0.33])) == 4
@@ -0,0 +1,16 @@
+from docstore import DocstoreWriter, MmapDocstore
+
+
+def test_docstore_round_trips_texts_and_metadata(tmp_path):
+    writer = DocstoreWriter(tmp_path)
+    writer.add(["first chunk", "zweiter Abschnitt ü"],
+               [{'source': 'a.pdf', 'page': 0, 'chunk': 0}, {'source': 'a.pdf', 'page': 3, 'chunk': 1}])
+    writer.add(["third"], [{'source': 'a.pdf', 'page': 3, 'chunk': 2, 'note': 'x'}])
+    assert writer.close() == 3
+
+    store = MmapDocstore(tmp_path)
+    assert len(store) == 3
+    second = store.document(1)
+    assert second.page_content == "zweiter Abschnitt ü"
+    assert second.metadata == {'source': 'a.pdf', 'page': 3, 'chunk': 1}
+    assert store.document(2).metadata['note'] == 'x'
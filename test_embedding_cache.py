@@ -0,0 +1,80 @@
+import multiprocessing
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def vector_for(i, dim=8):
+    return np.full(dim, i, dtype=np.float32)
+
+
+def test_caches_on_one_directory_share_entries_without_clobbering(tmp_path):
+    # Two processes (web workers, the bulk CLI) each open their own cache on the same files
+    first = EmbeddingCache(tmp_path, max_entries=64)
+    second = EmbeddingCache(tmp_path, max_entries=64)
+    x, y = first.key('m', 'x'), first.key('m', 'y')
+    first.put_many([(x, vector_for(1))])
+    second.put_many([(y, vector_for(2))])
+
+    assert first.get_many([x])[x].tolist() == vector_for(1).tolist()
+    assert first.get_many([y])[y].tolist() == vector_for(2).tolist()
+    assert second.get_many([x])[x].tolist() == vector_for(1).tolist()
+
+    # A fresh process sees what the others wrote
+    assert len(EmbeddingCache(tmp_path, max_entries=64)) == 2
+
+
+def test_full_set_evicts_its_least_recently_used_entry(tmp_path):
+    cache = EmbeddingCache(tmp_path, max_entries=EmbeddingCache.WAYS)  # a single set
+    keys = [cache.key('m', str(i)) for i in range(EmbeddingCache.WAYS + 1)]
+    for i, key in enumerate(keys[:-1]):
+        cache.put_many([(key, vector_for(i))])
+    cache.get_many([keys[0]])
+    cache.put_many([(keys[-1], vector_for(99))])
+
+    found = cache.get_many(keys)
+    assert keys[0] in found and keys[1] not in found and keys[-1] in found
+    assert len(found) == EmbeddingCache.WAYS
+
+
+def test_keys_spread_over_all_sets(tmp_path):
+    cache = EmbeddingCache(tmp_path, max_entries=1024)
+    keys = [cache.key('m', str(i)) for i in range(400)]
+    cache.put_many([(key, vector_for(i)) for i, key in enumerate(keys)])
+    assert len(cache.get_many(keys)) >= 390
+
+
+def test_torn_record_reads_as_a_miss(tmp_path):
+    cache = EmbeddingCache(tmp_path, max_entries=64)
+    key = cache.key('m', 'x')
+    cache.put_many([(key, vector_for(1))])
+    words, start = cache._locate(key)
+    way = int(np.flatnonzero((cache._records['key'][start:start + cache.WAYS] == words).all(axis=1))[0])
+    cache._records['vector'][start + way][0] = 42.0
+    assert cache.get_many([key]) == {}
+
+
+def _fill(path, offset, count):
+    cache = EmbeddingCache(path, max_entries=256)
+    for i in range(offset, offset + count, 16):
+        cache.put_many([(cache.key('m', str(j)), vector_for(j)) for j in range(i, i + 16)])
+
+
+def test_concurrent_writers_never_return_another_keys_vector(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_fill, args=(tmp_path, n * 1000, 800)) for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    cache = EmbeddingCache(tmp_path, max_entries=256)
+    ids = [j for n in range(3) for j in range(n * 1000, n * 1000 + 800)]
+    found = cache.get_many([cache.key('m', str(j)) for j in ids])
+    assert found
+    for j in ids:
+        key = cache.key('m', str(j))
+        if key in found:
+            assert found[key].tolist() == vector_for(j).tolist()
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from embeddings import check_parity, export_onnx, OnnxEmbeddings
+
+
+class BagOfWords(Embeddings):
+    def __init__(self, noise=0.0):
+        self.noise = noise
+
+    def _vector(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.lower().split():
+            vector[sum(map(ord, word)) % 64] += 1.0
+        if self.noise:
+            vector += np.random.default_rng(len(text)).normal(0, self.noise, 64).astype(np.float32)
+        return (vector / max(np.linalg.norm(vector), 1e-12)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+TEXTS = [f"chunk {i} about topic {i % 7} with words alpha{i} beta{i * 3} gamma{i % 5}" for i in range(40)]
+
+
+def test_identical_backends_agree():
+    report = check_parity(BagOfWords(), BagOfWords(), TEXTS, k=3, queries=10)
+    assert report['min_cosine'] == 1.0
+    assert report['recall_at_k'] == 1.0
+    assert report['queries'] == 10
+
+
+def test_noisy_backend_is_reported():
+    report = check_parity(BagOfWords(), BagOfWords(noise=0.5), TEXTS, k=3, queries=10)
+    assert report['mean_cosine'] < 0.9
+    assert report['recall_at_k'] < 1.0
+
+
+def test_onnx_export_matches_the_torch_model(tmp_path):
+    torch = pytest.importorskip('torch')
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    words = "[PAD] [UNK] [CLS] [SEP] [MASK] the quick brown fox jumps over lazy dog".split()
+    (tmp_path / "vocab.txt").write_text("\n".join(words))
+    model_dir = tmp_path / "model"
+    tokenizer = BertTokenizerFast(vocab_file=str(tmp_path / "vocab.txt"))
+    tokenizer.save_pretrained(str(model_dir))
+    torch.manual_seed(0)
+    model = BertModel(BertConfig(vocab_size=len(words), hidden_size=32, num_hidden_layers=2,
+                                 num_attention_heads=2, intermediate_size=64)).eval()
+    model.save_pretrained(str(model_dir))
+    export_onnx(str(model_dir), tmp_path / "onnx")
+
+    # Padded batch: a mask mixed up with token types would show here
+    texts = ["the quick brown fox", "the lazy dog jumps over the quick brown fox"]
+    encoded = tokenizer(texts, padding=True, return_tensors='pt')
+    with torch.no_grad():
+        hidden = model(**encoded).last_hidden_state.numpy()
+    mask = encoded['attention_mask'].numpy()[..., None]
+    expected = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    vectors = np.asarray(OnnxEmbeddings(tmp_path / "onnx").embed_documents(texts))
+    assert (expected * vectors).sum(axis=1).min() > 0.99
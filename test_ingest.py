@@ -0,0 +1,63 @@
+import re
+
+from ingest import iter_chunks, iter_batches
+
+
+class PairTokenizer:
+    """Stand-in word-piece tokenizer: every two characters of a word are one piece."""
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, verbose=True):
+        return {'offset_mapping': [(m.start() + i, min(m.start() + i + 2, m.end()))
+                                   for m in re.finditer(r"\S+", text) for i in range(0, len(m.group()), 2)]}
+
+
+def pieces(text):
+    return sum((len(word) + 1) // 2 for word in text.split())
+
+
+def test_chunks_are_bounded_and_overlap():
+    """Chunks never exceed the token limit and share `overlap` tokens"""
+    text = " ".join(f"w{i}" for i in range(10))
+    chunks = [c.page_content.split() for c in iter_chunks([(0, text)], "doc.pdf", chunk_tokens=4, overlap=1)]
+    assert all(len(c) <= 4 for c in chunks)
+    assert chunks[0][-1] == chunks[1][0]
+    assert chunks[-1][-1] == "w9"
+
+
+def test_chunk_metadata_tracks_page_and_index():
+    pages = [(0, "a b c"), (1, ""), (2, "d e f")]
+    chunks = list(iter_chunks(pages, "doc.pdf", chunk_tokens=10, overlap=2))
+    assert [c.metadata['page'] for c in chunks] == [0, 2]
+    assert [c.metadata['chunk'] for c in chunks] == [0, 1]
+
+
+def test_batches_are_fixed_size():
+    assert [len(b) for b in iter_batches(range(10), 4)] == [4, 4, 2]
+
+
+def test_chunks_stay_within_the_word_piece_limit():
+    # Short words are one piece, long identifiers several
+    words = [f"w{i}" if i % 3 else f"identifier_{i:04d}" for i in range(60)]
+    chunks = [c.page_content for c in iter_chunks([(0, " ".join(words))], "doc.pdf", chunk_tokens=20, overlap=2,
+                                                  tokenizer=PairTokenizer(), max_pieces=24)]
+    assert all(pieces(chunk) <= 24 for chunk in chunks)
+    assert max(len(chunk.split()) for chunk in chunks) < 20
+    # Still overlapping and covering every word
+    assert chunks[0].split()[-2:] == chunks[1].split()[:2]
+    assert chunks[-1].split()[-1] == words[-1]
+
+
+def test_default_piece_limit_leaves_room_for_special_tokens(monkeypatch):
+    monkeypatch.setattr('config.Config.EMBEDDING_MAX_LENGTH', 12)
+    text = " ".join(["abcd"] * 20)
+    chunks = list(iter_chunks([(0, text)], "doc.pdf", chunk_tokens=50, overlap=0, tokenizer=PairTokenizer()))
+    assert [pieces(c.page_content) for c in chunks] == [10, 10, 10, 10]
+
+
+def test_word_longer_than_the_limit_is_a_chunk_of_its_own():
+    chunks = [c.page_content for c in iter_chunks([(0, "a " + "x" * 40 + " b")], "doc.pdf", chunk_tokens=10,
+                                                  overlap=1, tokenizer=PairTokenizer(), max_pieces=4)]
+    assert chunks == ["a", "x" * 40, "b"]
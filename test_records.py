@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+from records import BulkWriter, encode_cursor, decode_cursor
+
+
+class FakeCollection:
+    name = 'fake'
+
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.batches.append(list(operations))
+
+
+def test_bulk_writer_batches_writes():
+    collection = FakeCollection()
+    writer = BulkWriter(collection, batch_size=3, flush_interval=0.05)
+    for i in range(7):
+        writer.insert({'n': i})
+    writer.flush()
+    assert sum(len(batch) for batch in collection.batches) == 7
+    assert max(len(batch) for batch in collection.batches) <= 3
+
+
+def test_cursor_round_trips_datetimes():
+    document = {'_id': ObjectId(), 'timestamp': datetime(2024, 5, 1, 12, 30, 15, 250000)}
+    assert decode_cursor(encode_cursor(document, 'timestamp')) == (document['timestamp'], document['_id'])
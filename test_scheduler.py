@@ -0,0 +1,38 @@
+import pytest
+
+from scheduler import InferenceScheduler, AdmissionError, DeadlineExceededError
+
+
+def test_slots_are_granted_in_fifo_order():
+    scheduler = InferenceScheduler(slots=1, max_queue=4)
+    first, second, third = scheduler.submit(), scheduler.submit(), scheduler.submit()
+    assert first.granted.is_set()
+    assert scheduler.position(second) == 1 and scheduler.position(third) == 2
+
+    scheduler.release(first)
+    assert second.granted.is_set() and not third.granted.is_set()
+
+
+def test_full_queue_is_rejected_with_429():
+    scheduler = InferenceScheduler(slots=1, max_queue=1)
+    scheduler.submit()
+    scheduler.submit()
+    with pytest.raises(AdmissionError) as excinfo:
+        scheduler.submit()
+    assert excinfo.value.status == 429
+
+
+def test_waiting_past_the_deadline_gives_up_the_place_in_line():
+    scheduler = InferenceScheduler(slots=1, max_queue=4)
+    scheduler.submit()
+    late = scheduler.submit(timeout=0.05)
+    with pytest.raises(DeadlineExceededError):
+        scheduler.acquire(late)
+    assert scheduler.status()['waiting'] == 0
+
+
+def test_cancel_frees_a_granted_slot():
+    scheduler = InferenceScheduler(slots=1, max_queue=4)
+    ticket = scheduler.submit()
+    scheduler.cancel(ticket)
+    assert scheduler.status()['busy'] == 0
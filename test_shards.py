@@ -0,0 +1,287 @@
+import multiprocessing
+import shutil
+from pathlib import Path
+
+import faiss
+import fitz
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from conftest import HashEmbeddings
+from datacreate import publish_document, delete_document
+from initialize_vectorstore import bulk_ingest, load_checkpoint
+from manifest import load_manifest, save_manifest, index_write_lock
+from registry import registry
+from shards import (GlobalIndex, ShardWriter, collect_garbage, sweep_temp_shards, migrate_legacy_store, rebuild_global_index,
+                    compact_global_index)
+
+A, B = "a" * 64, "b" * 64
+
+
+def index_document(doc_id, sha256, texts):
+    """Write and publish a one-page document the way the ingest paths do."""
+    writer = ShardWriter(sha256[:16])
+    metadatas = [{'source': doc_id, 'doc_id': doc_id, 'page': 0, 'chunk': i} for i in range(len(texts))]
+    writer.add(texts, HashEmbeddings().embed_documents(texts), metadatas)
+    writer.commit()
+    publish_document(f"/docs/{doc_id}", sha256, writer.name, writer.count, 1, doc_id=doc_id)
+
+
+def retired_paths():
+    return [item['path'] for item in load_manifest().get('retired', [])]
+
+
+def test_replaced_shard_stays_readable_until_its_snapshot_is_released(index_store):
+    index = registry.get('vectorstore')
+    index_document("a.pdf", A, ["apple pie recipe"])
+    with index.snapshot() as old:
+        index_document("a.pdf", B, ["banana bread recipe"])
+        assert index.select() == [B[:16]]
+        assert collect_garbage(index, grace=0) == []
+        assert index.select(snapshot=old) == [A[:16]]
+        assert index._document(A[:16], 0).page_content == "apple pie recipe"
+    assert collect_garbage(index, grace=0) == [f"shards/{A[:16]}"]
+    assert not (index_store / "shards" / A[:16]).exists()
+
+
+def test_retired_shard_is_kept_for_the_grace_period(index_store):
+    index_document("a.pdf", A, ["apple pie recipe"])
+    delete_document("a.pdf")
+    assert collect_garbage(grace=300) == []
+    assert retired_paths() == [f"shards/{A[:16]}"]
+    assert collect_garbage(grace=0) == [f"shards/{A[:16]}"]
+    assert retired_paths() == []
+
+
+def test_reindexing_retired_content_takes_its_shard_back(index_store):
+    index_document("a.pdf", A, ["apple pie recipe"])
+    delete_document("a.pdf")
+    index_document("a.pdf", A, ["apple pie recipe"])
+    assert retired_paths() == []
+    assert collect_garbage(grace=0) == []
+    assert registry.get('vectorstore').select() == [A[:16]]
+
+
+def _start_shard(name):
+    ShardWriter(name).add(["orphan"], HashEmbeddings().embed_documents(["orphan"]), [{'chunk': 0}])
+
+
+def test_temp_shards_of_dead_writers_are_swept(index_store):
+    ctx = multiprocessing.get_context('fork')
+    crashed = ctx.Process(target=_start_shard, args=("dead",))
+    crashed.start()
+    crashed.join()
+    live = ShardWriter("live")
+
+    def temp_dirs():
+        return sorted(path.name.split(".tmp-")[0] for path in (index_store / "shards").glob(".*.tmp-*"))
+    assert temp_dirs() == [".dead", ".live"]
+
+    collect_garbage(grace=0)
+    assert temp_dirs() == [".live"]
+    live.abort()
+    assert sweep_temp_shards() == []
+
+
+def _add_entries(prefix, count):
+    for i in range(count):
+        with index_write_lock:
+            manifest = load_manifest()
+            manifest['documents'][f"{prefix}{i}"] = {}
+            save_manifest(manifest)
+
+
+def test_manifest_lock_holds_across_processes(index_store):
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_add_entries, args=(f"p{n}-", 30)) for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert len(load_manifest()['documents']) == 90
+
+
+def write_pdf(path, *pages):
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+    return path
+
+
+class BrokenEmbeddings(HashEmbeddings):
+    def embed_documents(self, texts):
+        raise RuntimeError("embedder went away")
+
+
+def test_rebuild_swaps_the_new_document_set_in_at_the_end(index_store, tmp_path):
+    a = write_pdf(tmp_path / "a.pdf", "apple pie recipe")
+    b = write_pdf(tmp_path / "b.pdf", "banana bread recipe")
+    c = write_pdf(tmp_path / "c.pdf", "cherry tart recipe")
+    bulk_ingest([a, b], workers=1)
+    before = load_manifest()['documents']
+    assert sorted(before) == ["a.pdf", "b.pdf"]
+
+    # Interrupted: queries keep the complete previous index
+    registry.register('embeddings', BrokenEmbeddings)
+    registry.invalidate('embeddings')
+    with pytest.raises(RuntimeError):
+        bulk_ingest([a, c], workers=1, rebuild=True)
+    assert load_manifest()['documents'] == before
+    assert "a.pdf" in load_checkpoint()['documents']
+
+    # Resumed: swapped in at once, the unchanged shard reused and b's retired
+    registry.register('embeddings', HashEmbeddings)
+    registry.invalidate('embeddings')
+    bulk_ingest([a, c], workers=1, rebuild=True)
+    after = load_manifest()['documents']
+    assert sorted(after) == ["a.pdf", "c.pdf"]
+    assert after["a.pdf"]['shard'] == before["a.pdf"]['shard']
+    assert f"shards/{before['b.pdf']['shard']}" in retired_paths()
+    assert load_checkpoint() is None
+
+
+def test_bulk_ingest_streams_documents_in_batches(index_store, tmp_path):
+    pages = [f"page {i} about topic{i}" for i in range(12)]
+    a = write_pdf(tmp_path / "a.pdf", *pages)
+    b = write_pdf(tmp_path / "b.pdf", "banana bread recipe")
+    report = bulk_ingest([a, b], workers=2, batch_size=2)
+    assert report['failed'] == [] and report['pages'] == 13
+    index = registry.get('vectorstore')
+    entry = load_manifest()['documents']["a.pdf"]
+    assert entry['chunks'] == 12
+    assert [index._document(entry['shard'], row).page_content for row in range(12)] == pages
+
+
+def test_failed_embedding_does_not_hang_workers_on_a_full_queue(index_store, tmp_path):
+    # One chunk per page, far more than the queue holds
+    a = write_pdf(tmp_path / "a.pdf", *[f"page {i}" for i in range(40)])
+    registry.register('embeddings', BrokenEmbeddings)
+    registry.invalidate('embeddings')
+    with pytest.raises(RuntimeError):
+        bulk_ingest([a], workers=1, batch_size=1)
+
+
+def write_legacy_store(path, documents):
+    """A pre-shard store as the first create_vector_db wrote it: one FAISS store at the root."""
+    texts, metadatas = [], []
+    for source, pages in documents.items():
+        for page, text in enumerate(pages):
+            texts.append(text)
+            metadatas.append({'source': source, 'page': page})
+    FAISS.from_texts(texts, HashEmbeddings(), metadatas=metadatas).save_local(str(path))
+
+
+def test_shipped_store_is_migrated_and_its_documents_can_be_deleted(index_store):
+    for name in ("index.faiss", "index.pkl"):
+        shutil.copy(Path(__file__).parent / "vectorstoredb_faiss" / name, index_store / name)
+    shopnest = "Project_Title_ShopNest_An_E-Commerce_Application.pdf"
+
+    index = registry.get('vectorstore')
+    assert index.document_ids() == [shopnest]
+    assert load_manifest()['documents'][shopnest]['chunks'] == 6
+    assert not (index_store / "index.faiss").exists()
+
+    assert delete_document(shopnest) is not None
+    assert index.select() == []
+
+
+def test_legacy_documents_delete_and_compact_like_any_other(index_store):
+    write_legacy_store(index_store, {"C:\\docs\\x.pdf": ["xylophone lessons", "xenon lamps"],
+                                     "/srv/y.pdf": ["yellow yarn"]})
+    # A global index built before the migration, with the legacy store as a member
+    (index_store / "global" / "old").mkdir(parents=True)
+    faiss.write_index(faiss.IndexFlatL2(HashEmbeddings.dim), str(index_store / "global" / "old" / "index.faiss"))
+    with index_write_lock:
+        manifest = load_manifest()
+        manifest['global'] = {'name': "old", 'type': "flat", 'vectors': 3, 'members': [["_legacy", 3]]}
+        save_manifest(manifest)
+
+    assert sorted(migrate_legacy_store()) == ["x.pdf", "y.pdf"]
+    assert migrate_legacy_store() == []
+    manifest = load_manifest()
+    assert 'global' not in manifest and "global/old" in retired_paths()
+    index = registry.get('vectorstore')
+    assert index._document(manifest['documents']["x.pdf"]['shard'], 1).page_content == "xenon lamps"
+
+    query = HashEmbeddings().embed_query("xylophone lessons")
+    rebuild_global_index(index, force=True)
+    assert [shard for shard, _ in load_manifest()['global']['members']] == index.select()
+    assert index.search(query, 1)[0][0].page_content == "xylophone lessons"
+    delete_document("x.pdf")
+    assert [doc.page_content for doc, _ in index.search(query, 3)] == ["yellow yarn"]
+    assert compact_global_index(index, threshold=0.5) is not None
+    assert [doc.page_content for doc, _ in index.search(query, 3)] == ["yellow yarn"]
+
+
+def test_unscoped_lexical_search_uses_the_global_postings(index_store):
+    index_document("a.pdf", A, ["apple pie recipe", "apple crumble"])
+    index_document("b.pdf", B, ["banana bread recipe"])
+    index = registry.get('vectorstore')
+    rebuild_global_index(index, force=True)
+    # Published after the global index was built
+    index_document("c.pdf", "c" * 64, ["cherry pie recipe"])
+
+    with index.snapshot() as snapshot:
+        assert snapshot.global_index.lexical is not None
+        unscoped = index._lexical_hits(snapshot, "pie recipe", 10)
+        scoped = index._lexical_hits(snapshot, "pie recipe", 10, ["a.pdf", "b.pdf", "c.pdf"])
+    assert sorted(unscoped) == sorted(scoped) == [(A[:16], 0), (B[:16], 0), ("c" * 16, 0)]
+
+    delete_document("b.pdf")
+    with index.snapshot() as snapshot:
+        assert index._lexical_hits(snapshot, "banana bread", 10) == []
+
+
+def write_global_index(store, name, members):
+    """A flat global index whose row i is the vector (i, 0)."""
+    total = sum(count for _, count in members)
+    index = faiss.IndexFlatL2(2)
+    index.add(np.array([[i, 0] for i in range(total)], dtype=np.float32))
+    (store / "global" / name).mkdir(parents=True)
+    faiss.write_index(index, str(store / "global" / name / "index.faiss"))
+    return GlobalIndex({'name': name, 'members': members})
+
+
+def test_global_rows_map_back_to_their_shard_and_row(index_store):
+    # An empty member takes no rows: row 2 is c's first
+    global_index = write_global_index(index_store, "g", [["a", 2], ["b", 0], ["c", 3]])
+    assert [global_index.locate(i) for i in range(5)] == [("a", 0), ("a", 1), ("c", 0), ("c", 1), ("c", 2)]
+    # Asking for more rows than there are: faiss pads with -1, which are dropped
+    hits = global_index.search([[2.25, 0]], 10)[0]
+    assert hits == [("c", 0, 0.0625), ("c", 1, 0.5625), ("a", 1, 1.5625), ("c", 2, 3.0625), ("a", 0, 5.0625)]
+
+
+def test_fetch_k_grows_with_the_dead_rows_it_must_skip(index_store):
+    global_index = write_global_index(index_store, "g", [["a", 10], ["b", 30], ["c", 60]])
+    assert global_index.dead_vectors({"a", "b", "c"}) == 0
+    assert global_index.fetch_k(5, {"a", "b", "c"}) == 10
+    assert global_index.dead_vectors({"c"}) == 40
+    assert global_index.fetch_k(5, {"c"}) == 17          # ceil(5 * 2 * 100 / 60)
+    assert global_index.fetch_k(40, {"a"}) == 100        # never more than the index holds
+    assert global_index.fetch_k(5, set()) == 100
+
+
+def test_unscoped_search_skips_dead_rows_of_the_global_index(index_store):
+    index_document("a.pdf", A, ["apple pie", "apple pie recipe", "apple pie crust"])
+    index_document("b.pdf", B, ["banana bread"])
+    index = registry.get('vectorstore')
+    rebuild_global_index(index, force=True)
+    delete_document("a.pdf")
+    # The three nearest rows are a's, all dead: k live hits still come back
+    hits = index.search(HashEmbeddings().embed_query("apple pie"), 1)
+    assert [doc.page_content for doc, _ in hits] == ["banana bread"]
+
+
+def test_hybrid_hits_carry_their_exact_query_distance(index_store):
+    index_document("a.pdf", A, ["apple pie recipe", "zebra crossing rules"])
+    index_document("b.pdf", B, ["banana bread recipe"])
+    index = registry.get('vectorstore')
+    vector = HashEmbeddings().embed_query("zebra recipe")
+    results = index.hybrid_search("zebra recipe", vector, 3)
+    assert len(results) == 3
+    for doc, _, distance in results:
+        expected = np.sum((np.array(HashEmbeddings().embed_query(doc.page_content)) - vector) ** 2)
+        assert distance == pytest.approx(expected, abs=1e-5)
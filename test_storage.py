@@ -0,0 +1,45 @@
+import hashlib
+import io
+
+from storage import IncomingFile, receive, remove_stored
+
+
+def test_upload_is_stored_once_under_its_hash(tmp_path):
+    data = b"%PDF-1.4\n" + b"x" * 5000
+    first = receive(io.BytesIO(data), tmp_path, chunk_size=1000)
+    assert first.sha256 == hashlib.sha256(data).hexdigest()
+    assert first.size == len(data)
+    assert first.mime_type == 'application/pdf'
+    path = first.store('.pdf')
+    assert path == tmp_path / f"{first.sha256}.pdf" and path.read_bytes() == data
+
+    # The same bytes again leave the stored file as it is and no temp file behind
+    second = receive(io.BytesIO(data), tmp_path)
+    assert second.store('.pdf') == path
+    assert sorted(p.name for p in tmp_path.iterdir()) == [path.name]
+
+
+def test_unstored_upload_is_deleted_on_close(tmp_path):
+    incoming = IncomingFile(tmp_path)
+    incoming.write(b"not a pdf")
+    incoming.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_only_files_stored_in_the_upload_folder_are_removed(tmp_path):
+    uploads, archive = tmp_path / "uploads", tmp_path / "archive"
+    uploads.mkdir()
+    archive.mkdir()
+    data = b"%PDF-1.4\n" + b"y" * 100
+    sha256 = hashlib.sha256(data).hexdigest()
+    # Indexed in place by the bulk-ingest CLI, and also uploaded through the app
+    (archive / "report.pdf").write_bytes(data)
+    stored = receive(io.BytesIO(data), uploads).store('.pdf')
+
+    assert remove_stored(uploads, sha256)
+    assert not stored.exists()
+    assert (archive / "report.pdf").read_bytes() == data
+    # Nothing stored under that hash any more (or never was): nothing else is touched
+    assert not remove_stored(uploads, sha256)
+    assert not remove_stored(uploads, None)
+    assert (archive / "report.pdf").exists()
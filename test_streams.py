@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from streams import ResumableStream, StreamGoneError
+
+
+class Source:
+    def __init__(self, n, delay=0.0):
+        self.n, self.delay, self.closed = n, delay, False
+
+    def __iter__(self):
+        for i in range(self.n):
+            time.sleep(self.delay)
+            yield {'type': 'token', 'token': f"t{i} "}
+        yield {'type': 'sources', 'sources': ['doc']}
+
+    def close(self):
+        self.closed = True
+
+
+def collect(frames):
+    return [frame for frame in frames if frame is not None]
+
+
+def test_tokens_are_coalesced_and_resumable_by_event_id():
+    finished = []
+    stream = ResumableStream(Source(20, delay=0.005), threading.Event(), flush_interval=0.05,
+                             on_finish=finished.append).start()
+    frames = collect(stream.frames())
+    text = ''.join(event['token'] for _, event in frames if event['type'] == 'token')
+    assert text == ''.join(f"t{i} " for i in range(20))
+    assert len(frames) < 21
+    assert finished and finished[0].completed and finished[0].sources == ['doc']
+
+    # Resuming after the id of the first frame replays exactly the rest
+    first_id, first = frames[0]
+    rest = ''.join(event['token'] for _, event in collect(stream.frames(first_id)) if event['type'] == 'token')
+    assert first['token'] + rest == text
+
+
+def test_resume_from_an_evicted_position_is_rejected():
+    stream = ResumableStream(Source(10), threading.Event(), replay_events=4).start()
+    collect(stream.frames())
+    with pytest.raises(StreamGoneError):
+        stream.check_resume(2)
+
+
+def test_abandoned_stream_is_cancelled_after_the_grace_period():
+    cancel = threading.Event()
+    stream = ResumableStream(Source(1000, delay=0.01), cancel, grace=0.05).start()
+    frames = stream.frames()
+    next(frames)
+    frames.close()
+    assert cancel.wait(1)
+    time.sleep(0.05)
+    assert stream.finished and not stream.completed
+
+
+def test_async_frames_carry_the_same_text_and_leave_the_loop_free():
+    stream = ResumableStream(Source(20, delay=0.005), threading.Event(), flush_interval=0.02).start()
+
+    async def consume():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        frames = [frame async for frame in stream.aframes(keepalive=1)]
+        task.cancel()
+        return frames, ticks
+
+    frames, ticks = asyncio.run(consume())
+    text = ''.join(event['token'] for _, event in frames if event['type'] == 'token')
+    assert text == ''.join(f"t{i} " for i in range(20))
+    assert frames[-1][1] == {'type': 'sources', 'sources': ['doc']}
+    assert ticks > 5